@@ -0,0 +1,307 @@
+"""
+End-to-end throughput benchmark of the three services.
+
+Runs the inventory, kitchen and waitress apps in-process, connected through httpx ASGI transports, against a
+local Redis stand-in (fakeredis, Lua scripting needs the lupa package) and a generated SQLite inventory.
+Orders are placed on /place-order at a fixed arrival rate, while pollers read /consume-kitchen-order. An order's
+latency runs from the start of its placement until its OrderReady (or OrderCanceled) event is read by a poller.
+
+Every rate in --rates is run in turn against the same services. The results, including the achieved orders/sec
+and p50/p95/p99 latencies, are printed and written to --output as JSON, so runs can be compared.
+
+Usage: python -m benchmarks.end_to_end_benchmark [--rates R,R,...] [--duration S] [--recipes N] [--items N]
+       [--pollers N] [--redis-url URL] [--output FILE] [--log-level LEVEL]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+
+import aiosqlite
+import httpx
+import redis.asyncio as redis
+
+from kitchen_commons.shared.Settings import settings
+
+# The services find each other under these hosts, their requests never leave the process
+settings.inventory_service_url = "http://inventory"
+settings.kitchen_service_url = "http://kitchen"
+settings.waitress_service_url = "http://waitress"
+settings.stream_retention_enabled = False
+
+from kitchen_commons.shared.HTTPClientManager import http_client_manager
+from kitchen_commons.shared.RedisService import redis_service
+from inventory_service.Repository.CatalogSeeder import recipe_name, seed_catalog
+from inventory_service.Repository.InventoryMigrations import apply_migrations
+from inventory_service.Repository.InventoryRepository import InventoryRepository
+from inventory_service.InventoryServiceEntry import app as inventory_app
+from kitchen_service.KitchenServiceEntry import app as kitchen_app
+from waitress_service.WaitressServiceEntry import app as waitress_app
+
+
+# fakeredis answers blocking reads right away, so an idle consumer would spin and starve the event loop
+_EMPTY_READ_WAIT_SECONDS = 0.001
+_EMPTY_POLL_WAIT_SECONDS = 0.001
+
+
+def _create_fake_redis_clients() -> tuple[redis.Redis, redis.Redis]:
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("The Redis stand-in needs fakeredis and lupa (pip install fakeredis lupa), or pass --redis-url")
+
+    class BlockingFakeRedis(fakeredis.FakeAsyncRedis):
+        """Waits briefly when a blocking stream read finds nothing, as a real blocking read would."""
+
+        async def xread(self, *args, block=None, **kwargs):
+            messages = await super().xread(*args, block=block, **kwargs)
+            if not messages and block is not None:
+                await asyncio.sleep(_EMPTY_READ_WAIT_SECONDS)
+            return messages
+
+        async def xreadgroup(self, *args, block=None, **kwargs):
+            messages = await super().xreadgroup(*args, block=block, **kwargs)
+            if not messages and block is not None:
+                await asyncio.sleep(_EMPTY_READ_WAIT_SECONDS)
+            return messages
+
+    server = fakeredis.FakeServer()
+    return (BlockingFakeRedis(server=server, decode_responses=True), BlockingFakeRedis(server=server, decode_responses=False))
+
+async def _create_inventory_db(path: str, args: argparse.Namespace):
+    async with aiosqlite.connect(path) as conn:
+        await apply_migrations(conn)
+        # Stocked for far more orders than any run places, so every order can be made
+        await seed_catalog(conn, args.recipes, args.ingridients, args.ingridients_per_recipe, supply_qty=10**12, seed=args.seed)
+
+def _percentiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+
+    ordered = sorted(values)
+    def percentile(p: float) -> float:
+        # Nearest rank
+        return round(ordered[max(int(len(ordered) * p / 100 + 0.5) - 1, 0)], 3)
+
+    return {
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": round(ordered[-1], 3),
+        "mean": round(statistics.fmean(ordered), 3),
+    }
+
+
+class OrderTracker:
+    """Placement times of the orders of a run, and the time and status their kitchen event was read with."""
+
+    def __init__(self):
+        self.placed_at: dict[int, float] = {}
+        # Kitchen events read before the placement response arrived, order ID -> (read at, status)
+        self._early_completions: dict[int, tuple[float, str]] = {}
+        self.place_latencies_ms: list[float] = []
+        self.latencies_ms: list[float] = []
+        self.statuses: dict[str, int] = {}
+        self.place_errors = 0
+        self.first_placed_at = 0.0
+        self.last_completed_at = 0.0
+        self.all_completed = asyncio.Event()
+        self.placing = True
+
+    def place(self, order_id: int, placed_at: float):
+        if order_id in self._early_completions:
+            self._record(placed_at, *self._early_completions.pop(order_id))
+        else:
+            self.placed_at[order_id] = placed_at
+
+    def complete(self, order_id: int, status: str):
+        placed_at = self.placed_at.pop(order_id, None)
+        if placed_at is None:
+            # Its placement is still being answered, or it's an order of an earlier run and never claimed
+            self._early_completions[order_id] = (time.perf_counter(), status)
+            return
+
+        self._record(placed_at, time.perf_counter(), status)
+
+    def finish_placing(self):
+        self.placing = False
+        if not self.placed_at:
+            self.all_completed.set()
+
+    def _record(self, placed_at: float, completed_at: float, status: str):
+        self.last_completed_at = max(self.last_completed_at, completed_at)
+        self.latencies_ms.append((completed_at - placed_at) * 1000)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+        if not self.placing and not self.placed_at:
+            self.all_completed.set()
+
+
+async def _place_order(client: httpx.AsyncClient, tracker: OrderTracker, rng: random.Random, args: argparse.Namespace):
+    items = [{recipe_name(rng.randrange(args.recipes)): 1} for _ in range(args.items)]
+    started_at = time.perf_counter()
+
+    try:
+        response = await client.post("http://waitress/place-order", json={"table_no": rng.randint(1, 50), "items": items})
+        response.raise_for_status()
+    except httpx.HTTPError:
+        tracker.place_errors += 1
+        return
+
+    tracker.place_latencies_ms.append((time.perf_counter() - started_at) * 1000)
+    tracker.place(response.json()["order_id"], started_at)
+
+async def _poll_kitchen_orders(client: httpx.AsyncClient, get_tracker, stop: asyncio.Event):
+    # Stopped through the event, a cancellation can be swallowed inside the app's middleware stack
+    while not stop.is_set():
+        response = await client.get("http://waitress/consume-kitchen-order")
+
+        if response.status_code == httpx.codes.OK:
+            body = response.json()
+            get_tracker().complete(body["order_id"], body["status"])
+        else:
+            await asyncio.sleep(_EMPTY_POLL_WAIT_SECONDS)
+
+async def _run_rate(client: httpx.AsyncClient, tracker: OrderTracker, rate: float, args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    order_count = max(int(rate * args.duration), 1)
+    placements: set[asyncio.Task] = set()
+
+    # Open loop, orders arrive on schedule however long earlier ones take
+    tracker.first_placed_at = started_at = time.perf_counter()
+    for index in range(order_count):
+        delay = started_at + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        task = asyncio.create_task(_place_order(client, tracker, rng, args))
+        placements.add(task)
+        task.add_done_callback(placements.discard)
+
+    await asyncio.gather(*placements)
+    placing_seconds = time.perf_counter() - started_at
+    tracker.finish_placing()
+
+    if not tracker.all_completed.is_set():
+        try:
+            await asyncio.wait_for(tracker.all_completed.wait(), timeout=args.drain_timeout)
+        except TimeoutError:
+            pass
+
+    completed = len(tracker.latencies_ms)
+    elapsed = (tracker.last_completed_at or time.perf_counter()) - tracker.first_placed_at
+
+    return {
+        "target_rate": rate,
+        "orders": order_count,
+        "completed": completed,
+        "statuses": tracker.statuses,
+        "place_errors": tracker.place_errors,
+        "lost": len(tracker.placed_at),
+        "achieved_placement_rate": round(order_count / placing_seconds, 2),
+        "throughput_orders_per_second": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": _percentiles(tracker.latencies_ms),
+        "place_latency_ms": _percentiles(tracker.place_latencies_ms),
+    }
+
+async def _benchmark(args: argparse.Namespace) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="kitchen_benchmark_")
+    InventoryRepository._DB_PATH = os.path.join(work_dir, "kitchen.db")
+    await _create_inventory_db(InventoryRepository._DB_PATH, args)
+
+    if args.redis_url:
+        redis_service.use_clients(redis.Redis.from_url(args.redis_url, decode_responses=True), redis.Redis.from_url(args.redis_url, decode_responses=False))
+        await redis_service.client.flushdb()
+    else:
+        redis_service.use_clients(*_create_fake_redis_clients())
+
+    for host, app in (("inventory", inventory_app), ("kitchen", kitchen_app), ("waitress", waitress_app)):
+        http_client_manager.mount(f"all://{host}", httpx.ASGITransport(app=app))
+
+    runs: list[dict] = []
+    tracker = OrderTracker()
+
+    async with AsyncExitStack() as stack:
+        # The waitress loads the menu from the inventory service on startup
+        for app in (inventory_app, kitchen_app, waitress_app):
+            await stack.enter_async_context(app.router.lifespan_context(app))
+
+        client = await stack.enter_async_context(httpx.AsyncClient(transport=httpx.ASGITransport(app=waitress_app), timeout=args.drain_timeout))
+        stop_polling = asyncio.Event()
+        pollers = [asyncio.create_task(_poll_kitchen_orders(client, lambda: tracker, stop_polling)) for _ in range(args.pollers)]
+
+        try:
+            for rate in args.rates:
+                tracker = OrderTracker()
+                result = await _run_rate(client, tracker, rate, args)
+                runs.append(result)
+
+                latency = result["latency_ms"]
+                print(
+                    f"rate={rate:>7.1f}/s  throughput={result['throughput_orders_per_second']:>7.1f}/s  "
+                    f"completed={result['completed']}/{result['orders']}  "
+                    f"p50={latency.get('p50', 0):8.2f} ms  p95={latency.get('p95', 0):8.2f} ms  p99={latency.get('p99', 0):8.2f} ms"
+                )
+        finally:
+            stop_polling.set()
+            await asyncio.gather(*pollers, return_exceptions=True)
+
+    return {
+        "benchmark": "end_to_end",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "redis": args.redis_url or "fakeredis",
+        "config": {
+            "duration_seconds": args.duration,
+            "recipes": args.recipes,
+            "ingridients": args.ingridients,
+            "ingridients_per_recipe": args.ingridients_per_recipe,
+            "items_per_order": args.items,
+            "pollers": args.pollers,
+            "seed": args.seed,
+            "event_codec": settings.event_codec,
+            "inventory_cache_enabled": settings.inventory_cache_enabled,
+            "kitchen_use_consumer_group": settings.kitchen_use_consumer_group,
+            "kitchen_consumption_batching_enabled": settings.kitchen_consumption_batching_enabled,
+            "order_id_block_size": settings.order_id_block_size,
+        },
+        "runs": runs,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", type=lambda value: [float(rate) for rate in value.split(",")], default=[25.0, 50.0, 100.0], help="order arrival rates per second, comma separated")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds orders are placed for, per rate")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="seconds to wait for outstanding orders after placing stops")
+    parser.add_argument("--recipes", type=int, default=1000)
+    parser.add_argument("--ingridients", type=int, default=200)
+    parser.add_argument("--ingridients-per-recipe", type=int, default=5)
+    parser.add_argument("--items", type=int, default=2, help="dishes per order")
+    parser.add_argument("--pollers", type=int, default=4, help="concurrent /consume-kitchen-order pollers")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--redis-url", help="use this Redis server instead of the in-process stand-in, its database is flushed")
+    parser.add_argument("--output", help="file the JSON results are written to")
+    parser.add_argument("--log-level", default="CRITICAL", help="level of the service logs, which go to stdout")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    results = asyncio.run(_benchmark(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of the Redis stream event encodings.
+
+Compares the original field-per-key path (BaseEvent.to_redis, then json.loads and pydantic
+validation in OrderPlaced.from_redis) with the binary codec, for a round trip of an OrderPlaced
+event, and reports the encoded size of both.
+
+Usage: python -m benchmarks.event_codec_benchmark [--iterations N] [--items N]
+"""
+import argparse
+import timeit
+
+from kitchen_commons.events.Events import OrderPlaced
+from kitchen_commons.events.EventCodec import BinaryEventCodec, FieldEventCodec, decode_event_fields
+
+
+def _encoded_size(fields: dict) -> int:
+    return sum(len(str(key).encode()) + len(value if isinstance(value, bytes) else str(value).encode()) for key, value in fields.items())
+
+def _as_stream_reply(fields: dict) -> dict:
+    # Stream entries are read without decoding responses, so every key and value comes back as bytes
+    return {str(key).encode(): value if isinstance(value, bytes) else str(value).encode() for key, value in fields.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--items", type=int, default=4, help="number of dishes in the benchmarked order")
+    args = parser.parse_args()
+
+    event = OrderPlaced(
+        order_id=123456,
+        table_no=12,
+        comments="No onions, extra cheese",
+        items=[{f"dish_{index}": index + 1} for index in range(args.items)]
+    )
+
+    for codec in (FieldEventCodec(), BinaryEventCodec()):
+        fields = codec.encode(event)
+        reply = _as_stream_reply(fields)
+
+        def round_trip():
+            OrderPlaced.from_redis(decode_event_fields(_as_stream_reply(codec.encode(event))))
+
+        encode_seconds = timeit.timeit(lambda: codec.encode(event), number=args.iterations)
+        decode_seconds = timeit.timeit(lambda: OrderPlaced.from_redis(decode_event_fields(reply)), number=args.iterations)
+        round_trip_seconds = timeit.timeit(round_trip, number=args.iterations)
+
+        print(
+            f"{codec.name:<8} "
+            f"size={_encoded_size(fields):>4} B  "
+            f"encode={encode_seconds / args.iterations * 1e6:7.2f} us  "
+            f"decode={decode_seconds / args.iterations * 1e6:7.2f} us  "
+            f"round_trip={round_trip_seconds / args.iterations * 1e6:7.2f} us"
+        )
+
+if __name__ == "__main__":
+    main()
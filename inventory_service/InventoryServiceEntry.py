@@ -7,12 +7,15 @@ import os
 
 #sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi import FastAPI, status, HTTPException
+from fastapi import FastAPI, Header, Response, status, HTTPException
 from .InventoryServiceLogic import InventoryServiceLogic
-from kitchen_commons.models.InventoryServiceModel import CheckRecipeForIngredientsRequest, CheckRecipeForIngredientsResponse, ConsumeIngridientsRequest, ConsumeIngridientsResponse, ConsumeRecipeIngridientsRequest, ConsumeRecipeIngridientsResponse, Menu
-from kitchen_commons.shared.Logging import logger
+from kitchen_commons.models.InventoryServiceModel import CheckRecipeForIngredientsRequest, CheckRecipeForIngredientsResponse, ConsumeIngridientsRequest, ConsumeIngridientsResponse, ConsumeRecipeIngridientsRequest, ConsumeRecipeIngridientsResponse, ConsumeOrderIngridientsRequest, ConsumeOrderIngridientsResponse, ConsumeOrdersIngridientsRequest, ConsumeOrdersIngridientsResponse, Menu
+from kitchen_commons.shared.Logging import Lazy, logger
+from kitchen_commons.shared.Metrics import MetricsMiddleware
+from kitchen_commons.shared.Tracing import TracingMiddleware
 from kitchen_commons.shared.Lifecycle import startup_http_client, shutdown_http_client, startup_redis, shutdown_redis
 from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.HTTPCaching import etag_matches
 
 inventory_service = InventoryServiceLogic()
 
@@ -38,17 +41,19 @@ async def lifespan(app: FastAPI):
     logger.info("########################################################################")
 
 app = FastAPI(title="Kitchen inventory service", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware, service="inventory")
 
 
 @app.post("/checkRecipeForIngredients", response_model=CheckRecipeForIngredientsResponse, status_code=status.HTTP_200_OK)
 async def check_recipe_for_ingredients(request: CheckRecipeForIngredientsRequest):
     try:
 
-        logger.info("check_recipe_for_ingredients called", user_id=request.user_id, recipe_ids=request.recipe_ids)
+        logger.info("check_recipe_for_ingredients called", user_id=request.user_id, task_count=len(request.recipe_ids))
 
-        results = [await inventory_service.checkRecipeForIngridients(task) for task in request.recipe_ids]
+        results = await inventory_service.checkRecipeTasks(request.recipe_ids)
 
-        logger.info("check_recipe_for_ingredients results", user_id=request.user_id, results=results)
+        logger.info("check_recipe_for_ingredients results", user_id=request.user_id, task_count=len(results), can_make_count=Lazy(sum, (result.can_make for result in results)))
 
         return CheckRecipeForIngredientsResponse(user_id=request.user_id, results=results)
     except Exception as e:
@@ -59,32 +64,72 @@ async def check_recipe_for_ingredients(request: CheckRecipeForIngredientsRequest
 async def consume_recipe_ingredients(request: ConsumeRecipeIngridientsRequest):
     try:
 
-        logger.info("consume_recipe_ingredients called", user_id=request.user_id, tasks=request.tasks)
+        logger.info("consume_recipe_ingredients called", user_id=request.user_id, tasks=len(request.tasks))
 
         resultList = [await inventory_service.consumeRecipeIngridients(task) for task in request.tasks]
 
-        logger.info("consume_recipe_ingredients results", user_id=request.user_id, results=resultList)
+        logger.info("consume_recipe_ingredients results", user_id=request.user_id, tasks=len(resultList), consumed=Lazy(sum, (result.consumed for result in resultList)))
 
         return ConsumeRecipeIngridientsResponse(user_id=request.user_id, results=resultList)
     except Exception as e:
         logger.error("Error in consume_recipe_ingredients", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/consumeOrderIngridients", response_model=ConsumeOrderIngridientsResponse, status_code=status.HTTP_200_OK)
+async def consume_order_ingredients(request: ConsumeOrderIngridientsRequest):
+    try:
+
+        logger.info("consume_order_ingredients called", user_id=request.user_id, tasks=len(request.tasks))
+
+        response = await inventory_service.consumeOrderIngridients(request)
+
+        logger.info("consume_order_ingredients results", user_id=request.user_id, consumed=response.consumed, tasks=len(response.results))
+
+        return response
+    except Exception as e:
+        logger.error("Error in consume_order_ingredients", error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/consumeOrdersIngridients", response_model=ConsumeOrdersIngridientsResponse, status_code=status.HTTP_200_OK)
+async def consume_orders_ingredients(request: ConsumeOrdersIngridientsRequest):
+    try:
+
+        logger.info("consume_orders_ingredients called", user_id=request.user_id, orders=len(request.orders))
+
+        response = await inventory_service.consumeOrdersIngridients(request)
+
+        logger.info("consume_orders_ingredients results", user_id=request.user_id, orders=len(response.results), consumed=Lazy(sum, (result.consumed for result in response.results)))
+
+        return response
+    except Exception as e:
+        logger.error("Error in consume_orders_ingredients", error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/menu", response_model=Menu, status_code=status.HTTP_200_OK)
-async def get_menu_items():
+async def get_menu_items(if_none_match: str | None = Header(default=None)):
 
     logger.info("get_menu_items called")
 
-    menu_items = await inventory_service.get_menu_items()
+    (menu_body, etag) = await inventory_service.get_menu_response()
+
+    if etag_matches(if_none_match, etag):
+        logger.info("get_menu_items not modified", etag=etag)
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
-    logger.info("get_menu_items results", menu_items=menu_items)
+    logger.info("get_menu_items results", etag=etag, size=len(menu_body))
 
-    return menu_items
+    return Response(content=menu_body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.post("/admin/clear-menu-cache")
 async def clear_menu_cache():
-    await redis_service.client.delete(redis_service.MENU_CACHE_KEY)
-    logger.info(f"{redis_service.MENU_CACHE_KEY} has been cleared.")
+    version = await redis_service.invalidate_menu_cache()
+    logger.info(f"{redis_service.MENU_CACHE_KEY} has been cleared.", version=version)
+    return {"status" : "success", "version" : version}
+
+@app.post("/admin/invalidate-inventory-cache")
+async def invalidate_inventory_cache():
+    inventory_service.invalidate_inventory_cache()
+    logger.info("Inventory cache has been invalidated.")
     return {"status" : "success"}
 
 @app.get("/admin/cache-status", status_code=status.HTTP_200_OK)
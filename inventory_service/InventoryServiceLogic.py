@@ -1,7 +1,13 @@
+import asyncio
+import time
+from typing import List
 
-from kitchen_commons.models.InventoryServiceModel import CheckRecipeForIngredientsTask, CheckRecipeForIngredientsResult, ConsumeIngridientsTask, ConsumeIngridientsResult, ConsumeRecipeIngridientsTask, ConsumeRecipeIngridientsResult, Menu, MenuItem
+from kitchen_commons.models.InventoryServiceModel import CheckRecipeForIngredientsTask, CheckRecipeForIngredientsResult, ConsumeIngridientsTask, ConsumeIngridientsResult, ConsumeRecipeIngridientsTask, ConsumeRecipeIngridientsResult, ConsumeOrderIngridientsRequest, ConsumeOrderIngridientsResponse, ConsumeOrdersIngridientsRequest, ConsumeOrdersIngridientsResponse, Menu, MenuItem
 from .Repository.InventoryRepository import InventoryRepository
 from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Settings import settings
+from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.HTTPCaching import compute_etag
 
 
 class InventoryServiceLogic:
@@ -10,7 +16,12 @@ class InventoryServiceLogic:
     # It interacts with the InventoryRepository to check if a recipe can be made with the available ingredients
     # It provides methods to check if a recipe can be made with the available ingredients   
     def __init__(self):
-        self.inventory_repository = InventoryRepository()
+        self.inventory_repository = InventoryRepository(pool_size=settings.inventory_db_read_pool_size, use_cache=settings.inventory_cache_enabled)
+        # Serialized menu and its ETag, rebuilt when the menu version changes or the menu is older than its TTL
+        self._menu_version: int | None = None
+        self._menu_body = b""
+        self._menu_etag = ""
+        self._menu_built_at = 0.0
 
 
     async def initialize_service(self):
@@ -23,6 +34,12 @@ class InventoryServiceLogic:
         await self.inventory_repository.close_pool()
         logger.info("Inventory service shut down")
 
+    def invalidate_inventory_cache(self):
+        """Drops the in-process inventory cache, needed after recipes or supplies were edited outside of the service."""
+        self.inventory_repository.invalidate_cache()
+        # The menu is rebuilt on next use as well, and the menu version is bumped if the edits changed it
+        self._menu_built_at = 0.0
+
     # This method checks if a recipe can be made with the available ingredients
     # It takes a CheckRecipeForIngredientsTask as input and returns a CheckRecipeForIngredientsResult
     # If the recipe exists and all ingredients are available in the required quantities, it returns
@@ -32,39 +49,51 @@ class InventoryServiceLogic:
 
         logger.info("check_recipe_for_ingredients called", recipe_name=task.recipe_name, qty=task.qty)
         
-        # Check if the recipe exists in the database
-        if not await self.inventory_repository.get_recipe_ingridients_by_name(task.recipe_name):
-            
-            logger.warning("Recipe not found", recipe_name=task.recipe_name)
-            
-            return CheckRecipeForIngredientsResult(
-                id=task.id,  # Generate a unique ID for the result
-                recipe_id=task.recipe_name,  # Use the task ID as the recipe ID
-                can_make=False
-            )
-        
-        # Check if all ingredients for the recipe are available in the required quantities
-        can_make = await self.inventory_repository.check_ingridients_for_recipe(task.recipe_name, task.qty)
+        # Check if the recipe exists and all its ingredients are available in the required quantities
+        (recipe_found, can_make) = await self.inventory_repository.get_recipe_availability(task.recipe_name, task.qty)
 
-        if not can_make:
-            
-            logger.warning("Insufficient ingredients for recipe", recipe_name=task.recipe_name, qty=task.qty)
+        return self._build_check_result(task, recipe_found, can_make)
 
-            return CheckRecipeForIngredientsResult(
-                id=task.id,  # Generate a unique ID for the result
-                recipe_id=task.recipe_name,  # Use the task ID as the recipe ID
-                can_make=False
-            )
+    # This method checks every task of a request, results come back in request order
+    # Large requests go through the batched repository path, smaller ones are checked concurrently
+    # with at most as many checks in flight as the connection pool has connections
+    async def checkRecipeTasks(self, tasks: List[CheckRecipeForIngredientsTask]) -> List[CheckRecipeForIngredientsResult]:
 
-        logger.info("Recipe can be made", recipe_name=task.recipe_name)
+        if len(tasks) >= settings.inventory_bulk_check_threshold:
+            return await self.checkRecipesForIngridients(tasks)
 
-        # If all checks pass, return a result indicating the recipe can be made
-        return CheckRecipeForIngredientsResult(
-            id = task.id,  # Generate a unique ID for the result
-            recipe_id=task.recipe_name,  # Use the task ID as the recipe ID
-            can_make=True
-        )  # Assume we can always make the recipe for now
+        semaphore = asyncio.Semaphore(self.inventory_repository.pool_size)
+
+        async def check(task: CheckRecipeForIngredientsTask) -> CheckRecipeForIngredientsResult:
+            async with semaphore:
+                return await self.checkRecipeForIngridients(task)
+
+        return list(await asyncio.gather(*(check(task) for task in tasks)))
+
+    # This method checks a list of recipes in one database round trip
+    # Every task is checked on its own against the current supplies
+    async def checkRecipesForIngridients(self, tasks: List[CheckRecipeForIngredientsTask]) -> List[CheckRecipeForIngredientsResult]:
+
+        logger.info("check_recipes_for_ingredients called", task_count=len(tasks))
 
+        availability = await self.inventory_repository.get_recipes_availability([(task.recipe_name, task.qty) for task in tasks])
+
+        return [self._build_check_result(task, recipe_found, can_make) for task, (recipe_found, can_make) in zip(tasks, availability)]
+
+    def _build_check_result(self, task: CheckRecipeForIngredientsTask, recipe_found: bool, can_make: bool) -> CheckRecipeForIngredientsResult:
+
+        if not recipe_found:
+            logger.warning("Recipe not found", recipe_name=task.recipe_name)
+        elif not can_make:
+            logger.warning("Insufficient ingredients for recipe", recipe_name=task.recipe_name, qty=task.qty)
+        else:
+            logger.info("Recipe can be made", recipe_name=task.recipe_name)
+
+        return CheckRecipeForIngredientsResult(
+            id=task.id,
+            recipe_id=task.recipe_name,  # Use the recipe name as the recipe ID
+            can_make=can_make
+        )
 
 
     async def consumeRecipeIngridients(self, task: ConsumeRecipeIngridientsTask) -> ConsumeRecipeIngridientsResult:
@@ -83,15 +112,81 @@ class InventoryServiceLogic:
             comments=comments
         )
     
+    # This method consumes the ingredients for every recipe of an order in a single transaction
+    # If any recipe cannot be made, nothing is consumed and every result is marked as not consumed
+    async def consumeOrderIngridients(self, request: ConsumeOrderIngridientsRequest) -> ConsumeOrderIngridientsResponse:
+
+        logger.info("consume_order_ingredients called", user_id=request.user_id, tasks=len(request.tasks))
+
+        consumption = await self.inventory_repository.consume_order_ingridients([(task.recipe_name, task.qty) for task in request.tasks])
+
+        response = self._build_order_response(request, consumption)
+
+        logger.info("consume_order_ingredients result", user_id=request.user_id, tasks=len(request.tasks), consumed=response.consumed)
+
+        return response
+
+    # This method consumes the ingredients of several orders in a single transaction, in request order
+    # Every order is still consumed completely or not at all on its own
+    async def consumeOrdersIngridients(self, request: ConsumeOrdersIngridientsRequest) -> ConsumeOrdersIngridientsResponse:
+
+        logger.info("consume_orders_ingredients called", user_id=request.user_id, orders=len(request.orders))
+
+        consumption = await self.inventory_repository.consume_orders_ingridients([[(task.recipe_name, task.qty) for task in order.tasks] for order in request.orders])
+
+        results = [self._build_order_response(order, order_consumption) for order, order_consumption in zip(request.orders, consumption)]
+
+        logger.info("consume_orders_ingredients result", user_id=request.user_id, orders=len(request.orders), consumed=sum(result.consumed for result in results))
+
+        return ConsumeOrdersIngridientsResponse(user_id=request.user_id, results=results)
+
+    def _build_order_response(self, request: ConsumeOrderIngridientsRequest, consumption: List[tuple[bool, str]]) -> ConsumeOrderIngridientsResponse:
+
+        results = [
+            ConsumeRecipeIngridientsResult(
+                id=task.id,
+                recipe_name=task.recipe_name,
+                consumed=consumed,
+                comments=comments
+            )
+            for task, (consumed, comments) in zip(request.tasks, consumption)
+        ]
+
+        consumed = bool(results) and all(result.consumed for result in results)
+
+        return ConsumeOrderIngridientsResponse(user_id=request.user_id, consumed=consumed, results=results)
+    
     async def get_menu_items(self) -> Menu:
 
         logger.info("get_menu_items called")
 
         menu_result = await self.inventory_repository.get_menu_items()
 
-        logger.info("get_menu_items result", menu_items=menu_result)
+        logger.info("get_menu_items result", item_count=len(menu_result))
 
         menu = Menu(items=[MenuItem(name=item.get("name"), description=item.get("description")) for item in menu_result]) # type: ignore
 
         return menu
 
+    # This method returns the serialized menu and its ETag
+    # Both are computed once per menu version, the version is bumped whenever the menu cache is cleared
+    # They are also recomputed once older than the menu TTL, to pick up edits made outside of the service
+    async def get_menu_response(self) -> tuple[bytes, str]:
+
+        version = await redis_service.get_menu_version()
+
+        if version != self._menu_version or time.monotonic() - self._menu_built_at >= settings.inventory_menu_ttl_seconds:
+            menu = await self.get_menu_items()
+            menu_body = menu.model_dump_json().encode()
+            menu_etag = compute_etag(menu_body)
+
+            if version == self._menu_version and menu_etag != self._menu_etag:
+                # The menu changed without a version bump, so the menu caches of the waitress services are stale too
+                version = await redis_service.invalidate_menu_cache()
+
+            (self._menu_body, self._menu_etag, self._menu_version) = (menu_body, menu_etag, version)
+            self._menu_built_at = time.monotonic()
+
+            logger.info("Menu response built", version=version, etag=self._menu_etag)
+
+        return (self._menu_body, self._menu_etag)
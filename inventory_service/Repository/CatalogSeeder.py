@@ -0,0 +1,56 @@
+import aiosqlite
+import random
+
+from kitchen_commons.shared.Logging import logger
+
+
+def recipe_name(index: int) -> str:
+    return f"recipe_{index:06d}"
+
+def ingridient_name(index: int) -> str:
+    return f"ingridient_{index:06d}"
+
+async def seed_catalog(conn: aiosqlite.Connection, recipe_count: int, ingridient_count: int, ingridients_per_recipe: int = 5, supply_qty: int = 1_000_000, seed: int = 42, replace: bool = True):
+    """
+    Asynchronously fills a migrated inventory database with a synthetic catalog in a single transaction.
+    Every recipe gets ingridients_per_recipe distinct ingredients picked at random, every ingredient is stocked with supply_qty.
+    The same seed always produces the same catalog. With replace, the existing catalog is deleted first.
+    """
+    ingridients_per_recipe = min(ingridients_per_recipe, ingridient_count)
+    rng = random.Random(seed)
+
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        if replace:
+            for table in ("recipeingridient", "recipes", "supplies"):
+                await conn.execute(f"DELETE FROM {table}")
+        else:
+            # Recipes seeded before are regenerated, not given a second set of ingredients
+            await conn.executemany("DELETE FROM recipeingridient WHERE recipe = ?", ((recipe_name(index),) for index in range(recipe_count)))
+
+        await conn.executemany(
+            "INSERT OR REPLACE INTO supplies (name, qty) VALUES (?, ?)",
+            ((ingridient_name(index), supply_qty) for index in range(ingridient_count))
+        )
+        await conn.executemany(
+            "INSERT OR REPLACE INTO recipes (name, description) VALUES (?, ?)",
+            ((recipe_name(index), f"Synthetic recipe {index}") for index in range(recipe_count))
+        )
+        await conn.executemany(
+            "INSERT INTO recipeingridient (recipe, name, requiredQty) VALUES (?, ?, ?)",
+            (
+                (recipe_name(index), ingridient_name(ingridient_index), rng.randint(1, 5))
+                for index in range(recipe_count)
+                for ingridient_index in rng.sample(range(ingridient_count), ingridients_per_recipe)
+            )
+        )
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        raise
+
+    # Fresh statistics, so the query planner sees the catalog as it is now
+    await conn.execute("ANALYZE")
+    await conn.commit()
+
+    logger.info("Synthetic catalog seeded", recipes=recipe_count, ingridients=ingridient_count, ingridients_per_recipe=ingridients_per_recipe)
@@ -0,0 +1,71 @@
+import aiosqlite
+from typing import Dict, List
+
+from kitchen_commons.shared.Logging import logger
+
+class InventoryCache:
+    """
+    In-process copy of the recipe ingredients and supply levels.
+    Supplies only change through this service, so the repository keeps the cache up to date
+    by writing consumed quantities through after every commit. Edits made to the database
+    outside of the service have to be followed by an invalidation.
+    """
+
+    def __init__(self):
+        self._recipe_ingridients: Dict[str, List[tuple[str, int]]] = {}
+        self._supplies: Dict[str, int] = {}
+        self.loaded = False
+
+    async def load(self, conn: aiosqlite.Connection):
+        """Asynchronously (re)loads the recipe index and the supply levels using an existing connection."""
+        recipe_ingridients: Dict[str, List[tuple[str, int]]] = {}
+
+        async with conn.execute("SELECT recipe, name, requiredQty FROM recipeingridient") as cursor:
+            for (recipe_name, ingridient_name, required_qty) in await cursor.fetchall():
+                recipe_ingridients.setdefault(recipe_name, []).append((ingridient_name, required_qty))
+
+        async with conn.execute("SELECT name, qty FROM supplies") as cursor:
+            supplies = {ingridient_name: qty for (ingridient_name, qty) in await cursor.fetchall()}
+
+        self._recipe_ingridients = recipe_ingridients
+        self._supplies = supplies
+        self.loaded = True
+
+        logger.info("Inventory cache loaded", recipe_count=len(recipe_ingridients), supply_count=len(supplies))
+
+    def invalidate(self):
+        """Drops the cached data, it is loaded again on next use."""
+        self._recipe_ingridients = {}
+        self._supplies = {}
+        self.loaded = False
+
+        logger.info("Inventory cache invalidated")
+
+    def get_ingridients_for_recipes(self, recipe_names: List[str]) -> Dict[str, List[tuple[str, int]]]:
+        """Returns the (ingredient name, required qty) pairs of the known recipes among recipe_names."""
+        return {recipe_name: self._recipe_ingridients[recipe_name] for recipe_name in recipe_names if recipe_name in self._recipe_ingridients}
+
+    def get_recipe_availability(self, recipe_name: str, qty: int = 1) -> tuple[bool, bool]:
+        """Returns a (recipe_found, can_make) tuple based on the cached supply levels."""
+        recipe_ingridients = self._recipe_ingridients.get(recipe_name)
+
+        if not recipe_ingridients:
+            return (False, False)
+
+        can_make = all(self._supplies.get(ingridient_name, 0) >= required_qty * qty for ingridient_name, required_qty in recipe_ingridients)
+        return (True, can_make)
+
+    def apply_consumption(self, demand: Dict[str, int]):
+        """Writes committed consumption through to the cached supply levels."""
+        if not self.loaded:
+            return
+
+        for ingridient_name, qty in demand.items():
+            self._supplies[ingridient_name] = self._supplies.get(ingridient_name, 0) - qty
+
+    def set_supply_levels(self, levels: Dict[str, int]):
+        """Overwrites cached supply levels with values read from the database."""
+        if not self.loaded:
+            return
+
+        self._supplies.update(levels)
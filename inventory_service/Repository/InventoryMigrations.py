@@ -0,0 +1,78 @@
+import aiosqlite
+from typing import List
+
+from kitchen_commons.shared.Logging import logger
+
+
+# Versioned schema migrations of the inventory database, applied in order. The version reached is stored in
+# PRAGMA user_version, so every migration runs once per database. Statements are idempotent, so databases that
+# were created by hand before migrations existed are brought up to date as well. Never edit a released migration, add a new one.
+MIGRATIONS: List[tuple[int, str, List[str]]] = [
+    (1, "Create the recipes, recipe ingredients and supplies tables", [
+        """
+        CREATE TABLE IF NOT EXISTS recipes (
+            name TEXT PRIMARY KEY,
+            description TEXT NOT NULL DEFAULT ''
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS recipeingridient (
+            recipe TEXT NOT NULL,
+            name TEXT NOT NULL,
+            requiredQty INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS supplies (
+            name TEXT PRIMARY KEY,
+            qty INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+    (2, "Add covering indexes for the recipe availability, ingredient and supply lookups", [
+        # Serves WHERE recipe = ? / recipe IN (...) and the availability joins without reading the table
+        "CREATE INDEX IF NOT EXISTS idx_recipeingridient_recipe ON recipeingridient (recipe, name, requiredQty)",
+        # Serves the qty lookups by name without reading the table, the primary key index only holds the name
+        "CREATE INDEX IF NOT EXISTS idx_supplies_name_qty ON supplies (name, qty)",
+        "ANALYZE",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    """Asynchronously gets the schema version of the database, 0 for a new one."""
+    async with conn.execute("PRAGMA user_version") as cursor:
+        (version,) = await cursor.fetchone() # type: ignore
+        return version
+
+async def apply_migrations(conn: aiosqlite.Connection) -> int:
+    """
+    Asynchronously brings the database schema up to date. Every migration is applied in its own transaction together
+    with its version bump, so a failed migration leaves the database at the previous version.
+    Returns the schema version reached.
+    """
+    version = await get_schema_version(conn)
+
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than the latest known version {SCHEMA_VERSION}")
+
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute(f"PRAGMA user_version = {migration_version}")
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+        logger.info("Database migration applied", version=migration_version, description=description)
+        version = migration_version
+
+    return version
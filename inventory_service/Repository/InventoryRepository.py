@@ -1,38 +1,140 @@
 import aiosqlite
 import asyncio
+import time
 from typing import Any, Dict, List
 
 from fastapi.concurrency import asynccontextmanager
 from fastapi import HTTPException as HttpException
 from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Metrics import metrics
+from kitchen_commons.shared.Settings import settings
+from .InventoryCache import InventoryCache
+from .InventoryMigrations import SCHEMA_VERSION, apply_migrations, get_schema_version
 import os
 import sys
 from pathlib import Path
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+_pool_wait = metrics.histogram("db_pool_wait_seconds", "Time spent waiting for a database connection", ("pool",))
+_pool_connections = metrics.gauge("db_pool_connections", "Database connections of a pool", ("pool",))
+_pool_connections_in_use = metrics.gauge("db_pool_connections_in_use", "Database connections of a pool that are handed out", ("pool",))
+
 class InventoryRepository:
 
     _BASE_DIR = Path(__file__).resolve().parent
     _DB_PATH = os.path.join(_BASE_DIR, 'kitchen.db')
+
+    # Number of (recipe, qty) pairs checked per statement, 3 bound parameters each
+    _MAX_BULK_CHECK_SIZE = 300
+
+    # Counts the recipe's ingredients and how many of them are in stock for the requested quantity.
+    # A recipe can be made when it has ingredients and all of them are in stock.
+    _RECIPE_AVAILABILITY_QUERY = """
+        SELECT COUNT(ri.name) AS ingridient_count,
+               COALESCE(SUM(s.qty >= ri.requiredQty * ?), 0) AS available_count
+        FROM recipeingridient ri
+        LEFT JOIN supplies s ON s.name = ri.name
+        WHERE ri.recipe = ?
+    """
+
+    _RECIPES_AVAILABILITY_QUERY = """
+        WITH requested(position, recipe, qty) AS (VALUES {values})
+        SELECT r.position,
+               COUNT(ri.name) AS ingridient_count,
+               COALESCE(SUM(s.qty >= ri.requiredQty * r.qty), 0) AS available_count
+        FROM requested r
+        LEFT JOIN recipeingridient ri ON ri.recipe = r.recipe
+        LEFT JOIN supplies s ON s.name = ri.name
+        GROUP BY r.position
+        ORDER BY r.position
+    """
     
-    def __init__(self, pool_size: int = 10):
+    def __init__(self, pool_size: int = 10, use_cache: bool = True):
+        # Many read-only connections, plus a single connection that serializes every write
         self._pool : asyncio.Queue[aiosqlite.Connection] = asyncio.Queue(maxsize=pool_size)
         self._pool_size = pool_size
+        self._writer : aiosqlite.Connection | None = None
+        self._writer_lock = asyncio.Lock()
         self._closed = False
+        self._cache : InventoryCache | None = InventoryCache() if use_cache else None
+        self._cache_lock = asyncio.Lock()
+
+    @property
+    def pool_size(self) -> int:
+        return self._pool_size
 
     async def initialize_pool(self):
 
-        """Verify database exists and is accessible."""
-        if not os.path.exists(self._DB_PATH):
+        """Verify database exists and is accessible, unless it may be created."""
+        if not settings.inventory_db_auto_migrate and not os.path.exists(self._DB_PATH):
             raise FileNotFoundError(f"Database not found: {self._DB_PATH}")
-        
-        """Asynchronously initializes the database connection pool."""
+
+        """Asynchronously initializes the writer connection and the reader connection pool."""
+        # The journal mode is stored in the database file, so it is set once on the writer before any reader opens it
+        self._writer = await self._connect()
+        async with self._writer.execute(f"PRAGMA journal_mode = {settings.inventory_db_journal_mode}") as cursor:
+            (journal_mode,) = await cursor.fetchone() # type: ignore
+
+        if settings.inventory_db_auto_migrate:
+            schema_version = await apply_migrations(self._writer)
+        else:
+            schema_version = await get_schema_version(self._writer)
+            if schema_version < SCHEMA_VERSION:
+                logger.warning("Database schema is out of date, run the inventory migrations", schema_version=schema_version, latest_version=SCHEMA_VERSION)
+
         for _ in range(self._pool_size):
-            conn = await aiosqlite.connect(self._DB_PATH)
+            # Autocommit, so a reader never holds a transaction open and keeps seeing an old WAL snapshot
+            conn = await self._connect(isolation_level=None)
+            await conn.execute("PRAGMA query_only = ON")
             await self._pool.put(conn)
 
-        logger.info("Database connection pool initialized")
+        metrics.register_collector(self._collect_metrics)
+
+        logger.info("Database connection pool initialized", journal_mode=journal_mode, schema_version=schema_version, readers=self._pool_size)
+
+        await self.reload_cache()
+
+    async def _connect(self, isolation_level: str | None = "") -> aiosqlite.Connection:
+        """Asynchronously opens a connection to the database with the tuned pragmas applied."""
+        conn = await aiosqlite.connect(self._DB_PATH, isolation_level=isolation_level)
+        await conn.execute(f"PRAGMA busy_timeout = {settings.inventory_db_busy_timeout_ms}")
+        await conn.execute(f"PRAGMA synchronous = {settings.inventory_db_synchronous}")
+        # A negative cache size is in KiB rather than pages
+        await conn.execute(f"PRAGMA cache_size = -{settings.inventory_db_cache_size_kib}")
+        await conn.execute(f"PRAGMA mmap_size = {settings.inventory_db_mmap_size_bytes}")
+        return conn
+
+    async def reload_cache(self):
+        """Asynchronously reloads the in-process inventory cache from the database."""
+        if self._cache is None:
+            return
+
+        async with self._cache_lock:
+            await self._load_cache(self._cache)
+
+    async def _load_cache(self, cache: InventoryCache):
+        # Loading on the writer connection keeps consumptions from committing, and from updating the cache,
+        # between reading the snapshot and swapping it in
+        async with self.get_write_connection() as conn:
+            await cache.load(conn)
+
+    def invalidate_cache(self):
+        """Drops the in-process inventory cache after out-of-band database edits, it is reloaded on next use."""
+        if self._cache is not None:
+            self._cache.invalidate()
+
+    async def _get_loaded_cache(self) -> InventoryCache | None:
+        """Returns the inventory cache, loading it first if it was invalidated, or None if caching is disabled."""
+        if self._cache is None:
+            return None
+
+        if not self._cache.loaded:
+            async with self._cache_lock:
+                if not self._cache.loaded:
+                    await self._load_cache(self._cache)
+
+        return self._cache
 
     def get_connection(self):
         """Asynchronously gets a connection to the SQLite database."""
@@ -46,12 +148,16 @@ class InventoryRepository:
         if self._closed:
             raise Exception("Database connection pool is closed.")
         
+        started_at = time.perf_counter()
+
         try:
 
             """Asynchronously gets a connection from the pool."""
             conn = await asyncio.wait_for(self._pool.get(), timeout=5.0)
         except TimeoutError:
             raise HttpException(503, "Timeout while waiting for a database connection.")
+        finally:
+            _pool_wait.observe(time.perf_counter() - started_at, "read")
 
         try:
             yield conn
@@ -59,13 +165,47 @@ class InventoryRepository:
             if not self._closed:
                 await self._pool.put(conn)
 
+    @asynccontextmanager
+    async def get_write_connection(self) -> aiosqlite.Connection:
+        """Asynchronously gets the writer connection, writes wait for each other here rather than on the database lock."""
+        if self._closed or self._writer is None:
+            raise Exception("Database writer connection is not available.")
+
+        started_at = time.perf_counter()
+
+        try:
+            await asyncio.wait_for(self._writer_lock.acquire(), timeout=5.0)
+        except TimeoutError:
+            raise HttpException(503, "Timeout while waiting for the database writer connection.")
+        finally:
+            _pool_wait.observe(time.perf_counter() - started_at, "write")
+
+        try:
+            yield self._writer
+        finally:
+            self._writer_lock.release()
+
+    def _collect_metrics(self):
+        _pool_connections.set(self._pool_size, "read")
+        _pool_connections_in_use.set(self._pool_size - self._pool.qsize(), "read")
+        _pool_connections.set(1, "write")
+        _pool_connections_in_use.set(int(self._writer_lock.locked()), "write")
+
     async def close_pool(self):
-        """Asynchronously closes the database connection pool."""
+        """Asynchronously closes the database connection pool and the writer connection."""
+        metrics.unregister_collector(self._collect_metrics)
+
         for _ in range(self._pool_size):
             conn = await self._pool.get()
             await conn.close()
             logger.info("Database connection closed")
 
+        if self._writer is not None:
+            async with self._writer_lock:
+                await self._writer.close()
+                self._writer = None
+            logger.info("Database writer connection closed")
+
     async def get_menu_items(self) -> List[Dict[str, str]]:
         """Asynchronously gets all menu items from the recipes table."""
         async with self.get_connection() as conn:
@@ -75,25 +215,52 @@ class InventoryRepository:
 
                 logger.info("Menu items fetched from database", item_count=len(rows))
 
-                result = [dict(row) for row in rows]
-
-                logger.info("Menu items formatted", result=result)
-
-                return result
+                return [dict(row) for row in rows]
 
     async def check_ingridients_for_recipe(self, recipe_name: str, qty: int = 1) -> bool:
         """Asynchronously checks if all ingredients for a recipe are available."""
-        recipe_ingridients = await self.get_recipe_ingridients_by_name(recipe_name)
+        (_, can_make) = await self.get_recipe_availability(recipe_name, qty)
+        return can_make
 
-        if not recipe_ingridients:
-            return False
+    async def get_recipe_availability(self, recipe_name: str, qty: int = 1) -> tuple[bool, bool]:
+        """
+        Asynchronously checks a recipe against the supplies in a single statement.
+        Returns a (recipe_found, can_make) tuple.
+        """
+        cache = await self._get_loaded_cache()
 
-        for ingridient in recipe_ingridients:
-            required_qty = ingridient['requiredQty'] * qty
-            if not await self.check_ingridient_availability(ingridient['name'], required_qty):
-                return False
+        if cache is not None:
+            return cache.get_recipe_availability(recipe_name, qty)
+
+        async with self.get_connection() as conn:
+            async with conn.execute(self._RECIPE_AVAILABILITY_QUERY, (qty, recipe_name)) as cursor:
+                (ingridient_count, available_count) = await cursor.fetchone() # type: ignore
+                return (ingridient_count > 0, ingridient_count > 0 and available_count == ingridient_count)
+
+    async def get_recipes_availability(self, recipes: List[tuple[str, int]]) -> List[tuple[bool, bool]]:
+        """
+        Asynchronously checks a list of (recipe_name, qty) pairs against the supplies.
+        Every pair is checked on its own, the quantities are not summed up across pairs.
+        Returns a (recipe_found, can_make) tuple per pair, in request order.
+        """
+        cache = await self._get_loaded_cache()
+
+        if cache is not None:
+            return [cache.get_recipe_availability(recipe_name, qty) for recipe_name, qty in recipes]
+
+        results: List[tuple[bool, bool]] = []
+
+        async with self.get_connection() as conn:
+            for start in range(0, len(recipes), self._MAX_BULK_CHECK_SIZE):
+                chunk = recipes[start:start + self._MAX_BULK_CHECK_SIZE]
+                query = self._RECIPES_AVAILABILITY_QUERY.format(values=", ".join(["(?, ?, ?)"] * len(chunk)))
+                params = [param for position, (recipe_name, qty) in enumerate(chunk) for param in (position, recipe_name, qty)]
+
+                async with conn.execute(query, params) as cursor:
+                    rows = await cursor.fetchall()
+                    results.extend((ingridient_count > 0, ingridient_count > 0 and available_count == ingridient_count) for (_, ingridient_count, available_count) in rows)
 
-        return True
+        return results
 
     async def get_recipe_ingridients_by_name(self, recipe_name: str) -> List[Dict[str, Any]]:
         """Asynchronously gets the ingredients for a specific recipe by its name."""
@@ -125,34 +292,127 @@ class InventoryRepository:
         Asynchronously consumes all ingredients for a recipe in a single database transaction.
         If any ingredient consumption fails, the entire transaction is rolled back.
         """
+        return (await self.consume_order_ingridients([(recipe_name, qty)]))[0]
 
-        async with self.get_connection() as conn:
-            # Start a transaction
-            await conn.execute("BEGIN")
+    async def consume_order_ingridients(self, recipes: List[tuple[str, int]]) -> List[tuple[bool, str]]:
+        """
+        Asynchronously consumes the ingredients of every (recipe_name, qty) pair of an order in a single
+        database transaction, so either every recipe is consumed or none of them is.
+        Returns a (consumed, comments) tuple per pair, in request order.
+        """
+        return (await self.consume_orders_ingridients([recipes]))[0]
+
+    async def consume_orders_ingridients(self, orders: List[List[tuple[str, int]]]) -> List[List[tuple[bool, str]]]:
+        """
+        Asynchronously consumes the ingredients of several orders, one after the other, in a single database transaction.
+        Every order is all or nothing on its own: its demand is summed up per ingredient and applied with one batch
+        of conditional updates inside a savepoint, which is rolled back when any ingredient is short.
+        Returns, per order, a (consumed, comments) tuple per (recipe_name, qty) pair, in request order.
+        """
+        results: List[List[tuple[bool, str]]] = [[] for _ in orders]
+        recipe_names = sorted({recipe_name for recipes in orders for recipe_name, _ in recipes})
+
+        if not recipe_names:
+            return results
+
+        cache = await self._get_loaded_cache()
+        # Consumed demand and corrected supply levels, replayed on the cache in order once committed
+        cache_updates: List[tuple[str, Dict[str, int]]] = []
+
+        async with self.get_write_connection() as conn:
+
+            if cache is not None:
+                recipe_ingridients = cache.get_ingridients_for_recipes(recipe_names)
+            else:
+                recipe_ingridients = await self._get_ingridients_for_recipes(conn, recipe_names)
+
+            # Take the write lock up front, a deferred transaction could fail with SQLITE_BUSY when upgrading to write
+            await conn.execute("BEGIN IMMEDIATE")
+
+            try:
+                for index, recipes in enumerate(orders):
+                    if not recipes:
+                        continue
+
+                    missing_recipes = [recipe_name for recipe_name, _ in recipes if recipe_name not in recipe_ingridients]
+
+                    if missing_recipes:
+                        logger.warning("Recipe not found when trying to consume ingredients", recipe_names=missing_recipes)
+                        results[index] = [(False, "Recipe not found" if recipe_name in missing_recipes else "Order not consumed: recipe not found for another dish") for recipe_name, _ in recipes]
+                        continue
+
+                    demand: Dict[str, int] = {}
+                    for recipe_name, qty in recipes:
+                        for ingridient_name, required_qty in recipe_ingridients[recipe_name]:
+                            demand[ingridient_name] = demand.get(ingridient_name, 0) + required_qty * qty
+
+                    await conn.execute("SAVEPOINT order_consumption")
+
+                    # Every update only applies if enough is in stock, so a short ingredient shows up as a missing row
+                    cursor = await conn.executemany(
+                        "UPDATE supplies SET qty = qty - ? WHERE name = ? AND qty >= ?",
+                        [(required_qty, ingridient_name, required_qty) for ingridient_name, required_qty in demand.items()]
+                    )
+
+                    if cursor.rowcount == len(demand):
+                        await conn.execute("RELEASE order_consumption")
+                        cache_updates.append(("consumed", demand))
+                        results[index] = [(True, "Ingredients consumed successfully")] * len(recipes)
+                        continue
+
+                    # Only this order is undone, the orders before it stay consumed
+                    await conn.execute("ROLLBACK TO order_consumption")
+                    await conn.execute("RELEASE order_consumption")
+
+                    shortages = await self._get_ingridient_shortages(conn, demand)
+                    # The database is the source of truth, so a failed update corrects the cached levels
+                    cache_updates.append(("levels", shortages))
+
+                    logger.warning("Insufficient ingredient quantity when trying to consume", shortages=shortages)
+                    results[index] = self._get_shortage_results(recipes, recipe_ingridients, shortages)
+
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+            # Still holding the writer, so a cache load can't read the committed levels and then get them applied twice
+            if cache is not None:
+                for kind, levels in cache_updates:
+                    if kind == "consumed":
+                        cache.apply_consumption(levels)
+                    else:
+                        cache.set_supply_levels(levels)
+
+        return results
+
+    def _get_shortage_results(self, recipes: List[tuple[str, int]], recipe_ingridients: Dict[str, List[tuple[str, int]]], shortages: Dict[str, int]) -> List[tuple[bool, str]]:
+        results: List[tuple[bool, str]] = []
+        for recipe_name, _ in recipes:
+            short_ingridient = next((ingridient_name for ingridient_name, _ in recipe_ingridients[recipe_name] if ingridient_name in shortages), None)
+            if short_ingridient:
+                results.append((False, f"Insufficient quantity for ingredient: {short_ingridient}"))
+            else:
+                results.append((False, "Order not consumed: insufficient ingredients for another dish"))
 
-            recipe_ingridients = await self.get_recipe_ingridients_by_name(recipe_name)
+        return results
 
-            if not recipe_ingridients:
-                logger.warning("Recipe not found when trying to consume ingredients", recipe_name=recipe_name)
-                return (False, "Recipe not found")
+    async def _get_ingridients_for_recipes(self, conn: aiosqlite.Connection, recipe_names: List[str]) -> Dict[str, List[tuple[str, int]]]:
+        """Asynchronously gets the (ingredient name, required qty) pairs of several recipes using an existing connection."""
+        placeholders = ", ".join(["?"] * len(recipe_names))
+        recipe_ingridients: Dict[str, List[tuple[str, int]]] = {}
 
-            for ingredient in recipe_ingridients:
+        async with conn.execute(f"SELECT recipe, name, requiredQty FROM recipeingridient WHERE recipe IN ({placeholders})", recipe_names) as cursor:
+            for (recipe_name, ingridient_name, required_qty) in await cursor.fetchall():
+                recipe_ingridients.setdefault(recipe_name, []).append((ingridient_name, required_qty))
 
-                # SELECTING FOR AN UPDATE LOCKS THE TABLE
-                cursor = await conn.execute("SELECT qty FROM supplies WHERE name = ?", (ingredient['name'],))
-                
-                current_qty_row = (await cursor.fetchone())[0]
-                required_qty = ingredient['requiredQty'] * qty
+        return recipe_ingridients
 
-                if current_qty_row < required_qty:
-                    # Not enough quantity, roll back and return False
-                    await conn.rollback()
-                    logger.warning("Insufficient ingredient quantity when trying to consume", recipe_name=recipe_name, ingredient=ingredient['name'], required_qty=required_qty, available_qty=current_qty_row)
-                    return (False, f"Insufficient quantity for ingredient: {ingredient['name']}")
+    async def _get_ingridient_shortages(self, conn: aiosqlite.Connection, demand: Dict[str, int]) -> Dict[str, int]:
+        """Asynchronously gets the available qty of every ingredient whose stock does not cover the demand."""
+        placeholders = ", ".join(["?"] * len(demand))
 
-            for ingredient in recipe_ingridients:
-                await self.consume_ingridient(conn, ingredient['name'], required_qty)
+        async with conn.execute(f"SELECT name, qty FROM supplies WHERE name IN ({placeholders})", list(demand)) as cursor:
+            available = {ingridient_name: qty for (ingridient_name, qty) in await cursor.fetchall()}
 
-            # If all ingredients are consumed successfully, commit the transaction
-            await conn.commit()
-            return (True, "Ingredients consumed successfully")
\ No newline at end of file
+        return {ingridient_name: available.get(ingridient_name, 0) for ingridient_name, required_qty in demand.items() if available.get(ingridient_name, 0) < required_qty}
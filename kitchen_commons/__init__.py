@@ -22,6 +22,10 @@ from kitchen_commons.models.InventoryServiceModel import (
     ConsumeRecipeIngridientsRequest,
     ConsumeRecipeIngridientsResult,
     ConsumeRecipeIngridientsResponse,
+    ConsumeOrderIngridientsRequest,
+    ConsumeOrderIngridientsResponse,
+    ConsumeOrdersIngridientsRequest,
+    ConsumeOrdersIngridientsResponse,
     MenuItem,
     Menu
 )
@@ -36,10 +40,17 @@ from kitchen_commons.models.WaitressServiceModel import (
 )
 
 from kitchen_commons.shared.APIRequest import APIRequest
+from kitchen_commons.shared.CircuitBreaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from kitchen_commons.shared.ConcurrencyLimiter import ConcurrencyLimiter, get_concurrency_limiter
 from kitchen_commons.shared.HTTPClientManager import http_client_manager
+from kitchen_commons.shared.HTTPCaching import compute_etag, etag_matches
+from kitchen_commons.shared.IdAllocator import IdAllocator
 from kitchen_commons.shared.Settings import settings
-from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Logging import logger, Lazy, get_log_queue_stats
+from kitchen_commons.shared.Metrics import metrics, MetricsRegistry, MetricsMiddleware, collect_stream_metrics
 from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.StreamRetention import stream_retention, replay_archive
+from kitchen_commons.shared.Tracing import TracingMiddleware, start_span, current_trace, trace_collector, build_timeline
 from kitchen_commons.shared.Lifecycle import (
     startup_http_client,
     shutdown_http_client,
@@ -65,6 +76,10 @@ __all__ = [
     "ConsumeRecipeIngridientsRequest",
     "ConsumeRecipeIngridientsResult",
     "ConsumeRecipeIngridientsResponse",
+    "ConsumeOrderIngridientsRequest",
+    "ConsumeOrderIngridientsResponse",
+    "ConsumeOrdersIngridientsRequest",
+    "ConsumeOrdersIngridientsResponse",
     "MenuItem",
     "Menu",
     "PlaceOrderRequestItem",
@@ -72,10 +87,31 @@ __all__ = [
     "PlaceOrderResponse",
     "KitchenOrderResponse",
     "APIRequest",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "get_circuit_breaker",
+    "ConcurrencyLimiter",
+    "get_concurrency_limiter",
     "http_client_manager",
+    "compute_etag",
+    "etag_matches",
+    "IdAllocator",
     "settings",
     "logger",
+    "Lazy",
+    "get_log_queue_stats",
+    "metrics",
+    "MetricsRegistry",
+    "MetricsMiddleware",
+    "collect_stream_metrics",
     "redis_service",
+    "stream_retention",
+    "replay_archive",
+    "TracingMiddleware",
+    "start_span",
+    "current_trace",
+    "trace_collector",
+    "build_timeline",
     "startup_http_client",
     "shutdown_http_client",
     "startup_redis",
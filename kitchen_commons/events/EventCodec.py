@@ -0,0 +1,240 @@
+import base64
+import json
+import re
+import struct
+from typing import Any, Optional
+
+from kitchen_commons.events.Events import BaseEvent
+
+
+class EventEncodingError(ValueError):
+    """Raised when an event holds values that the codec's layout can't represent."""
+
+
+class EventCodec:
+    """Turns events into the fields of a Redis stream entry."""
+
+    name: str = ""
+
+    def encode(self, event: BaseEvent) -> dict[str, Any]:
+        """Raises EventEncodingError when the event doesn't fit the layout."""
+        raise NotImplementedError
+
+    def order_id_slot(self) -> tuple[str, Optional[int]]:
+        """
+        Where the order_id lives in the encoded fields, so Redis side scripts can fill it in:
+        (field, None) when the field holds the decimal order_id, (field, offset) for a little endian int64 at that byte offset.
+        """
+        raise NotImplementedError
+
+
+class FieldEventCodec(EventCodec):
+    """One stream field per event attribute, complex values JSON-encoded. This is the original format."""
+
+    name = "fields"
+
+    def encode(self, event: BaseEvent) -> dict[str, Any]:
+        return event.to_redis()
+
+    def order_id_slot(self) -> tuple[str, Optional[int]]:
+        return ("order_id", None)
+
+
+class BinaryEventCodec(EventCodec):
+    """
+    Schema-versioned binary layout stored in a single stream field.
+    Every entry starts with a fixed-width prefix (layout version, event type code, order_id, table_no),
+    followed by the remaining attributes of that event type in schema order. Integers are little endian,
+    strings are length-prefixed UTF-8. Order items are stored column-wise: the number of dishes in each
+    item, the NUL-joined dish names as one string, then all quantities.
+    Layout version 2 adds the trace context (trace ID, span ID, publish time) right after the prefix, it is only
+    written for traced events. Entries of every known version can be decoded.
+    """
+
+    name = "binary"
+
+    FIELD = "b"
+    VERSION = 2
+    UNTRACED_VERSION = 1
+
+    _PREFIX = struct.Struct("<BBqi")
+    # Trace ID and span ID as raw bytes, publish time as epoch seconds
+    _TRACE = struct.Struct("<16s8sd")
+    # Events whose IDs don't fit the W3C format are written untraced
+    _TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+    _SPAN_ID = re.compile(r"^[0-9a-f]{16}$")
+    _LENGTH = struct.Struct("<I")
+
+    # Event type code -> (event type, attributes after the prefix)
+    # Codes and attribute order must never change for a given layout version
+    _SCHEMAS: dict[int, tuple[str, list[tuple[str, str]]]] = {
+        1: ("OrderPlaced", [("comments", "str"), ("items", "items")]),
+        2: ("OrderReady", [("comments", "str")]),
+        3: ("OrderCanceled", [("comments", "str")]),
+        4: ("DeadEvent", [("comments", "str"), ("message_id", "str"), ("original_message", "str"), ("error", "str")]),
+    }
+
+    _TYPE_CODES = {event_type: code for code, (event_type, _) in _SCHEMAS.items()}
+
+    def encode(self, event: BaseEvent) -> dict[str, Any]:
+        try:
+            return {self.FIELD: self._encode_parts(event)}
+        except struct.error as e:
+            # e.g. quantities beyond int32
+            raise EventEncodingError(str(e)) from e
+
+    def _encode_parts(self, event: BaseEvent) -> bytes:
+        code = self._TYPE_CODES[getattr(event, "event_type")]
+        (_, schema) = self._SCHEMAS[code]
+
+        if self._TRACE_ID.match(event.trace_id) and self._SPAN_ID.match(event.span_id):
+            parts = [
+                self._PREFIX.pack(self.VERSION, code, event.order_id, event.table_no),
+                self._TRACE.pack(bytes.fromhex(event.trace_id), bytes.fromhex(event.span_id), event.published_at)
+            ]
+        else:
+            parts = [self._PREFIX.pack(self.UNTRACED_VERSION, code, event.order_id, event.table_no)]
+
+        for field, kind in schema:
+            value = getattr(event, field)
+
+            if kind == "str":
+                self._pack_str(parts, value)
+            elif kind == "items":
+                self._pack_items(parts, value)
+            else:
+                raise ValueError(f"Unknown field kind: {kind}")
+
+        return b"".join(parts)
+
+    def order_id_slot(self) -> tuple[str, Optional[int]]:
+        # order_id follows the version and event type bytes of the prefix
+        return (self.FIELD, 2)
+
+    def decode(self, payload: bytes) -> dict[str, Any]:
+        (version, code, order_id, table_no) = self._PREFIX.unpack_from(payload, 0)
+
+        if version not in (self.VERSION, self.UNTRACED_VERSION):
+            raise ValueError(f"Unsupported binary event layout version: {version}")
+
+        (event_type, schema) = self._SCHEMAS[code]
+
+        data: dict[str, Any] = {"event_type": event_type, "order_id": order_id, "table_no": table_no}
+        offset = self._PREFIX.size
+
+        if version == self.VERSION:
+            (trace_id, span_id, data["published_at"]) = self._TRACE.unpack_from(payload, offset)
+            (data["trace_id"], data["span_id"]) = (trace_id.hex(), span_id.hex())
+            offset += self._TRACE.size
+
+        for field, kind in schema:
+            if kind == "str":
+                (data[field], offset) = self._unpack_str(payload, offset)
+            elif kind == "items":
+                (data[field], offset) = self._unpack_items(payload, offset)
+            else:
+                raise ValueError(f"Unknown field kind: {kind}")
+
+        return data
+
+    def _pack_str(self, parts: list[bytes], value: str):
+        encoded = value.encode()
+        parts.append(self._LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+
+    def _unpack_str(self, payload: bytes, offset: int) -> tuple[str, int]:
+        (length,) = self._LENGTH.unpack_from(payload, offset)
+        start = offset + self._LENGTH.size
+        return (payload[start:start + length].decode(), start + length)
+
+    def _pack_items(self, parts: list[bytes], items: list[dict[str, int]]):
+        sizes = [len(item) for item in items]
+        names = [name for item in items for name in item]
+        quantities = [qty for item in items for qty in item.values()]
+
+        joined_names = "\0".join(names)
+
+        # Names are split on NUL again when decoding, which loses empty names and splits names holding NUL
+        if "" in names or joined_names.count("\0") != max(len(names) - 1, 0):
+            raise EventEncodingError("Dish names must be non-empty and free of NUL characters")
+
+        parts.append(self._LENGTH.pack(len(sizes)))
+        parts.append(struct.pack(f"<{len(sizes)}H", *sizes))
+        self._pack_str(parts, joined_names)
+        parts.append(struct.pack(f"<{len(quantities)}i", *quantities))
+
+    def _unpack_items(self, payload: bytes, offset: int) -> tuple[list[dict[str, int]], int]:
+        (item_count,) = self._LENGTH.unpack_from(payload, offset)
+        offset += self._LENGTH.size
+
+        sizes = struct.unpack_from(f"<{item_count}H", payload, offset)
+        offset += 2 * item_count
+
+        (joined_names, offset) = self._unpack_str(payload, offset)
+        names = joined_names.split("\0") if joined_names else []
+
+        quantities = struct.unpack_from(f"<{len(names)}i", payload, offset)
+        offset += 4 * len(names)
+
+        # Orders usually hold one dish per item
+        if len(sizes) == len(names) and all(size == 1 for size in sizes):
+            return ([{name: qty} for name, qty in zip(names, quantities)], offset)
+
+        items = []
+        position = 0
+        for size in sizes:
+            items.append(dict(zip(names[position:position + size], quantities[position:position + size])))
+            position += size
+
+        return (items, offset)
+
+
+_binary_codec = BinaryEventCodec()
+
+EVENT_CODECS: dict[str, EventCodec] = {
+    FieldEventCodec.name: FieldEventCodec(),
+    BinaryEventCodec.name: _binary_codec,
+}
+
+def get_event_codec(name: str) -> EventCodec:
+    if name not in EVENT_CODECS:
+        raise ValueError(f"Unknown event codec: {name}")
+    return EVENT_CODECS[name]
+
+def encode_message_fields(message_data: dict[str, Any]) -> dict[str, str]:
+    """Encodes decoded message data back into field-per-key stream fields, the same way BaseEvent.to_redis does."""
+    return {
+        str(key): json.dumps(value) if isinstance(value, (list, dict)) else "" if value is None else str(value)
+        for key, value in message_data.items()
+    }
+
+def decode_event_fields(fields: dict) -> dict[str, Any]:
+    """
+    Decodes the raw fields of a stream entry, written by any codec, into message data.
+    Binary entries come back with typed values, field-per-key entries as strings like before.
+    """
+    payload = fields.get(BinaryEventCodec.FIELD.encode(), fields.get(BinaryEventCodec.FIELD))
+
+    if payload is not None:
+        return _binary_codec.decode(payload if isinstance(payload, bytes) else payload.encode())
+
+    return {
+        (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+        for key, value in fields.items()
+    }
+
+# Message data of an entry that can't be decoded holds its raw fields, base64 encoded, under this key
+UNDECODABLE_FIELDS = "undecodable_fields"
+
+def undecodable_message_data(fields: dict, error: Exception) -> dict[str, Any]:
+    """
+    Stands in for the message data of an entry that can't be decoded. It has no event type, so consumers fail it
+    like any malformed message, and it keeps the raw fields for the dead event queue.
+    """
+    return {
+        UNDECODABLE_FIELDS: {
+            (key.decode() if isinstance(key, bytes) else key): base64.b64encode(value if isinstance(value, bytes) else value.encode()).decode()
+            for key, value in fields.items()
+        },
+        "decode_error": f"{type(error).__name__}: {error}",
+    }
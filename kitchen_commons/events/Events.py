@@ -10,6 +10,11 @@ class BaseEvent(BaseModel):
     table_no: int
     comments: str
 
+    # Span that published the event and when (epoch seconds), so the consumer continues the order's trace
+    trace_id: str = ""
+    span_id: str = ""
+    published_at: float = 0.0
+
     def to_redis(self) -> dict[str, str]:
         data = self.model_dump()
         redis_data = {}
@@ -6,6 +6,14 @@ from kitchen_commons.events.Events import (
     BaseEvent,
     KitchenBaseEvent
 )
+from kitchen_commons.events.EventCodec import (
+    EventCodec,
+    FieldEventCodec,
+    BinaryEventCodec,
+    get_event_codec,
+    encode_message_fields,
+    decode_event_fields
+)
 
 __all__ = [
     "DeadEvent",
@@ -13,5 +21,11 @@ __all__ = [
     "OrderPlaced",
     "OrderReady",
     "BaseEvent",
-    "KitchenBaseEvent"
+    "KitchenBaseEvent",
+    "EventCodec",
+    "FieldEventCodec",
+    "BinaryEventCodec",
+    "get_event_codec",
+    "encode_message_fields",
+    "decode_event_fields"
 ]
\ No newline at end of file
@@ -64,6 +64,27 @@ class ConsumeRecipeIngridientsResponse(BaseModel):
     user_id: str
     results: List[ConsumeRecipeIngridientsResult]
 
+# This model is used to consume ingredients for all recipes of an order at once
+# Either every recipe of the order is consumed or none of them is
+class ConsumeOrderIngridientsRequest(BaseModel):
+    user_id: str
+    tasks: List[ConsumeRecipeIngridientsTask]
+
+class ConsumeOrderIngridientsResponse(BaseModel):
+    user_id: str
+    consumed: bool
+    results: List[ConsumeRecipeIngridientsResult]
+
+# This model is used to consume ingredients for several orders in one call
+# Every order is consumed on its own, results come back in request order
+class ConsumeOrdersIngridientsRequest(BaseModel):
+    user_id: str
+    orders: List[ConsumeOrderIngridientsRequest]
+
+class ConsumeOrdersIngridientsResponse(BaseModel):
+    user_id: str
+    results: List[ConsumeOrderIngridientsResponse]
+
 class MenuItem(BaseModel):
     name: str
     description: str
@@ -1,19 +1,55 @@
 import asyncio
+import time
 from enum import Enum
 from typing import Any
 from kitchen_commons.shared.Logging import logger
 from kitchen_commons.shared.HTTPClientManager import http_client_manager
+from kitchen_commons.shared.CircuitBreaker import get_circuit_breaker
+from kitchen_commons.shared.ConcurrencyLimiter import get_concurrency_limiter
+from kitchen_commons.shared.Metrics import metrics
+from kitchen_commons.shared.Settings import settings
+from kitchen_commons.shared.Tracing import current_trace, format_traceparent, start_span
 import httpx
 import logging
 from tenacity import (
     retry, 
     stop_after_attempt, 
     wait_exponential,
-    retry_if_exception,
     before_sleep_log,
-    after_log
+    after_log,
+    RetryCallState
 )
 
+# Upstream responses worth another attempt, anything else is returned or raised right away
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Responses turning a request away before it was handled, the only ones a non-idempotent call is retried on
+REJECTED_STATUS_CODES = {429, 503}
+# Failures before the request reached the upstream
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+def is_retryable_error(error: BaseException, idempotent: bool = True) -> bool:
+    """
+    Transport failures and overloaded or unavailable upstreams are retried, client errors and open circuits are not.
+    A non-idempotent call may already have been applied when its response got lost, so it is only retried when it
+    never reached the upstream or was turned away.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in (RETRYABLE_STATUS_CODES if idempotent else REJECTED_STATUS_CODES)
+    return isinstance(error, httpx.TransportError if idempotent else CONNECT_ERRORS)
+
+def _should_retry(retry_state: RetryCallState) -> bool:
+    error = retry_state.outcome.exception() if retry_state.outcome is not None else None
+    return error is not None and is_retryable_error(error, retry_state.args[0].method in APIRequest.IDEMPOTENT_METHODS)
+
+_api_request_duration = metrics.histogram("api_request_duration_seconds", "Time of one attempt of an inter-service call", ("upstream", "method", "outcome"))
+_api_request_retries = metrics.counter("api_request_retries_total", "Inter-service call attempts that failed and were retried", ("upstream",))
+
+_log_before_sleep = before_sleep_log(logger, logging.WARNING)
+
+def _before_retry(retry_state: RetryCallState):
+    _api_request_retries.inc(httpx.URL(retry_state.args[0].url).netloc.decode())
+    _log_before_sleep(retry_state)
+
 class APIRequest:
 
     class Method(Enum):
@@ -22,16 +58,20 @@ class APIRequest:
         PUT = "PUT"
         DELETE = "DELETE"
 
-    def __init__(self, method: Method, url: str, payload: Any | None = None):
+    IDEMPOTENT_METHODS = {Method.GET, Method.PUT, Method.DELETE}
+
+    def __init__(self, method: Method, url: str, payload: Any | None = None, headers: dict[str, str] | None = None):
         self.method = method
         self.url = url
         self.payload = payload
+        self.headers = headers
 
     @retry(
-        stop=stop_after_attempt(5), 
-        wait=wait_exponential(multiplier=2, min=1, max=10),
+        stop=stop_after_attempt(settings.api_max_attempts),
+        wait=wait_exponential(multiplier=2, min=0.5, max=settings.api_retry_max_wait_seconds),
+        retry=_should_retry,
         reraise=True,
-        before_sleep=before_sleep_log(logger, logging.WARNING),
+        before_sleep=_before_retry,
         after=after_log(logger, logging.INFO)
     )
     async def sendRequest(self) -> httpx.Response:
@@ -39,16 +79,72 @@ class APIRequest:
         logger.info("Sending API request", method=self.method, url=self.url, payload=self.payload)
 
         client = http_client_manager.client
-    
-        if self.method == self.Method.GET:
-            response = await client.get(self.url)
-        elif self.method == self.Method.POST:
-            response = await client.post(self.url, json=self.payload)
-        else:
+
+        if self.method not in (self.Method.GET, self.Method.POST):
             logger.error("Unsupported HTTP method", method=self.method)
             raise ValueError(f"Unsupported HTTP method: {self.method}")
 
+        # Breaker and limiter are kept per upstream host
+        upstream = httpx.URL(self.url).netloc.decode()
+        circuit_breaker = get_circuit_breaker(upstream)
+        concurrency_limiter = get_concurrency_limiter(upstream)
+
+        # Fails fast while the upstream is known to be down
+        circuit_breaker.before_request()
+
+        outcome_recorded = False
+
+        try:
+            await concurrency_limiter.acquire()
+            started_at = time.monotonic()
+
+            try:
+                # Every attempt is a span of its own, the upstream continues the trace from it
+                with start_span(f"{self.method.value} {self.url}", upstream=upstream) as span:
+                    trace = current_trace()
+                    headers = {**(self.headers or {}), "traceparent": format_traceparent(trace)} if trace is not None else self.headers
+
+                    if self.method == self.Method.GET:
+                        response = await client.get(self.url, headers=headers)
+                    else:
+                        response = await client.post(self.url, json=self.payload, headers=headers)
+
+                    if span is not None:
+                        span["status"] = response.status_code
+            except httpx.TransportError:
+                latency = time.monotonic() - started_at
+                _api_request_duration.observe(latency, upstream, self.method.value, "transport_error")
+                await concurrency_limiter.release(latency, dropped=True)
+                circuit_breaker.record_failure()
+                outcome_recorded = True
+                raise
+            except BaseException:
+                await concurrency_limiter.release(time.monotonic() - started_at)
+                raise
+
+            latency = time.monotonic() - started_at
+            _api_request_duration.observe(latency, upstream, self.method.value, str(response.status_code))
+
+            dropped = response.status_code in RETRYABLE_STATUS_CODES
+            await concurrency_limiter.release(latency, dropped)
+
+            # Client errors say nothing about the health of the upstream
+            if dropped:
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+            outcome_recorded = True
+        finally:
+            # A call that ended without telling anything about the upstream, e.g. cancelled while waiting, gives its trial slot back
+            if not outcome_recorded:
+                circuit_breaker.release_trial()
+
+        # A 304 answers a conditional request, the caller reuses the representation it already has
+        if response.status_code == httpx.codes.NOT_MODIFIED:
+            logger.info("API request not modified", status_code=response.status_code)
+            return response
+
         response.raise_for_status()  # Raise an error for bad responses
 
-        logger.info("API request successful", status_code=response.status_code, response=response.json())
+        logger.info("API request successful", status_code=response.status_code, size=len(response.content))
         return response
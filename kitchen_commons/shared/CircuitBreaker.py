@@ -0,0 +1,88 @@
+import time
+from enum import Enum
+from typing import Optional
+
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Settings import settings
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, name: str, retry_after_seconds: float):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after_seconds:.1f}s")
+        self.name = name
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker. After failure_threshold consecutive failures the circuit opens and calls fail
+    immediately. Once recovery_seconds have passed it is half-open and lets up to half_open_max_calls trial calls
+    through: a success closes the circuit again, a failure opens it for another recovery period.
+    """
+
+    class State(Enum):
+        CLOSED = "closed"
+        OPEN = "open"
+        HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None, recovery_seconds: Optional[float] = None, half_open_max_calls: Optional[int] = None):
+        self.name = name
+        self._failure_threshold = failure_threshold if failure_threshold is not None else settings.circuit_breaker_failure_threshold
+        self._recovery_seconds = recovery_seconds if recovery_seconds is not None else settings.circuit_breaker_recovery_seconds
+        self._half_open_max_calls = half_open_max_calls if half_open_max_calls is not None else settings.circuit_breaker_half_open_max_calls
+
+        self._state = self.State.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    @property
+    def state(self) -> "CircuitBreaker.State":
+        if self._state == self.State.OPEN and time.monotonic() - self._opened_at >= self._recovery_seconds:
+            self._transition(self.State.HALF_OPEN)
+        return self._state
+
+    def before_request(self):
+        """Raises CircuitOpenError when the call must not be made."""
+        state = self.state
+
+        if state == self.State.OPEN:
+            raise CircuitOpenError(self.name, self._recovery_seconds - (time.monotonic() - self._opened_at))
+
+        if state == self.State.HALF_OPEN:
+            # Only a few trial calls while the upstream may still be down
+            if self._half_open_calls >= self._half_open_max_calls:
+                raise CircuitOpenError(self.name, 0.0)
+            self._half_open_calls += 1
+
+    def release_trial(self):
+        """Gives back the trial slot of a call that ended without an outcome, e.g. because it was cancelled."""
+        if self._state == self.State.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        self._failures = 0
+        if self._state != self.State.CLOSED:
+            self._transition(self.State.CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == self.State.HALF_OPEN or (self._state == self.State.CLOSED and self._failures >= self._failure_threshold):
+            self._opened_at = time.monotonic()
+            self._transition(self.State.OPEN)
+
+    def _transition(self, state: "CircuitBreaker.State"):
+        logger.warning("Circuit breaker state changed", name=self.name, old_state=self._state.value, new_state=state.value, failures=self._failures)
+        self._state = state
+        self._half_open_calls = 0
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Returns the circuit breaker of an upstream, creating it on first use."""
+    if name not in _circuit_breakers:
+        _circuit_breakers[name] = CircuitBreaker(name)
+    return _circuit_breakers[name]
@@ -0,0 +1,62 @@
+import asyncio
+from typing import Optional
+
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Settings import settings
+
+
+class ConcurrencyLimiter:
+    """
+    Adaptive (AIMD) limit on the number of calls in flight to one upstream.
+    Every successful call raises the limit by 1/limit, so roughly by one per limit's worth of calls. A failed call,
+    or one slower than latency_threshold_ms, multiplies it by backoff_ratio. Callers over the limit wait for a slot.
+    """
+
+    def __init__(self, name: str, initial_limit: Optional[int] = None, min_limit: Optional[int] = None, max_limit: Optional[int] = None, backoff_ratio: Optional[float] = None, latency_threshold_ms: Optional[int] = None):
+        self.name = name
+        self._min_limit = min_limit if min_limit is not None else settings.api_concurrency_min_limit
+        self._max_limit = max_limit if max_limit is not None else settings.api_concurrency_max_limit
+        self._backoff_ratio = backoff_ratio if backoff_ratio is not None else settings.api_concurrency_backoff_ratio
+        self._latency_threshold_ms = latency_threshold_ms if latency_threshold_ms is not None else settings.api_concurrency_latency_threshold_ms
+
+        self._limit = float(initial_limit if initial_limit is not None else settings.api_concurrency_initial_limit)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return max(self._min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self, latency_seconds: float, dropped: bool = False):
+        """Frees the slot and adjusts the limit, dropped tells whether the upstream failed or rejected the call."""
+        async with self._condition:
+            self._in_flight -= 1
+            previous_limit = self.limit
+
+            if dropped or latency_seconds * 1000 > self._latency_threshold_ms:
+                self._limit = max(self._min_limit, self._limit * self._backoff_ratio)
+            else:
+                self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+
+            if self.limit < previous_limit:
+                logger.warning("Concurrency limit decreased", name=self.name, limit=self.limit, latency_ms=int(latency_seconds * 1000), dropped=dropped)
+
+            self._condition.notify_all()
+
+
+_concurrency_limiters: dict[str, ConcurrencyLimiter] = {}
+
+def get_concurrency_limiter(name: str) -> ConcurrencyLimiter:
+    """Returns the concurrency limiter of an upstream, creating it on first use."""
+    if name not in _concurrency_limiters:
+        _concurrency_limiters[name] = ConcurrencyLimiter(name)
+    return _concurrency_limiters[name]
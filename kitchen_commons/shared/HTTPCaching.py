@@ -0,0 +1,18 @@
+import hashlib
+from typing import Optional
+
+def compute_etag(body: bytes) -> str:
+    """Returns a strong ETag derived from the content of a response body."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Checks an If-None-Match header against an ETag, using the weak comparison GET requests allow."""
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+
+    return False
@@ -1,17 +1,56 @@
+from importlib.util import find_spec
 from typing import Optional
 import httpx
 
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Metrics import metrics
+from kitchen_commons.shared.Settings import settings
+
+_pool_connections = metrics.gauge("http_client_pool_connections", "Connections of a pool of the shared HTTP client", ("pool", "state"))
+_pool_requests = metrics.gauge("http_client_pool_requests", "Requests of a pool of the shared HTTP client, waiting ones have no connection yet", ("pool", "state"))
+
 class HTTPClientManager:
+    """
+    Owns the shared httpx client. Each known upstream service gets its own connection pool, so one slow service
+    can't take every connection. Connections are kept alive between calls and HTTP/2 is used where the upstream supports it.
+    """
 
     def __init__(self):
         self._client: Optional[httpx.AsyncClient] = None
+        # Pool name -> transport, "default" serves every host without a pool of its own
+        self._transports: dict[str, httpx.AsyncHTTPTransport] = {}
+        self._requests_sent = 0
+        # URL pattern -> transport, mounted over the pools on start
+        self._custom_mounts: dict[str, httpx.AsyncBaseTransport] = {}
 
     async def start(self):
+        http2 = settings.http_client_http2 and find_spec("h2") is not None
+        if settings.http_client_http2 and not http2:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+
+        self._transports = {"default": self._create_transport(settings.http_client_max_connections, http2)}
+        mounts: dict[str, httpx.AsyncBaseTransport] = {}
+
+        for url in {settings.inventory_service_url, settings.waitress_service_url, settings.kitchen_service_url}:
+            host = httpx.URL(url).netloc.decode()
+            self._transports[host] = self._create_transport(settings.http_client_max_connections_per_host, http2)
+            mounts[f"all://{host}"] = self._transports[host]
+
+        mounts.update(self._custom_mounts)
+
         self._client = httpx.AsyncClient(
-            timeout=30.0
+            timeout=httpx.Timeout(settings.http_client_timeout_seconds, connect=settings.http_client_connect_timeout_seconds, pool=settings.http_client_pool_timeout_seconds),
+            transport=self._transports["default"],
+            mounts=mounts,
+            event_hooks={"request": [self._count_request]}
         )
 
+        metrics.register_collector(self._collect_metrics)
+
+        logger.info("HTTP client started", pools=list(self._transports), http2=http2, max_connections_per_host=settings.http_client_max_connections_per_host)
+
     async def stop(self):
+        metrics.unregister_collector(self._collect_metrics)
         await self._client.aclose()
 
     @property
@@ -19,5 +58,49 @@ class HTTPClientManager:
         if self._client is None:
             raise RuntimeError("HTTPx client is not started!")
         return self._client
-    
-http_client_manager = HTTPClientManager()
\ No newline at end of file
+
+    def mount(self, url_pattern: str, transport: httpx.AsyncBaseTransport):
+        """Sends the requests matching an httpx mount pattern, e.g. "all://inventory", through transport from the next start on."""
+        self._custom_mounts[url_pattern] = transport
+
+    def get_pool_stats(self) -> dict[str, dict[str, int]]:
+        """Returns connection and request counts per pool, plus the number of requests sent since start."""
+        stats = {name: self._get_transport_stats(transport) for name, transport in self._transports.items()}
+        stats["total"] = {"requests_sent": self._requests_sent}
+        return stats
+
+    def _create_transport(self, max_connections: int, http2: bool) -> httpx.AsyncHTTPTransport:
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(settings.http_client_max_keepalive_connections, max_connections),
+            keepalive_expiry=settings.http_client_keepalive_expiry_seconds
+        )
+        return httpx.AsyncHTTPTransport(limits=limits, http2=http2, http1=not (http2 and settings.http_client_http2_prior_knowledge))
+
+    def _get_transport_stats(self, transport: httpx.AsyncHTTPTransport) -> dict[str, int]:
+        # httpx doesn't expose its pool, these counts come from the underlying httpcore pool when available
+        pool = getattr(transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        requests = list(getattr(pool, "_requests", []))
+
+        return {
+            "connections": len(connections),
+            "active_connections": sum(1 for connection in connections if not connection.is_idle()),
+            "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+            "http2_connections": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+            "requests_in_flight": sum(1 for request in requests if request.connection is not None),
+            "requests_waiting": sum(1 for request in requests if request.connection is None),
+        }
+
+    def _collect_metrics(self):
+        for name, transport in self._transports.items():
+            stats = self._get_transport_stats(transport)
+            _pool_connections.set(stats["active_connections"], name, "active")
+            _pool_connections.set(stats["idle_connections"], name, "idle")
+            _pool_requests.set(stats["requests_in_flight"], name, "in_flight")
+            _pool_requests.set(stats["requests_waiting"], name, "waiting")
+
+    async def _count_request(self, request: httpx.Request):
+        self._requests_sent += 1
+
+http_client_manager = HTTPClientManager()
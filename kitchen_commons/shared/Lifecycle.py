@@ -20,4 +20,5 @@ async def startup_redis():
 async def shutdown_redis():
     logger.info("Closing Redis connection...")
     await redis_service.client.close()
+    await redis_service.stream_client.close()
     logger.info("Redis connection closed...")
\ No newline at end of file
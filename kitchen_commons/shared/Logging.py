@@ -1,36 +1,173 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+from typing import Any, Callable
 import structlog
 from kitchen_commons.shared.Settings import settings
 
+
+class Lazy:
+    """
+    Log value that is only computed when the event is rendered, so sampled out or dropped events never pay for it.
+    Usage: logger.info("Menu cached", size=Lazy(len, menu)). In production it is computed on the logging thread.
+    """
+    __slots__ = ("_func", "_args")
+
+    def __init__(self, func: Callable[..., Any], *args: Any):
+        self._func = func
+        self._args = args
+
+    def __call__(self) -> Any:
+        return self._func(*self._args)
+
+
+class EventSampler:
+    """
+    Keeps only a fraction of the info and debug events, per event name. Warnings and errors are always kept.
+    Runs before any rendering, so a sampled out event costs next to nothing.
+    """
+    _ALWAYS_KEPT = {"warning", "warn", "error", "exception", "critical", "fatal"}
+
+    def __init__(self, sample_rates: dict[str, float], default_sample_rate: float = 1.0):
+        self._sample_rates = sample_rates
+        self._default_sample_rate = default_sample_rate
+
+    def __call__(self, logger: Any, method_name: str, event_dict: dict) -> dict:
+        if method_name in self._ALWAYS_KEPT:
+            return event_dict
+
+        sample_rate = self._sample_rates.get(event_dict.get("event"), self._default_sample_rate) # type: ignore
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            raise structlog.DropEvent
+
+        return event_dict
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records over to the logging thread without ever blocking the caller.
+    While max_size records are waiting, new ones are dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue, max_size: int):
+        super().__init__(log_queue)
+        self._max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Rendering is left to the logging thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self._max_size: # type: ignore
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def resolve_lazy_values(logger: Any, method_name: str, event_dict: dict) -> dict:
+    """Computes the Lazy values of an event that is about to be rendered."""
+    for key, value in event_dict.items():
+        if isinstance(value, Lazy):
+            event_dict[key] = value()
+    return event_dict
+
+def cap_value_sizes(logger: Any, method_name: str, event_dict: dict) -> dict:
+    """Truncates values that would render longer than log_max_value_length characters."""
+    max_length = settings.log_max_value_length
+
+    for key, value in event_dict.items():
+        if key == "exception" or value is None or isinstance(value, (bool, int, float)):
+            continue
+
+        rendered = value if isinstance(value, str) else json.dumps(value, default=str)
+        if len(rendered) > max_length:
+            event_dict[key] = f"{rendered[:max_length]}... ({len(rendered)} chars)"
+
+    return event_dict
+
+
+_queue_handler: DroppingQueueHandler | None = None
+
+def get_log_queue_stats() -> dict[str, int]:
+    """Returns the number of records waiting for the logging thread and the number dropped so far."""
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped} # type: ignore
+
 def configure_logging(is_dev_mode=True):
     """
     Configures logging for the application.
     In development mode, logs are human-readable and colored.
-    In production mode, logs are JSON-formatted.
+    In production mode, logs are JSON-formatted. With log_async, they are rendered and written by a background
+    thread, the event loop only puts records on a queue.
     """
+    global _queue_handler
+
     # 1. Define the processor chain
     shared_processors = [
         structlog.contextvars.merge_contextvars,
         structlog.stdlib.add_logger_name,
         structlog.stdlib.add_log_level,
+        EventSampler(settings.log_sample_rates, settings.log_default_sample_rate),
         structlog.processors.TimeStamper(fmt="iso"),
     ]
 
+    # Turn values into output, in production these run on the logging thread when log_async is set
+    render_processors = [
+        resolve_lazy_values,
+        cap_value_sizes,
+    ]
+
+    handler: logging.Handler = logging.StreamHandler(sys.stdout)
+
     if is_dev_mode:
         # Development-friendly logging
         processors = shared_processors + [
             structlog.stdlib.PositionalArgumentsFormatter(),
             structlog.processors.StackInfoRenderer(),
             structlog.processors.format_exc_info,
+        ] + render_processors + [
             structlog.dev.ConsoleRenderer(colors=True), # Pretty, colored output
         ]
-    else:
+    elif not settings.log_async:
         # Production-ready JSON logging
         processors = shared_processors + [
             structlog.processors.dict_tracebacks,
+        ] + render_processors + [
             structlog.processors.JSONRenderer(), # Render to JSON
         ]
+    else:
+        # Production-ready JSON logging, tracebacks are captured on the caller's thread as they can't be later
+        processors = shared_processors + [
+            structlog.processors.dict_tracebacks,
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        ]
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(structlog.stdlib.ProcessorFormatter(
+            processors=[structlog.stdlib.ProcessorFormatter.remove_processors_meta] + render_processors + [structlog.processors.JSONRenderer()],
+            # Records of other libraries are structured as well
+            foreign_pre_chain=[structlog.stdlib.add_logger_name, structlog.stdlib.add_log_level, structlog.processors.TimeStamper(fmt="iso")],
+        ))
+
+        # Never rendered, so not worth collecting for every record
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        log_queue: queue.Queue = queue.Queue()
+        _queue_handler = DroppingQueueHandler(log_queue, settings.log_queue_size)
+        handler = _queue_handler
+
+        listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        listener.start()
+        # Writes out what is still queued on exit
+        atexit.register(listener.stop)
 
     # 2. Configure structlog to wrap the standard logging library
     structlog.configure(
@@ -39,11 +176,11 @@ def configure_logging(is_dev_mode=True):
         wrapper_class=structlog.stdlib.BoundLogger,
         cache_logger_on_first_use=True,
     )
-    
+
     # 3. Configure the standard logging library to pass messages to structlog
     # This ensures logs from other libraries (e.g., SQLAlchemy) are also structured.
-    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="%(message)s")
+    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[handler])
 
 configure_logging(is_dev_mode=settings.debug_mode)
 
-logger = structlog.get_logger("Kitchen microservices")
\ No newline at end of file
+logger = structlog.get_logger("Kitchen microservices")
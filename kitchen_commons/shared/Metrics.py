@@ -0,0 +1,240 @@
+import bisect
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Union
+
+from kitchen_commons.shared.Logging import get_log_queue_stats, logger
+from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.Settings import settings
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    """Monotonic count per label combination, label values are passed positionally in label_names order."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}" for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Current value per label combination, usually set by a collector right before metrics are rendered."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+
+class Histogram:
+    """
+    Bucketed distribution per label combination. Observing costs a bisect and two additions,
+    cumulative bucket counts are only computed when rendering.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._buckets = buckets
+        # Label values -> [count per bucket (the last one is +Inf), sum]
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._values.get(label_values)
+        if series is None:
+            series = self._values[label_values] = ([0] * (len(self._buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self._buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> list[str]:
+        lines: list[str] = []
+
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {repr(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+
+        return lines
+
+
+Metric = Union[Counter, Gauge, Histogram]
+Collector = Callable[[], Union[None, Awaitable[None]]]
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the process and renders them in the Prometheus text format.
+    Collectors are called right before rendering, to set gauges that are cheaper to read on demand than to keep up to date.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Collector] = []
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names)) # type: ignore
+
+    def gauge(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names)) # type: ignore
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets)) # type: ignore
+
+    def register_collector(self, collector: Collector):
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def unregister_collector(self, collector: Collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    async def render(self) -> str:
+        for collector in list(self._collectors):
+            try:
+                result = collector()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                # A failing collector leaves its gauges at their last values, the rest is still rendered
+                logger.warning("Metrics collector failed", collector=getattr(collector, "__qualname__", repr(collector)), error=str(e))
+
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Metric) -> Metric:
+        # Modules and instances declaring the same metric share it
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if existing.kind != metric.kind or existing.label_names != metric.label_names:
+                raise ValueError(f"Metric {metric.name} is already registered as a {existing.kind} with labels {existing.label_names}")
+            return existing
+
+        self._metrics[metric.name] = metric
+        return metric
+
+metrics = MetricsRegistry()
+
+
+_http_request_duration = metrics.histogram("http_request_duration_seconds", "Time to handle an HTTP request, up to the end of the response body", ("method", "route", "status"))
+
+_log_records_queued = metrics.gauge("log_records_queued", "Log records waiting to be written by the logging thread")
+_log_records_dropped = metrics.gauge("log_records_dropped", "Log records dropped because the logging queue was full")
+
+def _collect_log_queue_stats():
+    stats = get_log_queue_stats()
+    _log_records_queued.set(stats["queued"])
+    _log_records_dropped.set(stats["dropped"])
+
+metrics.register_collector(_collect_log_queue_stats)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that times every HTTP request per route template and serves the metrics under path.
+    Usage: app.add_middleware(MetricsMiddleware). Websocket and lifespan traffic passes through untouched.
+    """
+
+    def __init__(self, app: Any, path: str = "/metrics"):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope["type"] != "http" or not settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] == self.path:
+            await self._send_metrics(send)
+            return
+
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: dict):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router leaves the matched route in the scope, its template keeps the label count bounded
+            route = scope.get("route")
+            _http_request_duration.observe(time.perf_counter() - started_at, scope["method"], getattr(route, "path", "unmatched"), str(status_code))
+
+    async def _send_metrics(self, send: Callable):
+        body = (await metrics.render()).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+_stream_length = metrics.gauge("stream_length", "Entries in a Redis stream", ("stream",))
+_stream_consumer_lag_seconds = metrics.gauge("stream_consumer_lag_seconds", "Age of the oldest entry a consumer has not read yet", ("stream", "consumer"))
+_stream_consumer_lag_entries = metrics.gauge("stream_consumer_lag_entries", "Entries a consumer group has not read yet, when Redis reports it", ("stream", "consumer"))
+_stream_consumer_pending = metrics.gauge("stream_consumer_pending", "Entries delivered to a consumer group but not acknowledged", ("stream", "consumer"))
+_dead_event_queue_depth = metrics.gauge("dead_event_queue_depth", "Entries in the dead event queue")
+_retry_queue_depth = metrics.gauge("retry_queue_depth", "Failed messages waiting for their retry")
+
+async def collect_stream_metrics():
+    """Collector for the lag of the order event stream consumers and the depth of the dead event and retry queues."""
+    for stream in (redis_service.WAITRESS_ORDER_EVENTS, redis_service.KITCHEN_ORDER_EVENTS):
+        # A stream that can't be read leaves its gauges at their last values, the other gauges are still set
+        try:
+            lag = await redis_service.get_stream_lag(stream)
+        except Exception as e:
+            logger.warning("Stream metrics not collected", stream=stream, error=str(e))
+            continue
+
+        _stream_length.set(lag["length"], stream)
+
+        for consumer, consumer_lag in lag["consumers"].items():
+            _stream_consumer_lag_seconds.set(consumer_lag["lag_seconds"], stream, consumer)
+            _stream_consumer_pending.set(consumer_lag["pending"], stream, consumer)
+            if consumer_lag["lag_entries"] is not None:
+                _stream_consumer_lag_entries.set(consumer_lag["lag_entries"], stream, consumer)
+
+    _dead_event_queue_depth.set(await redis_service.get_dead_event_queue_depth())
+    _retry_queue_depth.set(await redis_service.get_waitress_order_retry_queue_depth())
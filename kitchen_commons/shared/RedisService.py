@@ -1,35 +1,243 @@
-from typing import Optional
+import json
+import struct
+import time
+from typing import AsyncIterator, Optional
 import redis.asyncio as redis
 from kitchen_commons.events.Events import BaseEvent
+from kitchen_commons.events.EventCodec import EventCodec, EventEncodingError, FieldEventCodec, decode_event_fields, encode_message_fields, get_event_codec, undecodable_message_data
 from kitchen_commons.models.WaitressServiceModel import Menu
 from kitchen_commons.shared.Settings import settings
 from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Tracing import inject_trace, start_span
 
 class RedisService:
 
     MENU_CACHE_KEY              = "menu_items"
+    MENU_VERSION_KEY            = "menu_version"
+    MENU_INVALIDATION_CHANNEL   = "menu_invalidation"
     
     DEFAULT_TTL_SECONDS         = 3600  # 1 hour
     
     WAITRESS_ORDER_EVENTS       = "waitress_order_events"
     KITCHEN_ORDER_EVENTS        = "kitchen_order_events"
     DEAD_EVENT_QUEUE            = "dead_event_queue"
+    WAITRESS_ORDER_RETRY_QUEUE  = "waitress_order_retry_queue"
+
+    ORDER_ID_COUNTER_KEY        = "event_id_counter"
 
     KITCHEN_LAST_MESSAGE_ID_KEY   = "kitchen_last_message_id"
     WAITRESS_LAST_MESSAGE_ID_KEY  = "waitress_last_message_id"
 
+    # KEYS: stream, counter. ARGV: order_id field, byte offset of the order_id in that field or -1, then field/value pairs.
+    # Increments the counter, writes the new value into the encoded event as the order_id and adds the event to the stream.
+    _PUBLISH_WITH_NEW_ID_SCRIPT = """
+        local order_id = redis.call('INCR', KEYS[2])
+        local order_id_field, offset = ARGV[1], tonumber(ARGV[2])
+        local entry = {}
+
+        for i = 3, #ARGV, 2 do
+            local name, value = ARGV[i], ARGV[i + 1]
+
+            if name == order_id_field then
+                if offset < 0 then
+                    value = tostring(order_id)
+                else
+                    local bytes, remaining = {}, order_id
+                    for b = 1, 8 do
+                        bytes[b] = string.char(remaining % 256)
+                        remaining = math.floor(remaining / 256)
+                    end
+                    value = string.sub(value, 1, offset) .. table.concat(bytes) .. string.sub(value, offset + 9)
+                end
+            end
+
+            entry[#entry + 1] = name
+            entry[#entry + 1] = value
+        end
+
+        local message_id = redis.call('XADD', KEYS[1], '*', unpack(entry))
+        return {order_id, message_id}
+    """
+
+    # KEYS: retry queue, stream. ARGV: queue member, then field/value pairs.
+    # Moves a due retry from the queue back onto the stream, only the caller that removes the member adds the entry.
+    _REINJECT_SCRIPT = """
+        if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+            return redis.call('XADD', KEYS[2], '*', unpack(ARGV, 2))
+        end
+        return false
+    """
+
+    # KEYS: stream, offset key. ARGV: count.
+    # Reads the entries after the stored offset and moves the offset past them.
+    _READ_AND_ADVANCE_SCRIPT = """
+        local last_id = redis.call('GET', KEYS[2]) or '0-0'
+        local messages = redis.call('XRANGE', KEYS[1], '(' .. last_id, '+', 'COUNT', ARGV[1])
+
+        if #messages > 0 then
+            redis.call('SET', KEYS[2], messages[#messages][1])
+        end
+
+        return messages
+    """
+
+    # KEYS: menu cache, menu version. ARGV: menu JSON, TTL in seconds, version the menu was fetched at.
+    # Caches the menu only while the version is unchanged, so a menu fetched before an invalidation never overwrites it.
+    _SET_MENU_CACHE_SCRIPT = """
+        if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[3]) then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+        return 1
+    """
+
     def __init__(self):
-        self.client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db, decode_responses=True)
+        self.event_codec = get_event_codec(settings.event_codec)
+        self.use_clients(
+            redis.Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db, decode_responses=True),
+            # Stream entries may hold binary encoded events, so they are read without decoding responses
+            redis.Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db, decode_responses=False)
+        )
+
+    def use_clients(self, client: redis.Redis, stream_client: redis.Redis):
+        """Switches to other Redis clients, e.g. of a local stand-in. stream_client must not decode responses."""
+        self.client = client
+        self.stream_client = stream_client
+        # Compound operations that take a single round trip, the scripts are loaded on first use
+        self._publish_with_new_id_script = self.stream_client.register_script(self._PUBLISH_WITH_NEW_ID_SCRIPT)
+        self._read_and_advance_script = self.stream_client.register_script(self._READ_AND_ADVANCE_SCRIPT)
+        self._reinject_script = self.client.register_script(self._REINJECT_SCRIPT)
+        self._set_menu_cache_script = self.client.register_script(self._SET_MENU_CACHE_SCRIPT)
 
     async def generate_new_id(self, counter_key: str) -> int: 
         return await self.client.incr(counter_key) # type: ignore
 
+    async def reserve_id_block(self, counter_key: str, size: int) -> int:
+        """Reserves size consecutive IDs on the counter, returns the last one."""
+        return await self.client.incrby(counter_key, size) # type: ignore
+
     async def publish_waitress_order_event(self, base_event: BaseEvent):
         await self._publish_event(self.WAITRESS_ORDER_EVENTS, base_event)
 
+    async def publish_waitress_order_event_with_new_id(self, base_event: BaseEvent, counter_key: str) -> BaseEvent:
+        """Allocates the order_id from counter_key and publishes the event in one atomic step, returns the event with its order_id."""
+        return await self._publish_event_with_new_id(self.WAITRESS_ORDER_EVENTS, counter_key, base_event)
+
     async def consume_waitress_order_event(self, last_id: str = '0-0'):
         return await self._consume_event(self.WAITRESS_ORDER_EVENTS, last_id)
 
+    async def consume_waitress_order_event_batch(self, last_id: str = '0-0', count: int = 1, block: int = 1000) -> list[tuple[str, dict]]:
+        return await self._consume_events(self.WAITRESS_ORDER_EVENTS, last_id, count, block)
+
+    async def create_waitress_order_consumer_group(self, group: str, start_id: str = '0-0'):
+        await self._create_consumer_group(self.WAITRESS_ORDER_EVENTS, group, start_id)
+
+    async def consume_waitress_order_event_group_batch(self, group: str, consumer: str, count: int = 1, block: int = 1000) -> list[tuple[str, dict]]:
+        return await self._consume_group_events(self.WAITRESS_ORDER_EVENTS, group, consumer, count, block)
+
+    async def ack_waitress_order_events(self, group: str, *message_ids: str) -> int:
+        return await self._ack_events(self.WAITRESS_ORDER_EVENTS, group, *message_ids)
+
+    async def claim_stale_waitress_order_events(self, group: str, consumer: str, min_idle_ms: int, count: int = 100) -> list[tuple[str, dict]]:
+        return await self._claim_stale_events(self.WAITRESS_ORDER_EVENTS, group, consumer, min_idle_ms, count)
+
+    async def schedule_waitress_order_retry(self, message_id: str, message_data: dict, retry_count: int, delay_ms: int):
+        """Queues a failed waitress order message to be added to the stream again once delay_ms has passed."""
+        member = json.dumps({"message_id": message_id, "retry_count": retry_count, "message_data": message_data})
+        due_ms = int(time.time() * 1000) + delay_ms
+        await self.client.zadd(self.WAITRESS_ORDER_RETRY_QUEUE, {member: due_ms})
+        logger.info("Message scheduled for retry", message_id=message_id, retry_count=retry_count, delay_ms=delay_ms)
+
+    async def reinject_due_waitress_order_retries(self, count: int = 100) -> int:
+        """
+        Adds queued retries whose backoff has expired to the waitress order stream, returns how many were added.
+        Re-injected entries use the field-per-key format and carry retry_count and retry_of, the ID of the original message,
+        next to the trace fields of the message data.
+        """
+        members = await self.client.zrangebyscore(self.WAITRESS_ORDER_RETRY_QUEUE, "-inf", int(time.time() * 1000), start=0, num=count)
+        reinjected = 0
+
+        for member in members:
+            retry = json.loads(member)
+            fields = encode_message_fields({**retry["message_data"], "retry_count": retry["retry_count"], "retry_of": retry["message_id"]})
+
+            args = [member]
+            for key, value in fields.items():
+                args.extend((key, value))
+
+            # Another replica may have re-injected it already
+            if await self._reinject_script(keys=[self.WAITRESS_ORDER_RETRY_QUEUE, self.WAITRESS_ORDER_EVENTS], args=args):
+                reinjected += 1
+
+        if reinjected:
+            logger.info("Retries re-injected", stream=self.WAITRESS_ORDER_EVENTS, count=reinjected)
+        return reinjected
+
+    async def get_waitress_order_retry_queue_depth(self) -> int:
+        return await self.client.zcard(self.WAITRESS_ORDER_RETRY_QUEUE) # type: ignore
+
+    async def get_dead_event_queue_depth(self) -> int:
+        return await self.client.xlen(self.DEAD_EVENT_QUEUE) # type: ignore
+
+    def get_stream_offset_keys(self, stream: str) -> list[str]:
+        """Returns the keys of the consumers that track their position in a stream in a plain key instead of a consumer group."""
+        if stream == self.WAITRESS_ORDER_EVENTS and not settings.kitchen_use_consumer_group:
+            return [self.WAITRESS_LAST_MESSAGE_ID_KEY]
+        if stream == self.KITCHEN_ORDER_EVENTS:
+            return [self.KITCHEN_LAST_MESSAGE_ID_KEY]
+        return []
+
+    async def get_stream_lag(self, stream: str) -> dict:
+        """
+        Returns the length of a stream and, per consumer (offset key or consumer group), how far it is behind.
+        lag_seconds is the age of the oldest entry the consumer has not read yet, lag_entries is only reported
+        for consumer groups by Redis 7 and later.
+        """
+        # XINFO STREAM would also return the first and last entries, which may be binary encoded
+        length = await self.client.xlen(stream)
+        consumers: dict[str, dict] = {}
+
+        for key in self.get_stream_offset_keys(stream):
+            last_id = await self.client.get(key)
+            if last_id:
+                consumers[key] = {"lag_seconds": await self._get_unread_age_seconds(stream, last_id), "lag_entries": None, "pending": 0} # type: ignore
+
+        try:
+            groups = await self.client.xinfo_groups(stream)
+        except redis.ResponseError:
+            # The stream doesn't exist yet
+            groups = []
+
+        for group in groups:
+            consumers[group["name"]] = {
+                "lag_seconds": await self._get_unread_age_seconds(stream, group["last-delivered-id"]),
+                "lag_entries": group.get("lag"),
+                "pending": group["pending"],
+            }
+
+        return {"length": length, "consumers": consumers}
+
+    async def _get_unread_age_seconds(self, stream: str, last_id: str) -> float:
+        # Entry IDs start with the time they were added at, in milliseconds
+        messages = await self.stream_client.xrange(stream, min=f"({last_id}", max="+", count=1)
+        if not messages:
+            return 0.0
+        return max(time.time() * 1000 - int(messages[0][0].decode().split("-")[0]), 0) / 1000
+
+    async def republish_waitress_order_message(self, message_data: dict) -> str:
+        """Adds decoded message data to the waitress order stream again as a new entry, returns its ID."""
+        message_id = await self.client.xadd(self.WAITRESS_ORDER_EVENTS, encode_message_fields(message_data)) # type: ignore
+        logger.info("Message republished", stream=self.WAITRESS_ORDER_EVENTS, message_id=message_id, order_id=message_data.get("order_id"))
+        return message_id # type: ignore
+
+    async def get_dead_events_after(self, last_id: str, count: int = 100) -> list[tuple[str, dict]]:
+        return await self._get_events_after(self.DEAD_EVENT_QUEUE, last_id, count)
+
+    async def delete_dead_events(self, *message_ids: str) -> int:
+        if not message_ids:
+            return 0
+        return await self.client.xdel(self.DEAD_EVENT_QUEUE, *message_ids) # type: ignore
+
     async def publish_kitchen_order_event(self, base_event: BaseEvent):
         await self._publish_event(self.KITCHEN_ORDER_EVENTS, base_event)
 
@@ -39,23 +247,156 @@ class RedisService:
     async def consume_kitchen_order_event(self, last_id: str = '0-0'):
         return await self._consume_event(self.KITCHEN_ORDER_EVENTS, last_id)
 
+    async def consume_kitchen_order_event_batch(self, last_id: str = '0-0', count: int = 1, block: int = 1000) -> list[tuple[str, dict]]:
+        return await self._consume_events(self.KITCHEN_ORDER_EVENTS, last_id, count, block)
+
+    async def consume_next_kitchen_order_events(self, count: int = 1) -> list[tuple[str, dict]]:
+        """Reads the kitchen order events after the stored offset and advances the offset past them in one atomic step."""
+        return await self._read_and_advance(self.KITCHEN_ORDER_EVENTS, self.KITCHEN_LAST_MESSAGE_ID_KEY, count)
+
+    async def get_kitchen_order_events_after(self, last_id: str, count: int = 100) -> list[tuple[str, dict]]:
+        return await self._get_events_after(self.KITCHEN_ORDER_EVENTS, last_id, count)
+
+    async def get_kitchen_order_events_tail_id(self) -> str:
+        return await self._get_tail_id(self.KITCHEN_ORDER_EVENTS)
+
+    async def _get_events_after(self, stream: str, last_id: str, count: int) -> list[tuple[str, dict]]:
+        # "(" makes the start of the range exclusive
+        return self._decode_messages(await self.stream_client.xrange(stream, min=f"({last_id}", max="+", count=count))
+
+    async def _get_tail_id(self, stream: str) -> str:
+        messages = await self.stream_client.xrevrange(stream, max="+", min="-", count=1)
+        return messages[0][0].decode() if messages else "0-0"
+
     async def _publish_event(self, stream: str, base_event):
-        event_data = base_event.to_redis()
-        await self.client.xadd(stream, event_data) # type: ignore
-        logger.info("Event added to Redis stream", stream=stream, event_data=event_data)
+        # The consumer continues the trace from the publishing span
+        with start_span(f"publish {stream}", order_id=base_event.order_id, stream=stream):
+            (codec, event_data) = self._encode_event(inject_trace(base_event))
+            await self.client.xadd(stream, event_data) # type: ignore
+        logger.info("Event added to Redis stream", stream=stream, codec=codec.name, event_type=getattr(base_event, "event_type", None), order_id=base_event.order_id)
+
+    async def _publish_event_with_new_id(self, stream: str, counter_key: str, base_event: BaseEvent) -> BaseEvent:
+        with start_span(f"publish {stream}", stream=stream) as span:
+            (codec, event_data) = self._encode_event(inject_trace(base_event))
+            (order_id_field, offset) = codec.order_id_slot()
+
+            args: list = [order_id_field, -1 if offset is None else offset]
+            for key, value in event_data.items():
+                args.extend((key, value))
+
+            (order_id, _) = await self._publish_with_new_id_script(keys=[stream, counter_key], args=args)
+            if span is not None:
+                span["order_id"] = order_id
+
+        logger.info("Event added to Redis stream", stream=stream, codec=codec.name, event_type=getattr(base_event, "event_type", None), order_id=order_id)
+        return base_event.model_copy(update={"order_id": order_id})
+
+    def _encode_event(self, base_event: BaseEvent) -> tuple[EventCodec, dict]:
+        """Encodes the event with the configured codec, or with the field codec if a value doesn't fit the binary layout."""
+        try:
+            return (self.event_codec, self.event_codec.encode(base_event))
+        except EventEncodingError as e:
+            # e.g. quantities beyond int32 or dish names holding NUL, field-per-key entries hold any value
+            codec = get_event_codec(FieldEventCodec.name)
+            logger.warning("Event encoded with fallback codec", codec=codec.name, event_type=getattr(base_event, "event_type", None), error=str(e))
+            return (codec, codec.encode(base_event))
+
+    async def _read_and_advance(self, stream: str, offset_key: str, count: int) -> list[tuple[str, dict]]:
+        messages = await self._read_and_advance_script(keys=[stream, offset_key], args=[count])
+        if not messages:
+            logger.info("No new messages in Redis stream", stream=stream)
+            return []
+
+        # Script replies hold entries as [id, [field, value, ...]]
+        return self._decode_messages([(message_id, dict(zip(fields[::2], fields[1::2]))) for message_id, fields in messages])
 
     async def _consume_event(self, stream: str, last_id: str):
-        messages = await self.client.xread({stream: last_id}, count=1, block=1000)
+        messages = await self.stream_client.xread({stream: last_id}, count=1, block=1000)
         if messages:
-            stream, messages_list = messages[0] # type: ignore
-            for message_id, message_data in messages_list:
+            _, messages_list = messages[0] # type: ignore
+            for message_id, message_data in self._decode_messages(messages_list):
                 return message_id, message_data
         else:
             logger.info("No new messages in Redis stream", stream=stream)
 
-    async def set_menu_cache(self, menu: Menu) -> None:
-        await self.client.set(self.MENU_CACHE_KEY, menu.model_dump_json(), ex=self.DEFAULT_TTL_SECONDS)
+    async def _consume_events(self, stream: str, last_id: str, count: int, block: int) -> list[tuple[str, dict]]:
+        messages = await self.stream_client.xread({stream: last_id}, count=count, block=block)
+        if not messages:
+            logger.info("No new messages in Redis stream", stream=stream)
+            return []
+
+        _, messages_list = messages[0] # type: ignore
+        return self._decode_messages(messages_list)
+
+    async def _create_consumer_group(self, stream: str, group: str, start_id: str):
+        try:
+            await self.client.xgroup_create(stream, group, id=start_id, mkstream=True)
+            logger.info("Consumer group created", stream=stream, group=group, start_id=start_id)
+        except redis.ResponseError as e:
+            # BUSYGROUP means another worker has already created the group
+            if "BUSYGROUP" not in str(e):
+                raise
+            logger.info("Consumer group already exists", stream=stream, group=group)
+
+    async def _consume_group_events(self, stream: str, group: str, consumer: str, count: int, block: int) -> list[tuple[str, dict]]:
+        messages = await self.stream_client.xreadgroup(group, consumer, {stream: '>'}, count=count, block=block)
+        if not messages:
+            logger.info("No new messages for consumer group", stream=stream, group=group, consumer=consumer)
+            return []
+
+        _, messages_list = messages[0] # type: ignore
+        return self._decode_messages(messages_list)
+
+    async def _ack_events(self, stream: str, group: str, *message_ids: str) -> int:
+        if not message_ids:
+            return 0
+        acked = await self.client.xack(stream, group, *message_ids)
+        logger.info("Messages acknowledged", stream=stream, group=group, count=acked)
+        return acked # type: ignore
+
+    async def _claim_stale_events(self, stream: str, group: str, consumer: str, min_idle_ms: int, count: int) -> list[tuple[str, dict]]:
+        claimed: list[tuple[str, dict]] = []
+        start_id = '0-0'
+
+        while True:
+            # Redis 7 returns [next_start_id, messages, deleted_ids], older versions omit deleted_ids
+            result = await self.stream_client.xautoclaim(stream, group, consumer, min_idle_ms, start_id=start_id, count=count)
+            start_id, messages = result[0].decode(), result[1]
+            # Entries trimmed from the stream come back as None and can't be processed anymore
+            claimed.extend(self._decode_messages([(message_id, message_data) for message_id, message_data in messages if message_data is not None]))
+            if start_id == '0-0' or len(claimed) >= count:
+                break
+
+        if claimed:
+            logger.warning("Claimed stale pending messages", stream=stream, group=group, consumer=consumer, count=len(claimed))
+        return claimed
+
+    def _decode_messages(self, messages_list) -> list[tuple[str, dict]]:
+        decoded = []
+        # Entries are decoded one by one, so one that can't be decoded is left to the consumer's dead event handling
+        # instead of failing the whole batch
+        for message_id, message_data in messages_list:
+            message_id = message_id.decode()
+            try:
+                decoded.append((message_id, decode_event_fields(message_data)))
+            except (KeyError, ValueError, struct.error) as e:
+                logger.error("Stream entry can't be decoded", message_id=message_id, error=str(e))
+                decoded.append((message_id, undecodable_message_data(message_data, e)))
+        return decoded
+
+    async def set_menu_cache(self, menu: Menu, version: Optional[int] = None) -> bool:
+        """
+        Caches the menu. With version, the menu version read before it was fetched, it is only cached if no invalidation
+        happened since. Returns whether the menu was cached.
+        """
+        if version is None:
+            await self.client.set(self.MENU_CACHE_KEY, menu.model_dump_json(), ex=self.DEFAULT_TTL_SECONDS)
+        elif not await self._set_menu_cache_script(keys=[self.MENU_CACHE_KEY, self.MENU_VERSION_KEY], args=[menu.model_dump_json(), self.DEFAULT_TTL_SECONDS, version]):
+            logger.info("Menu not cached, it was invalidated while being fetched", key=self.MENU_CACHE_KEY, version=version)
+            return False
+
         logger.info("Menu items cached", key=self.MENU_CACHE_KEY)
+        return True
 
     async def get_menu_cache(self) -> Optional[Menu]:
         cached_menu = await self.client.get(self.MENU_CACHE_KEY)
@@ -63,7 +404,7 @@ class RedisService:
         if not cached_menu :
             return None
 
-        logger.info("Menu items fetched from cache under key", key=self.MENU_CACHE_KEY, menu_items=cached_menu)
+        logger.info("Menu items fetched from cache under key", key=self.MENU_CACHE_KEY, size=len(cached_menu))
 
         try:
             return Menu.model_validate_json(cached_menu) # type: ignore
@@ -71,6 +412,53 @@ class RedisService:
             logger.error("Error validating cached menu data", error=str(e))
             return None
 
+    async def get_menu_cache_json(self) -> Optional[str]:
+        """Returns the cached menu as validated JSON, for callers that serve it without building a Menu."""
+        cached_menu = await self.client.get(self.MENU_CACHE_KEY)
+
+        if not cached_menu:
+            return None
+
+        try:
+            Menu.model_validate_json(cached_menu) # type: ignore
+            return cached_menu # type: ignore
+        except Exception as e:
+            logger.error("Error validating cached menu data", error=str(e))
+            return None
+
+    async def get_menu_version(self) -> int:
+        version = await self.client.get(self.MENU_VERSION_KEY)
+        return int(version) if version else 0
+
+    async def invalidate_menu_cache(self) -> int:
+        """Drops the shared menu cache, bumps the menu version and tells every subscriber about it."""
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.MENU_CACHE_KEY)
+            pipe.incr(self.MENU_VERSION_KEY)
+            (_, version) = await pipe.execute()
+
+        await self.client.publish(self.MENU_INVALIDATION_CHANNEL, version)
+        logger.info("Menu cache invalidated", key=self.MENU_CACHE_KEY, version=version)
+        return version
+
+    async def listen_menu_invalidations(self) -> AsyncIterator[int]:
+        """
+        Yields menu versions as they are published. The current version is yielded right after subscribing,
+        so a subscriber also catches up with invalidations published while it was not listening.
+        """
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.MENU_INVALIDATION_CHANNEL)
+
+        try:
+            yield await self.get_menu_version()
+
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield int(message["data"])
+        finally:
+            await pubsub.unsubscribe(self.MENU_INVALIDATION_CHANNEL)
+            await pubsub.aclose()
+
     async def get_last_kitchen_message_id(self,) -> str:
         last_id = await self.client.get(self.KITCHEN_LAST_MESSAGE_ID_KEY)
         logger.info("Retrieved last kitchen message ID", last_id=last_id)
@@ -1,8 +1,26 @@
+import socket
 from pydantic_settings import BaseSettings, SettingsConfigDict
     
 class Settings(BaseSettings): # type: ignore
     debug_mode: bool = True
 
+    # Production logs are rendered and written by a background thread, records beyond log_queue_size are dropped
+    log_async                       : bool = True
+    log_queue_size                  : int = 10000
+    log_max_value_length            : int = 512
+    # Fraction of info and debug events kept per event name, e.g. {"Event added to Redis stream": 0.01}
+    log_sample_rates                : dict[str, float] = {}
+    log_default_sample_rate         : float = 1.0
+
+    # Request latencies are recorded and every service serves its metrics under /metrics
+    metrics_enabled                 : bool = True
+
+    # Orders are traced across the HTTP and stream hops, every service serves the timelines it has seen under /traces
+    tracing_enabled                 : bool = True
+    tracing_max_traces              : int = 1000
+    # Spans are also appended to this file as JSON lines when set, tools/order_timeline.py merges the files of all services
+    tracing_export_path             : str = ""
+
     inventory_service_url   : str = "http://localhost:8000"
     waitress_service_url    : str = "http://localhost:6000"
     kitchen_service_url     : str = "http://localhost:7000"
@@ -11,6 +29,93 @@ class Settings(BaseSettings): # type: ignore
     redis_port: int = 6379
     redis_db: int = 0
 
+    # Connection pooling of the shared HTTP client, every upstream service gets its own pool
+    http_client_timeout_seconds             : float = 30.0
+    http_client_connect_timeout_seconds     : float = 5.0
+    http_client_pool_timeout_seconds        : float = 10.0
+    http_client_max_connections             : int = 100
+    http_client_max_connections_per_host    : int = 50
+    http_client_max_keepalive_connections   : int = 20
+    http_client_keepalive_expiry_seconds    : float = 60.0
+    # HTTP/2 is negotiated over TLS, prior knowledge also speaks it over plain HTTP to servers that support h2c
+    http_client_http2                       : bool = True
+    http_client_http2_prior_knowledge       : bool = False
+
+    # Inter-service calls, only transport errors and retryable status codes are retried
+    api_max_attempts                        : int = 3
+    api_retry_max_wait_seconds              : float = 4.0
+
+    circuit_breaker_failure_threshold       : int = 5
+    circuit_breaker_recovery_seconds        : float = 10.0
+    circuit_breaker_half_open_max_calls     : int = 1
+
+    api_concurrency_initial_limit           : int = 20
+    api_concurrency_min_limit               : int = 1
+    api_concurrency_max_limit               : int = 200
+    api_concurrency_backoff_ratio           : float = 0.9
+    api_concurrency_latency_threshold_ms    : int = 2000
+
+    # Encoding of newly published stream events, "binary" or "fields", both are always readable
+    event_codec                     : str = "binary"
+
+    # SQLite tuning of the inventory database, WAL lets the reader connections run alongside the single writer
+    inventory_db_read_pool_size     : int = 10
+    # Creates a missing database and applies pending schema migrations on startup
+    inventory_db_auto_migrate       : bool = True
+    inventory_db_journal_mode       : str = "WAL"
+    inventory_db_synchronous        : str = "NORMAL"
+    inventory_db_busy_timeout_ms    : int = 5000
+    inventory_db_cache_size_kib     : int = 16384
+    inventory_db_mmap_size_bytes    : int = 268435456
+
+    inventory_cache_enabled         : bool = True
+    # Recipe edits made outside the service don't bump the menu version, so the served menu is also rebuilt this often
+    inventory_menu_ttl_seconds      : int = 60
+    # Recipe check requests with at least this many tasks are answered with one batched query
+    inventory_bulk_check_threshold  : int = 20
+
+    # Order IDs are reserved in blocks of this size per process, 1 allocates every ID together with publishing the order
+    order_id_block_size             : int = 100
+    order_id_refill_threshold       : int = 20
+
+    menu_l1_ttl_seconds             : int = 3600
+    menu_l1_refresh_ahead_seconds   : int = 300
+
+    kitchen_consumer_batch_size     : int = 50
+    kitchen_consumer_concurrency    : int = 10
+    kitchen_consumer_block_ms       : int = 1000
+
+    # Ingredient consumption of concurrently handled orders is sent to the inventory service in batches
+    kitchen_consumption_batching_enabled    : bool = True
+    kitchen_consumption_batch_size          : int = 20
+    kitchen_consumption_batch_wait_ms       : int = 5
+
+    kitchen_use_consumer_group      : bool = True
+    kitchen_consumer_group          : str = "kitchen_workers"
+    kitchen_consumer_name           : str = socket.gethostname()
+    kitchen_claim_min_idle_ms       : int = 60000
+    kitchen_claim_interval_seconds  : int = 30
+
+    # Failed messages are retried with exponential backoff, then moved to the dead event queue
+    kitchen_max_retries             : int = 3
+    kitchen_retry_base_delay_ms     : int = 1000
+    kitchen_retry_max_delay_ms      : int = 60000
+    kitchen_retry_poll_interval_ms  : int = 500
+
+    kitchen_stream_heartbeat_seconds        : int = 15
+    kitchen_stream_subscriber_queue_size    : int = 1000
+
+    # Stream entries are trimmed once every consumer has passed them and they are older or further back than these limits
+    stream_retention_enabled                    : bool = True
+    stream_retention_interval_seconds           : int = 300
+    stream_retention_max_age_seconds            : int = 3600
+    stream_retention_max_length                 : int = 100000
+    # Dead events wait for a replay, 0 keeps them however old or many they are
+    stream_retention_dead_event_max_age_seconds : int = 0
+    stream_retention_dead_event_max_length      : int = 0
+    stream_archive_dir                          : str = "stream_archive"
+    stream_archive_segment_max_entries          : int = 10000
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
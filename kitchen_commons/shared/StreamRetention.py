@@ -0,0 +1,224 @@
+import asyncio
+import base64
+import gzip
+import json
+import os
+import secrets
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.Settings import settings
+
+
+def _stream_id_key(message_id: str) -> tuple[int, int]:
+    (milliseconds, _, sequence) = message_id.partition("-")
+    return (int(milliseconds), int(sequence or 0))
+
+def _next_stream_id(message_id: str) -> str:
+    (milliseconds, sequence) = _stream_id_key(message_id)
+    return f"{milliseconds}-{sequence + 1}"
+
+def _min_stream_id(*message_ids: str) -> str:
+    return min(message_ids, key=_stream_id_key)
+
+def _max_stream_id(*message_ids: str) -> str:
+    return max(message_ids, key=_stream_id_key)
+
+
+class StreamRetention:
+    """
+    Keeps the event streams bounded. Entries become eligible for trimming once they are older than the
+    configured age or beyond the configured length, but never before every consumer of the stream has passed them.
+    The dead event queue has no consumers and limits of its own, by default its entries stay until they are replayed or deleted.
+    Eligible entries are archived to gzip compressed JSON lines segment files before the stream is trimmed with
+    approximate (~) MINID trimming. Segments are written once and never modified, they can be replayed with replay_archive.
+    """
+
+    ARCHIVED_UP_TO_KEY_PREFIX   = "stream_archived_up_to:"
+    LOCK_KEY                    = "stream_retention_lock"
+
+    _READ_BATCH_SIZE = 1000
+
+    # KEYS: lock key. ARGV: owner token. Releases the lock only if this run still holds it.
+    _RELEASE_LOCK_SCRIPT = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return redis.call('DEL', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, archive_dir: Optional[str] = None, max_age_seconds: Optional[int] = None, max_length: Optional[int] = None, segment_max_entries: Optional[int] = None,
+                 dead_event_max_age_seconds: Optional[int] = None, dead_event_max_length: Optional[int] = None):
+        self._archive_dir = archive_dir if archive_dir is not None else settings.stream_archive_dir
+        self._max_age_seconds = max_age_seconds if max_age_seconds is not None else settings.stream_retention_max_age_seconds
+        self._max_length = max_length if max_length is not None else settings.stream_retention_max_length
+        self._dead_event_max_age_seconds = dead_event_max_age_seconds if dead_event_max_age_seconds is not None else settings.stream_retention_dead_event_max_age_seconds
+        self._dead_event_max_length = dead_event_max_length if dead_event_max_length is not None else settings.stream_retention_dead_event_max_length
+        self._segment_max_entries = segment_max_entries if segment_max_entries is not None else settings.stream_archive_segment_max_entries
+
+    async def run(self, interval_seconds: Optional[int] = None):
+        """Applies the retention policy periodically, meant to run as a background task."""
+        interval_seconds = interval_seconds if interval_seconds is not None else settings.stream_retention_interval_seconds
+
+        while True:
+            try:
+                await self.apply()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error applying stream retention", error=str(e))
+
+            await asyncio.sleep(interval_seconds)
+
+    async def apply(self) -> dict[str, int]:
+        """Archives and trims every stream once, returns the number of entries removed per stream."""
+        # Only one service replica archives and trims at a time
+        token = f"{settings.kitchen_consumer_name}:{secrets.token_hex(8)}"
+        if not await redis_service.client.set(self.LOCK_KEY, token, nx=True, ex=settings.stream_retention_interval_seconds):
+            logger.info("Stream retention is running elsewhere, skipping")
+            return {}
+
+        try:
+            return {stream: await self.apply_to_stream(stream) for stream in self._get_streams()}
+        finally:
+            # A run that outlived the lock must not release the lock another replica has taken since
+            if not await redis_service.client.eval(self._RELEASE_LOCK_SCRIPT, 1, self.LOCK_KEY, token): # type: ignore
+                logger.warning("Stream retention lock expired before the run finished", lock_ttl_seconds=settings.stream_retention_interval_seconds)
+
+    async def apply_to_stream(self, stream: str) -> int:
+        trim_before = _min_stream_id(await self._get_policy_boundary(stream), await self._get_consumed_boundary(stream))
+
+        if trim_before == "0-0":
+            return 0
+
+        archived = await self._archive_before(stream, trim_before)
+        trimmed = await redis_service.stream_client.xtrim(stream, minid=trim_before, approximate=True)
+
+        logger.info("Stream retention applied", stream=stream, trim_before=trim_before, archived=archived, trimmed=trimmed)
+        return trimmed # type: ignore
+
+    def _get_streams(self) -> list[str]:
+        return [redis_service.WAITRESS_ORDER_EVENTS, redis_service.KITCHEN_ORDER_EVENTS, redis_service.DEAD_EVENT_QUEUE]
+
+    def _get_limits(self, stream: str) -> tuple[int, int]:
+        """Returns the maximum age in seconds and the maximum length of a stream, 0 means unlimited."""
+        if stream == redis_service.DEAD_EVENT_QUEUE:
+            return (self._dead_event_max_age_seconds, self._dead_event_max_length)
+        return (self._max_age_seconds, self._max_length)
+
+    async def _get_policy_boundary(self, stream: str) -> str:
+        # Entries before the returned ID are too old or beyond the length limit
+        (max_age_seconds, max_length) = self._get_limits(stream)
+        age_boundary = f"{max(int(time.time() * 1000) - max_age_seconds * 1000, 0)}-0" if max_age_seconds > 0 else "0-0"
+
+        if max_length <= 0:
+            return age_boundary
+
+        excess = await redis_service.stream_client.xlen(stream) - max_length # type: ignore
+        if excess <= 0:
+            return age_boundary
+
+        messages = await redis_service.stream_client.xrange(stream, min="-", max="+", count=excess + 1)
+        return _max_stream_id(age_boundary, messages[-1][0].decode())
+
+    async def _get_consumed_boundary(self, stream: str) -> str:
+        # Entries before the returned ID have been passed by every consumer
+        boundaries: list[str] = []
+
+        for key in redis_service.get_stream_offset_keys(stream):
+            last_id = await redis_service.client.get(key)
+            # A consumer that never stored an offset can't hold the stream forever, the age and length limits still apply
+            if last_id:
+                boundaries.append(_next_stream_id(last_id)) # type: ignore
+
+        try:
+            groups = await redis_service.client.xinfo_groups(stream)
+        except Exception:
+            # The stream doesn't exist yet
+            groups = []
+
+        for group in groups:
+            boundaries.append(_next_stream_id(group["last-delivered-id"]))
+            if group["pending"]:
+                pending = await redis_service.client.xpending(stream, group["name"])
+                boundaries.append(pending["min"])
+
+        # A stream nobody consumes is only bounded by the age and length limits
+        return _min_stream_id(*boundaries) if boundaries else f"{int(time.time() * 1000) + 1}-0"
+
+    async def _archive_before(self, stream: str, trim_before: str) -> int:
+        # Approximate trimming leaves some archived entries behind, so archiving resumes after the last archived ID
+        archived_up_to = await redis_service.client.get(self.ARCHIVED_UP_TO_KEY_PREFIX + stream) or "0-0"
+        archived = 0
+        segment: list[tuple[str, dict]] = []
+
+        while True:
+            count = min(self._READ_BATCH_SIZE, self._segment_max_entries - len(segment))
+            messages = await redis_service.stream_client.xrange(stream, min=f"({archived_up_to}", max=f"({trim_before}", count=count)
+            segment.extend((message_id.decode(), message_data) for message_id, message_data in messages)
+
+            if len(segment) >= self._segment_max_entries or (segment and len(messages) < count):
+                await asyncio.to_thread(self._write_segment, stream, segment)
+                archived_up_to = segment[-1][0]
+                await redis_service.client.set(self.ARCHIVED_UP_TO_KEY_PREFIX + stream, archived_up_to)
+                archived += len(segment)
+                segment = []
+            elif messages:
+                archived_up_to = messages[-1][0].decode()
+
+            if len(messages) < count:
+                return archived
+
+    def _write_segment(self, stream: str, entries: list[tuple[str, dict]]):
+        directory = os.path.join(self._archive_dir, stream)
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, f"{entries[0][0]}_{entries[-1][0]}.jsonl.gz")
+        temporary_path = path + ".tmp"
+
+        # Field values may be binary encoded events, they are stored base64 encoded
+        with gzip.open(temporary_path, "wt", encoding="utf-8") as segment_file:
+            for message_id, message_data in entries:
+                fields = {key.decode(): base64.b64encode(value).decode() for key, value in message_data.items()}
+                segment_file.write(json.dumps({"id": message_id, "fields": fields}) + "\n")
+
+        # The segment only shows up under its final name once it is complete
+        os.replace(temporary_path, path)
+        logger.info("Stream segment archived", stream=stream, path=path, entries=len(entries))
+
+
+def iter_archived_entries(stream: str, archive_dir: Optional[str] = None, after_id: str = "0-0") -> Iterator[tuple[str, dict[str, bytes]]]:
+    """Yields (message_id, raw fields) of the archived entries of a stream in stream order, starting after after_id."""
+    directory = os.path.join(archive_dir if archive_dir is not None else settings.stream_archive_dir, stream)
+
+    if not os.path.isdir(directory):
+        return
+
+    segments = [name for name in os.listdir(directory) if name.endswith(".jsonl.gz")]
+
+    for name in sorted(segments, key=lambda name: _stream_id_key(name.split("_")[0])):
+        # Skip segments that end before the requested position
+        if _stream_id_key(name.removesuffix(".jsonl.gz").split("_")[1]) <= _stream_id_key(after_id):
+            continue
+
+        with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as segment_file:
+            for line in segment_file:
+                record = json.loads(line)
+                if _stream_id_key(record["id"]) > _stream_id_key(after_id):
+                    yield (record["id"], {key: base64.b64decode(value) for key, value in record["fields"].items()})
+
+async def replay_archive(stream: str, target_stream: Optional[str] = None, archive_dir: Optional[str] = None, after_id: str = "0-0") -> AsyncIterator[tuple[str, str]]:
+    """
+    Appends the archived entries of a stream to target_stream, the original stream by default.
+    Replayed entries get new IDs, (original ID, new ID) is yielded for every entry.
+    """
+    target_stream = target_stream or stream
+
+    for message_id, fields in iter_archived_entries(stream, archive_dir, after_id):
+        new_id = await redis_service.stream_client.xadd(target_stream, fields) # type: ignore
+        yield (message_id, new_id.decode())
+
+
+stream_retention = StreamRetention()
@@ -0,0 +1,333 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+from urllib.parse import parse_qs
+
+import structlog
+
+from kitchen_commons.events.Events import BaseEvent
+from kitchen_commons.shared.Logging import DroppingQueueHandler, logger
+from kitchen_commons.shared.Settings import settings
+
+
+class TraceContext(NamedTuple):
+    """The trace an order belongs to and the span that is running in it."""
+    trace_id: str
+    span_id: str
+
+
+_current_trace: contextvars.ContextVar[Optional[TraceContext]] = contextvars.ContextVar("current_trace", default=None)
+_current_service: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_service", default=None)
+
+def current_trace() -> Optional[TraceContext]:
+    return _current_trace.get()
+
+def new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+def new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+def format_traceparent(trace: TraceContext) -> str:
+    """W3C trace context header value, always sampled."""
+    return f"00-{trace.trace_id}-{trace.span_id}-01"
+
+TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+SPAN_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+
+def is_valid_trace(trace_id: str, span_id: str) -> bool:
+    """True for lowercase hex IDs of the W3C lengths that aren't all zeros."""
+    return (
+        TRACE_ID_PATTERN.match(trace_id) is not None and SPAN_ID_PATTERN.match(span_id) is not None
+        and trace_id != "0" * 32 and span_id != "0" * 16
+    )
+
+def parse_traceparent(header: Optional[str]) -> Optional[TraceContext]:
+    """Reads a W3C traceparent header (version-trace_id-parent_id-flags), None when it is missing or malformed."""
+    parts = header.split("-") if header else []
+    if len(parts) < 4 or not is_valid_trace(parts[1], parts[2]):
+        return None
+    return TraceContext(parts[1], parts[2])
+
+
+def inject_trace(event: BaseEvent) -> BaseEvent:
+    """Returns the event stamped with the current span and the time it is published at, as is when no span is running."""
+    trace = _current_trace.get()
+    if trace is None or not settings.tracing_enabled:
+        return event
+    return event.model_copy(update={"trace_id": trace.trace_id, "span_id": trace.span_id, "published_at": time.time()})
+
+def inject_trace_fields(message_data: dict) -> dict:
+    """Same as inject_trace for decoded message data that is about to be published again, e.g. as a retry."""
+    trace = _current_trace.get()
+    if trace is None or not settings.tracing_enabled:
+        return message_data
+    return {**message_data, "trace_id": trace.trace_id, "span_id": trace.span_id, "published_at": time.time()}
+
+def extract_trace(message_data: dict) -> tuple[Optional[TraceContext], float]:
+    """Returns the span that published a decoded event and when, (None, 0.0) for events published without a trace."""
+    trace_id = message_data.get("trace_id")
+    span_id = message_data.get("span_id")
+    if not trace_id or not span_id or not is_valid_trace(str(trace_id), str(span_id)):
+        return (None, 0.0)
+
+    try:
+        published_at = float(message_data.get("published_at") or 0.0)
+    except ValueError:
+        published_at = 0.0
+
+    return (TraceContext(str(trace_id), str(span_id)), published_at)
+
+def _get_order_id(message_data: dict) -> Optional[int]:
+    try:
+        return int(message_data["order_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class _SpanFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, default=str)
+
+
+class TraceCollector:
+    """
+    Keeps the spans of the most recent max_traces traces of this process, and finds a trace by its order_id.
+    With export_path set, every kept span is also appended to that file as a JSON line by a background thread.
+    Lone root spans outside of any order, like polls that found nothing, are not kept.
+    """
+
+    def __init__(self, max_traces: Optional[int] = None, export_path: Optional[str] = None):
+        self._max_traces = max_traces if max_traces is not None else settings.tracing_max_traces
+        # Trace ID -> spans in the order they ended, least recently updated trace first
+        self._traces: OrderedDict[str, list[dict]] = OrderedDict()
+        self._order_traces: OrderedDict[int, str] = OrderedDict()
+        self._export_logger = self._create_export_logger(export_path) if export_path else None
+
+    def record(self, span: dict):
+        trace_id = span["trace_id"]
+        spans = self._traces.get(trace_id)
+
+        if spans is None:
+            if span["parent_id"] is None and span["order_id"] is None:
+                return
+            spans = self._traces[trace_id] = []
+            if len(self._traces) > self._max_traces:
+                self._traces.popitem(last=False)
+        else:
+            self._traces.move_to_end(trace_id)
+
+        spans.append(span)
+
+        if span["order_id"] is not None:
+            self._order_traces[span["order_id"]] = trace_id
+            if len(self._order_traces) > self._max_traces:
+                self._order_traces.popitem(last=False)
+
+        if self._export_logger is not None:
+            self._export_logger.info(span)
+
+    def get_spans(self, trace_id: str) -> list[dict]:
+        return list(self._traces.get(trace_id, []))
+
+    def get_order_spans(self, order_id: int) -> list[dict]:
+        trace_id = self._order_traces.get(order_id)
+        return self.get_spans(trace_id) if trace_id else []
+
+    def get_recent_traces(self, limit: int) -> list[list[dict]]:
+        """Returns the spans of the limit most recently updated traces, most recent first."""
+        trace_ids = list(self._traces)[-limit:] if limit > 0 else []
+        return [self.get_spans(trace_id) for trace_id in reversed(trace_ids)]
+
+    def clear(self):
+        self._traces.clear()
+        self._order_traces.clear()
+
+    def _create_export_logger(self, export_path: str) -> logging.Logger:
+        file_handler = logging.FileHandler(export_path, encoding="utf-8")
+        file_handler.setFormatter(_SpanFormatter())
+
+        span_queue: queue.Queue = queue.Queue()
+        listener = logging.handlers.QueueListener(span_queue, file_handler)
+        listener.start()
+        # Writes out what is still queued on exit
+        atexit.register(listener.stop)
+
+        export_logger = logging.getLogger("kitchen_commons.traces")
+        export_logger.setLevel(logging.INFO)
+        export_logger.propagate = False
+        export_logger.addHandler(DroppingQueueHandler(span_queue, settings.log_queue_size))
+        return export_logger
+
+trace_collector = TraceCollector(export_path=settings.tracing_export_path or None)
+
+
+def _new_span(name: str, parent: Optional[TraceContext], service: Optional[str], order_id: Optional[int], start: float, attributes: dict) -> dict:
+    return {
+        "trace_id": parent.trace_id if parent is not None else new_trace_id(),
+        "span_id": new_span_id(),
+        "parent_id": parent.span_id if parent is not None else None,
+        "name": name,
+        "service": service or _current_service.get(),
+        "order_id": order_id,
+        "start": start,
+        "duration_ms": 0.0,
+        **attributes,
+    }
+
+@contextmanager
+def start_span(name: str, parent: Optional[TraceContext] = None, service: Optional[str] = None, order_id: Optional[int] = None, **attributes: Any) -> Iterator[Optional[dict]]:
+    """
+    Runs the block in a new span, a child of parent or else of the current span, or the root of a new trace.
+    The span's IDs are bound to the log context while it runs. Yields the span, so attributes like the order_id can
+    be set once known, or None when tracing is off.
+    """
+    if not settings.tracing_enabled:
+        yield None
+        return
+
+    span = _new_span(name, parent or _current_trace.get(), service, order_id, time.time(), attributes)
+    started_at = time.perf_counter()
+
+    trace_token = _current_trace.set(TraceContext(span["trace_id"], span["span_id"]))
+    service_token = _current_service.set(span["service"])
+    log_tokens = structlog.contextvars.bind_contextvars(trace_id=span["trace_id"], span_id=span["span_id"])
+
+    try:
+        yield span
+    except BaseException as e:
+        span["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        structlog.contextvars.reset_contextvars(**log_tokens)
+        _current_service.reset(service_token)
+        _current_trace.reset(trace_token)
+
+        span["duration_ms"] = round((time.perf_counter() - started_at) * 1000, 3)
+        trace_collector.record(span)
+
+def record_span(name: str, parent: Optional[TraceContext], start: float, end: float, service: Optional[str] = None, order_id: Optional[int] = None, **attributes: Any) -> Optional[TraceContext]:
+    """Records a span that already ended, e.g. the time an event waited in a stream. Times are epoch seconds."""
+    if not settings.tracing_enabled:
+        return None
+
+    span = _new_span(name, parent, service, order_id, start, attributes)
+    span["duration_ms"] = round(max(end - start, 0.0) * 1000, 3)
+    trace_collector.record(span)
+    return TraceContext(span["trace_id"], span["span_id"])
+
+@contextmanager
+def consume_span(name: str, stream: str, message_data: dict, service: Optional[str] = None) -> Iterator[Optional[dict]]:
+    """
+    Continues the trace of a consumed stream event: the time it waited in the stream is recorded as a span,
+    then the block runs in a span that follows it.
+    """
+    if not settings.tracing_enabled:
+        yield None
+        return
+
+    (parent, published_at) = extract_trace(message_data)
+    order_id = _get_order_id(message_data)
+
+    if parent is not None and published_at:
+        parent = record_span(f"queue {stream}", parent, published_at, time.time(), service, order_id, stream=stream)
+
+    with start_span(name, parent, service, order_id) as span:
+        yield span
+
+
+def build_timeline(spans: list[dict]) -> dict:
+    """Orders the spans of one trace by start time, with every span's offset from the start of the trace."""
+    if not spans:
+        return {}
+
+    ordered = sorted(spans, key=lambda span: span["start"])
+    started_at = ordered[0]["start"]
+    ended_at = max(span["start"] + span["duration_ms"] / 1000 for span in ordered)
+
+    return {
+        "trace_id": ordered[0]["trace_id"],
+        "order_id": next((span["order_id"] for span in ordered if span.get("order_id") is not None), None),
+        "start": started_at,
+        "duration_ms": round((ended_at - started_at) * 1000, 3),
+        "spans": [{**span, "offset_ms": round((span["start"] - started_at) * 1000, 3)} for span in ordered],
+    }
+
+
+def _get_header(scope: dict, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+class TracingMiddleware:
+    """
+    ASGI middleware that runs every HTTP request in a span, continuing the trace of the caller's traceparent header,
+    and serves the timelines of the traces collected by this process under path, filtered with ?order_id= or ?trace_id=.
+    Usage: app.add_middleware(TracingMiddleware, service="waitress"). Websocket and lifespan traffic passes through untouched.
+    """
+
+    def __init__(self, app: Any, service: str, path: str = "/traces", max_listed_traces: int = 100):
+        self.app = app
+        self.service = service
+        self.path = path
+        self.max_listed_traces = max_listed_traces
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope["type"] != "http" or not settings.tracing_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] == self.path:
+            await self._send_traces(scope, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: dict):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with start_span(f"{scope['method']} {scope['path']}", parse_traceparent(_get_header(scope, b"traceparent")), self.service) as span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # Named after the route template once the router has matched it, like the request metrics
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    span["name"] = f"{scope['method']} {route}" # type: ignore
+                span["status"] = status_code # type: ignore
+
+    async def _send_traces(self, scope: dict, send: Callable):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        status_code = 200
+
+        try:
+            if "order_id" in query:
+                traces = [trace_collector.get_order_spans(int(query["order_id"][0]))]
+            elif "trace_id" in query:
+                traces = [trace_collector.get_spans(query["trace_id"][0])]
+            else:
+                traces = trace_collector.get_recent_traces(min(int(query.get("limit", [self.max_listed_traces])[0]), self.max_listed_traces))
+            body = json.dumps({"traces": [build_timeline(spans) for spans in traces if spans]}, default=str).encode()
+        except ValueError as e:
+            logger.warning("Invalid traces query", query=query, error=str(e))
+            (status_code, body) = (400, json.dumps({"detail": "Invalid traces query"}).encode())
+
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,8 +1,15 @@
 from kitchen_commons.shared.APIRequest import APIRequest
+from kitchen_commons.shared.CircuitBreaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from kitchen_commons.shared.ConcurrencyLimiter import ConcurrencyLimiter, get_concurrency_limiter
 from kitchen_commons.shared.HTTPClientManager import http_client_manager
+from kitchen_commons.shared.HTTPCaching import compute_etag, etag_matches
+from kitchen_commons.shared.IdAllocator import IdAllocator
 from kitchen_commons.shared.Settings import settings
-from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Logging import logger, Lazy, get_log_queue_stats
+from kitchen_commons.shared.Metrics import metrics, MetricsRegistry, MetricsMiddleware, collect_stream_metrics
 from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.StreamRetention import StreamRetention, stream_retention, iter_archived_entries, replay_archive
+from kitchen_commons.shared.Tracing import TracingMiddleware, start_span, current_trace, trace_collector, build_timeline
 from kitchen_commons.shared.Lifecycle import (
     startup_http_client,
     shutdown_http_client,
@@ -12,10 +19,33 @@ from kitchen_commons.shared.Lifecycle import (
 
 __all__ = [
     "APIRequest",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "get_circuit_breaker",
+    "ConcurrencyLimiter",
+    "get_concurrency_limiter",
     "http_client_manager",
+    "compute_etag",
+    "etag_matches",
+    "IdAllocator",
     "settings",
     "logger",
+    "Lazy",
+    "get_log_queue_stats",
+    "metrics",
+    "MetricsRegistry",
+    "MetricsMiddleware",
+    "collect_stream_metrics",
     "redis_service",
+    "StreamRetention",
+    "stream_retention",
+    "iter_archived_entries",
+    "replay_archive",
+    "TracingMiddleware",
+    "start_span",
+    "current_trace",
+    "trace_collector",
+    "build_timeline",
     "startup_http_client",
     "shutdown_http_client",
     "startup_redis",
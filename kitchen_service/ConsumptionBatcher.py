@@ -0,0 +1,83 @@
+import asyncio
+import contextvars
+import time
+from typing import Awaitable, Callable, Optional
+
+from kitchen_commons.models.InventoryServiceModel import ConsumeOrderIngridientsRequest, ConsumeOrderIngridientsResponse
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Settings import settings
+from kitchen_commons.shared.Tracing import TraceContext, current_trace, record_span, start_span
+
+
+class ConsumptionBatcher:
+    """
+    Collects the ingredient consumption requests of concurrently handled orders and sends them to the inventory
+    service as one batched call. A batch is sent once it holds max_batch_size orders or max_wait_ms after its first
+    order arrived, whichever comes first. Every caller gets the result of its own order, or the error of the call.
+    A batch is sent in a trace of its own, the trace of every order in it gets a span linking to that trace.
+    """
+
+    def __init__(self, send_batch: Callable[[list[ConsumeOrderIngridientsRequest]], Awaitable[list[ConsumeOrderIngridientsResponse]]], max_batch_size: Optional[int] = None, max_wait_ms: Optional[int] = None):
+        self._send_batch = send_batch
+        self._max_batch_size = max_batch_size if max_batch_size is not None else settings.kitchen_consumption_batch_size
+        self._max_wait_ms = max_wait_ms if max_wait_ms is not None else settings.kitchen_consumption_batch_wait_ms
+
+        # Requests with the future of their caller and the span they were submitted from
+        self._pending: list[tuple[ConsumeOrderIngridientsRequest, asyncio.Future, Optional[TraceContext]]] = []
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        # Batches being sent, kept referenced until they complete
+        self._in_flight: set[asyncio.Task] = set()
+
+    async def submit(self, request: ConsumeOrderIngridientsRequest) -> ConsumeOrderIngridientsResponse:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((request, future, current_trace()))
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self._max_wait_ms / 1000, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        (batch, self._pending) = (self._pending, [])
+        if not batch:
+            return
+
+        # Sent from a clean context, so the call isn't attributed to whichever order filled the batch
+        task = asyncio.create_task(self._send(batch), context=contextvars.Context())
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: list[tuple[ConsumeOrderIngridientsRequest, asyncio.Future, Optional[TraceContext]]]):
+        with start_span("consumption batch", service="kitchen", orders=len(batch)) as batch_span:
+            started_at = time.time()
+            error = None
+
+            try:
+                responses = await self._send_batch([request for request, _, _ in batch])
+
+                if len(responses) != len(batch):
+                    raise Exception(f"Inventory service returned {len(responses)} results for {len(batch)} orders")
+
+                logger.info("Consumption batch sent", orders=len(batch))
+
+                for (_, future, _), response in zip(batch, responses):
+                    if not future.done():
+                        future.set_result(response)
+            except Exception as e:
+                error = str(e)
+                logger.error("Consumption batch failed", orders=len(batch), error=error)
+
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            if batch_span is not None:
+                for _, _, trace in batch:
+                    if trace is not None:
+                        record_span("consumption batch", trace, started_at, time.time(), "kitchen", batch_trace_id=batch_span["trace_id"], orders=len(batch), **({"error": error} if error else {}))
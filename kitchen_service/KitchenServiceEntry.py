@@ -13,6 +13,10 @@ from .KitchenServiceLogic import KitchenServiceLogic
 from fastapi import FastAPI, status
 
 from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Metrics import MetricsMiddleware, collect_stream_metrics, metrics
+from kitchen_commons.shared.Tracing import TracingMiddleware
+from kitchen_commons.shared.Settings import settings
+from kitchen_commons.shared.StreamRetention import stream_retention
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -28,9 +32,20 @@ async def lifespan(app: FastAPI):
     kitchen_service_logic = await KitchenServiceLogic.create()  
     # Start the background task to consume waitress order events
     asyncio.create_task(kitchen_service_logic.consume_waitress_order_events())
+    # Failed messages wait in the retry queue instead of holding up the consumer
+    retry_scheduler_task = asyncio.create_task(kitchen_service_logic.run_retry_scheduler())
+    # Archive and trim the event streams in the background
+    retention_task = asyncio.create_task(stream_retention.run()) if settings.stream_retention_enabled else None
+    # Stream lag and queue depths are read from Redis when metrics are scraped
+    metrics.register_collector(collect_stream_metrics)
 
     yield
 
+    metrics.unregister_collector(collect_stream_metrics)
+    retry_scheduler_task.cancel()
+    if retention_task is not None:
+        retention_task.cancel()
+
     await shutdown_http_client()
     await shutdown_redis()
 
@@ -39,3 +54,5 @@ async def lifespan(app: FastAPI):
     logger.info("########################################################################")
 
 app = FastAPI(title="Kitchen service", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware, service="kitchen")
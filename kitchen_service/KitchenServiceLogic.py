@@ -4,18 +4,50 @@ import traceback
 import redis
 
 from kitchen_commons.events.Events import DeadEvent, OrderCanceled, OrderPlaced, OrderReady
-from kitchen_commons.models.InventoryServiceModel import ConsumeRecipeIngridientsRequest, ConsumeRecipeIngridientsResponse, ConsumeRecipeIngridientsTask
+from kitchen_commons.events.EventCodec import UNDECODABLE_FIELDS
+from kitchen_commons.models.InventoryServiceModel import ConsumeOrderIngridientsRequest, ConsumeOrderIngridientsResponse, ConsumeOrdersIngridientsRequest, ConsumeOrdersIngridientsResponse, ConsumeRecipeIngridientsTask
 
 from kitchen_commons.shared.RedisService import redis_service
 from kitchen_commons.shared.Settings import settings
 from kitchen_commons.shared.Logging import logger
 from kitchen_commons.shared.APIRequest import APIRequest
+from kitchen_commons.shared.Tracing import consume_span, inject_trace_fields
+from .ConsumptionBatcher import ConsumptionBatcher
+
+
+class MalformedMessageError(Exception):
+    """Raised when a consumed message can't be parsed into an event, it fails the same way every time."""
+
+
+def _to_int(value, default: int = 0) -> int:
+    # Fields of a malformed message may hold anything, they must not keep it from the DLQ
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
 
 class KitchenServiceLogic:
+
+    def __init__(self):
+        self.batch_size = settings.kitchen_consumer_batch_size
+        self._semaphore = asyncio.Semaphore(settings.kitchen_consumer_concurrency)
+        # IDs processed successfully but not yet committed because an earlier message in the batch failed
+        self._processed_ahead: set[str] = set()
+
+        self.use_consumer_group = settings.kitchen_use_consumer_group
+        self.consumer_group = settings.kitchen_consumer_group
+        self.consumer_name = settings.kitchen_consumer_name
+        self._next_claim_at = 0.0
+
+        self._consumption_batcher = ConsumptionBatcher(self.consume_orders_ingredients) if settings.kitchen_consumption_batching_enabled else None
     
     async def _initialize_last_message_id(self):
         self.last_waitress_message_id = await redis_service.get_last_waitress_message_id()
 
+    async def _initialize_consumer_group(self):
+        # A new group starts from the stored offset so switching modes neither replays nor skips orders
+        await redis_service.create_waitress_order_consumer_group(self.consumer_group, self.last_waitress_message_id)
+
     # 3. The async factory using @classmethod
     @classmethod
     async def create(cls):
@@ -24,28 +56,24 @@ class KitchenServiceLogic:
         """
         instance = cls()
         await instance._initialize_last_message_id()
+        if instance.use_consumer_group:
+            await instance._initialize_consumer_group()
         return instance
 
 
     async def consume_waitress_order_events(self):
         while True:
             try:
-                message_id, message_data = await redis_service.consume_waitress_order_event(self.last_waitress_message_id) or (None, None)
-                
-                if message_id is None or message_data is None:
-                    await asyncio.sleep(5)
+                messages = await self.read_waitress_order_events()
+
+                if not messages:
                     continue
 
-                logger.info("Consumed waitress order event", message_id=message_id, message_data=message_data)
+                logger.info("Consumed waitress order events", count=len(messages), first_message_id=messages[0][0], last_message_id=messages[-1][0])
 
-                try:
+                handled = await self.process_messages(messages)
 
-                    await self.process_message(message_data)
-                    self.last_waitress_message_id = message_id # type: ignore
-                    await redis_service.set_last_waitress_message_id(self.last_waitress_message_id)
-                except Exception as e:
-                    logger.error("Error processing waitress order event", error=str(e))
-                    self.handle_processing_failure(message_id, message_data, e)
+                await self.commit_waitress_order_events(messages, handled)
             
             except redis.ConnectionError as e:
                 logger.error("Redis connection error", error=str(e))
@@ -54,40 +82,174 @@ class KitchenServiceLogic:
                 logger.error("Error processing waitress order event", error=str(e))
                 logger.error(traceback.format_exc())
 
-    async def handle_processing_failure(self, message_id, message_data, error):
-        retry_count = await redis_service.client.hincrby(f"retry:{message_id}", "count", 1)
-        
-        if retry_count > 3:
-            # Move to DLQ
-            await redis_service.publish_error_event(DeadEvent(
-                order_id=int(message_data.get('order_id', 0)),
-                table_no=int(message_data.get('table_no', 0)),
-                comments="Moved to DLQ after exceeding retry limit",
-                message_id=message_id,
-                original_message=json.dumps(message_data),
-                error=str(error)
-            ))
-            logger.error("Message moved to DLQ", message_id=message_id)
-            self.last_waitress_message_id = message_id
-            await redis_service.set_last_waitress_message_id(message_id)
-        else:
-            await asyncio.sleep(2 ** retry_count)  
+    async def read_waitress_order_events(self) -> list[tuple[str, dict]]:
+        if not self.use_consumer_group:
+            return await redis_service.consume_waitress_order_event_batch(
+                self.last_waitress_message_id,
+                count=self.batch_size,
+                block=settings.kitchen_consumer_block_ms
+            )
+
+        # Periodically take over messages left pending by dead workers or by failed processing
+        now = asyncio.get_running_loop().time()
+        if now >= self._next_claim_at:
+            self._next_claim_at = now + settings.kitchen_claim_interval_seconds
+            claimed = await redis_service.claim_stale_waitress_order_events(
+                self.consumer_group,
+                self.consumer_name,
+                settings.kitchen_claim_min_idle_ms,
+                count=self.batch_size
+            )
+            if claimed:
+                return claimed
+
+        return await redis_service.consume_waitress_order_event_group_batch(
+            self.consumer_group,
+            self.consumer_name,
+            count=self.batch_size,
+            block=settings.kitchen_consumer_block_ms
+        )
+
+    async def commit_waitress_order_events(self, messages: list[tuple[str, dict]], handled: dict[str, bool]):
+        if self.use_consumer_group:
+            # Handled messages are acknowledged one by one, failed ones stay pending until claimed again
+            await redis_service.ack_waitress_order_events(self.consumer_group, *(message_id for message_id, _ in messages if handled.get(message_id)))
+            return
+
+        # The offset is committed once per batch, and only up to the last message
+        # that was fully handled, so nothing is skipped if the service dies mid-batch
+        committed_id = None
+        for index, (message_id, _) in enumerate(messages):
+            if not handled.get(message_id):
+                self._processed_ahead.update(later_id for later_id, _ in messages[index + 1:] if handled.get(later_id))
+                break
+            committed_id = message_id
+            self._processed_ahead.discard(message_id)
+
+        if committed_id is not None:
+            self.last_waitress_message_id = committed_id
+            await redis_service.set_last_waitress_message_id(committed_id)
+
+    async def process_messages(self, messages: list[tuple[str, dict]]) -> dict[str, bool]:
+        """
+        Processes a batch of stream messages concurrently and returns, per message ID, whether
+        the message was handled. Messages belonging to the same order are processed sequentially
+        in stream order, and stop at the first one that fails.
+        """
+        orders: dict[str, list[tuple[str, dict]]] = {}
+        for message_id, message_data in messages:
+            orders.setdefault(str(message_data.get('order_id', message_id)), []).append((message_id, message_data))
+
+        handled: dict[str, bool] = {}
+
+        async def process_order_messages(order_messages: list[tuple[str, dict]]):
+            async with self._semaphore:
+                for message_id, message_data in order_messages:
+                    if message_id in self._processed_ahead:
+                        handled[message_id] = True
+                        continue
+
+                    handled[message_id] = await self.process_message_safely(message_id, message_data)
+
+                    # Later events of the same order must wait until this one is handled
+                    if not handled[message_id]:
+                        break
+
+        await asyncio.gather(*(process_order_messages(order_messages) for order_messages in orders.values()))
+
+        return handled
+
+    async def process_message_safely(self, message_id: str, message_data: dict) -> bool:
+        """Processes a single message and returns True once it no longer needs to be redelivered."""
+        # Continues the order's trace from the span that published the message
+        with consume_span(f"process {message_data.get('event_type')}", redis_service.WAITRESS_ORDER_EVENTS, message_data, service="kitchen") as span:
+            try:
+                await self.process_message(message_data)
+                return True
+            except Exception as e:
+                logger.error("Error processing waitress order event", message_id=message_id, error=str(e))
+                if span is not None:
+                    span["error"] = str(e)
+                return await self.handle_processing_failure(message_id, message_data, e)
+
+    async def handle_processing_failure(self, message_id, message_data, error) -> bool:
+        """
+        Hands a failed message over to the delayed retry queue, or to the DLQ once the retry limit is reached
+        or the message can never succeed. Returns False only if neither worked, so the message is redelivered.
+        """
+        # Re-injected retries carry the retry count and the ID of the original message
+        original_message_id = message_data.get('retry_of', message_id)
+        retry_count = _to_int(message_data.get('retry_count', 0)) + 1
+        original_message = {key: value for key, value in message_data.items() if key not in ('retry_count', 'retry_of')}
+
+        try:
+            # Malformed messages fail the same way every time, errors of downstream calls may not
+            if retry_count > settings.kitchen_max_retries or isinstance(error, MalformedMessageError):
+                await redis_service.publish_error_event(DeadEvent(
+                    order_id=_to_int(message_data.get('order_id', 0)),
+                    table_no=_to_int(message_data.get('table_no', 0)),
+                    comments="Moved to DLQ after exceeding retry limit" if not isinstance(error, MalformedMessageError) else "Moved to DLQ, message can't be processed",
+                    message_id=original_message_id,
+                    original_message=json.dumps(original_message),
+                    error=str(error)
+                ))
+                logger.error("Message moved to DLQ", message_id=original_message_id, retry_count=retry_count - 1)
+                return True
+
+            delay_ms = min(settings.kitchen_retry_base_delay_ms * 2 ** (retry_count - 1), settings.kitchen_retry_max_delay_ms)
+            # The retry continues the trace from the failed attempt, its backoff shows up as time spent in the stream
+            await redis_service.schedule_waitress_order_retry(original_message_id, inject_trace_fields(original_message), retry_count, delay_ms)
+            return True
+        except Exception as e:
+            logger.error("Error handing over failed message", message_id=message_id, error=str(e))
+            return False
+
+    async def run_retry_scheduler(self):
+        """Puts failed messages back on the waitress order stream once their backoff has expired, meant to run as a background task."""
+        while True:
+            try:
+                # A full batch means more retries may be due already
+                if await redis_service.reinject_due_waitress_order_retries(count=self.batch_size) == self.batch_size:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error re-injecting retries", error=str(e))
+
+            await asyncio.sleep(settings.kitchen_retry_poll_interval_ms / 1000)
 
     async def process_message(self, message_data):
-        match message_data.get('event_type'):
-            case 'OrderPlaced':
-                await self.handle_order_placed(OrderPlaced.from_redis(message_data))
-            case 'OrderCanceled':
-                await self.handle_order_canceled(OrderCanceled.model_validate(message_data))
-            case default:
-                logger.error("Unknown event type", event_type=message_data.get('event_type'))
-                raise Exception(f"Unknown event type: {message_data.get('event_type')}")
+        event = self.parse_message(message_data)
+
+        if isinstance(event, OrderPlaced):
+            await self.handle_order_placed(event)
+        else:
+            await self.handle_order_canceled(event)
+
+    def parse_message(self, message_data: dict) -> OrderPlaced | OrderCanceled:
+        """Turns consumed message data into its event, raises MalformedMessageError if it can't."""
+        # The dead event keeps the raw fields of the entry
+        if UNDECODABLE_FIELDS in message_data:
+            raise MalformedMessageError(f"Undecodable event: {message_data.get('decode_error')}")
+
+        try:
+            match message_data.get('event_type'):
+                case 'OrderPlaced':
+                    return OrderPlaced.from_redis(message_data)
+                case 'OrderCanceled':
+                    return OrderCanceled.model_validate(message_data)
+        except ValueError as e:
+            # Covers pydantic's ValidationError and undecodable JSON items
+            raise MalformedMessageError(str(e)) from e
+
+        logger.error("Unknown event type", event_type=message_data.get('event_type'))
+        raise MalformedMessageError(f"Unknown event type: {message_data.get('event_type')}")
 
     async def handle_order_placed(self, event: OrderPlaced):
 
         logger.info("Processing order placed event", order_id=event.order_id, items=event.items, table_no=event.table_no)
 
-        consumeRequest = ConsumeRecipeIngridientsRequest(
+        consumeRequest = ConsumeOrderIngridientsRequest(
             user_id="kitchen_service",
             tasks=[]
         )
@@ -110,14 +272,30 @@ class KitchenServiceLogic:
             )
 
             logger.info("Publishing order canceled event", order_id=event.order_id)
-            await redis_service.publish_kitchen_order_event(orderCanceled.to_redis()) # type: ignore
+            await redis_service.publish_kitchen_order_event(orderCanceled) # type: ignore
             return
 
-        result = await self.consume_recipe_ingredients(consumeRequest)
+        # Orders handled at the same time share one inventory call
+        if self._consumption_batcher is not None:
+            result = await self._consumption_batcher.submit(consumeRequest)
+        else:
+            result = await self.consume_order_ingredients(consumeRequest)
 
         order_consumption_comments = [f"{consumptionResult.recipe_name}: {'Success' if consumptionResult.consumed else 'Failed'} - {consumptionResult.comments}" for consumptionResult in result.results]
 
-        logger.info("Order ingredient consumption results", order_id=event.order_id, results=order_consumption_comments)
+        logger.info("Order ingredient consumption results", order_id=event.order_id, consumed=result.consumed, results=order_consumption_comments)
+
+        # Ingredients are consumed for the whole order or not at all, so a partial order is never cooked
+        if not result.consumed:
+            orderCanceled = OrderCanceled(
+                order_id = event.order_id,
+                table_no = event.table_no,
+                comments = ", ".join(order_consumption_comments)
+            )
+
+            logger.info("Publishing order canceled event", order_id=event.order_id)
+            await redis_service.publish_kitchen_order_event(orderCanceled) # type: ignore
+            return
 
         orderReady = OrderReady(
             order_id = event.order_id,
@@ -130,21 +308,42 @@ class KitchenServiceLogic:
     async def handle_order_canceled(self, event: OrderCanceled):
         logger.info("Processing order canceled event", order_id=event.order_id, table_no=event.table_no)
 
-    async def consume_recipe_ingredients(self, request: ConsumeRecipeIngridientsRequest) -> ConsumeRecipeIngridientsResponse:
+    async def consume_order_ingredients(self, request: ConsumeOrderIngridientsRequest) -> ConsumeOrderIngridientsResponse:
 
-        logger.info("consume_recipe_ingredients called", user_id=request.user_id, tasks=len(request.tasks))
+        logger.info("consume_order_ingredients called", user_id=request.user_id, tasks=len(request.tasks))
 
-        URL = settings.inventory_service_url + "/consumeRecipeIngridients"
+        URL = settings.inventory_service_url + "/consumeOrderIngridients"
 
         api_request = APIRequest(APIRequest.Method.POST, URL, request.model_dump())
 
         response = await api_request.sendRequest()
 
         if response:
-            result = ConsumeRecipeIngridientsResponse.model_validate(response.json())
-            logger.info("consume_recipe_ingredients result", user_id=request.user_id, tasks=len(request.tasks), result=result)
+            result = ConsumeOrderIngridientsResponse.model_validate(response.json())
+            logger.info("consume_order_ingredients result", user_id=request.user_id, tasks=len(request.tasks), result=result)
         else:
-            logger.error("Failed to consume recipe ingredients after retries", user_id=request.user_id, tasks=len(request.tasks))
-            raise Exception("Failed to consume recipe ingredients from Inventory Service")
+            logger.error("Failed to consume order ingredients after retries", user_id=request.user_id, tasks=len(request.tasks))
+            raise Exception("Failed to consume order ingredients from Inventory Service")
         
-        return result           
\ No newline at end of file
+        return result
+
+    async def consume_orders_ingredients(self, requests: list[ConsumeOrderIngridientsRequest]) -> list[ConsumeOrderIngridientsResponse]:
+
+        logger.info("consume_orders_ingredients called", orders=len(requests))
+
+        URL = settings.inventory_service_url + "/consumeOrdersIngridients"
+
+        batchRequest = ConsumeOrdersIngridientsRequest(user_id="kitchen_service", orders=requests)
+
+        api_request = APIRequest(APIRequest.Method.POST, URL, batchRequest.model_dump())
+
+        response = await api_request.sendRequest()
+
+        if response:
+            result = ConsumeOrdersIngridientsResponse.model_validate(response.json())
+            logger.info("consume_orders_ingredients result", orders=len(requests), consumed=sum(order.consumed for order in result.results))
+        else:
+            logger.error("Failed to consume orders ingredients after retries", orders=len(requests))
+            raise Exception("Failed to consume orders ingredients from Inventory Service")
+
+        return result.results
@@ -0,0 +1,37 @@
+import fakeredis
+import pytest
+
+from inventory_service.Repository.InventoryRepository import InventoryRepository
+from kitchen_commons.shared.RedisService import redis_service
+
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def fake_redis():
+    """Points the shared RedisService at an in-memory Redis for the duration of a test."""
+    (client, stream_client) = (redis_service.client, redis_service.stream_client)
+    server = fakeredis.FakeServer()
+    redis_service.use_clients(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), fakeredis.FakeAsyncRedis(server=server))
+    yield redis_service
+    redis_service.use_clients(client, stream_client)
+
+@pytest.fixture
+async def inventory_repository(tmp_path):
+    """Repository on a fresh database in tmp_path, holding a Pizza recipe made of one Dough and one Cheese, 1000 of each in stock."""
+    repository = InventoryRepository(pool_size=2)
+    repository._DB_PATH = str(tmp_path / "kitchen.db")
+    await repository.initialize_pool()
+
+    async with repository.get_write_connection() as conn:
+        await conn.execute("INSERT INTO recipes (name, description) VALUES ('Pizza', '')")
+        await conn.executemany("INSERT INTO recipeingridient (recipe, name, requiredQty) VALUES ('Pizza', ?, 1)", [("Dough",), ("Cheese",)])
+        await conn.executemany("INSERT INTO supplies (name, qty) VALUES (?, ?)", [("Dough", 1000), ("Cheese", 1000)])
+        await conn.commit()
+    await repository.reload_cache()
+
+    yield repository
+    await repository.close_pool()
@@ -0,0 +1,184 @@
+import asyncio
+import itertools
+
+import httpx
+import pytest
+from tenacity import wait_none
+
+from kitchen_commons.shared.APIRequest import APIRequest
+from kitchen_commons.shared.CircuitBreaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from kitchen_commons.shared.ConcurrencyLimiter import ConcurrencyLimiter, get_concurrency_limiter
+from kitchen_commons.shared.HTTPClientManager import http_client_manager
+from kitchen_commons.shared.Settings import settings
+
+_upstream_ids = itertools.count()
+
+
+@pytest.fixture
+async def upstream(monkeypatch):
+    """
+    Mounts a mock upstream on a host of its own, so every test gets a fresh circuit breaker and concurrency limiter.
+    Set upstream.handler to answer the calls, upstream.calls counts them.
+    """
+    class Upstream:
+        url = f"http://upstream-{next(_upstream_ids)}.test"
+        calls = 0
+        handler = staticmethod(lambda request: httpx.Response(200, json={}))
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        Upstream.calls += 1
+        return Upstream.handler(request)
+
+    monkeypatch.setattr(APIRequest.sendRequest.retry, "wait", wait_none())
+    mount = f"all://{httpx.URL(Upstream.url).netloc.decode()}"
+    http_client_manager.mount(mount, httpx.MockTransport(handle))
+    await http_client_manager.start()
+
+    yield Upstream
+
+    await http_client_manager.stop()
+    http_client_manager._custom_mounts.pop(mount)
+
+def _raise(error: Exception):
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise error
+    return handler
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(("method", "handler", "expected_calls"), [
+    (APIRequest.Method.POST, _raise(httpx.ConnectError("refused")), settings.api_max_attempts),
+    (APIRequest.Method.POST, _raise(httpx.ReadTimeout("timed out")), 1),
+    (APIRequest.Method.POST, lambda request: httpx.Response(503), settings.api_max_attempts),
+    (APIRequest.Method.POST, lambda request: httpx.Response(502), 1),
+    (APIRequest.Method.GET, _raise(httpx.ReadTimeout("timed out")), settings.api_max_attempts),
+    (APIRequest.Method.GET, lambda request: httpx.Response(502), settings.api_max_attempts),
+    (APIRequest.Method.GET, lambda request: httpx.Response(404), 1),
+])
+async def test_retries_depend_on_the_method_and_the_failure(upstream, method, handler, expected_calls):
+    upstream.handler = handler
+
+    with pytest.raises((httpx.TransportError, httpx.HTTPStatusError)):
+        await APIRequest(method, upstream.url + "/orders", {}).sendRequest()
+
+    assert upstream.calls == expected_calls
+
+@pytest.mark.anyio
+async def test_open_circuit_fails_fast(upstream):
+    upstream.handler = lambda request: httpx.Response(500)
+
+    for _ in range(settings.circuit_breaker_failure_threshold):
+        with pytest.raises((httpx.HTTPStatusError, CircuitOpenError)):
+            await APIRequest(APIRequest.Method.GET, upstream.url).sendRequest()
+
+    calls = upstream.calls
+    with pytest.raises(CircuitOpenError):
+        await APIRequest(APIRequest.Method.GET, upstream.url).sendRequest()
+
+    assert upstream.calls == calls
+
+
+def test_circuit_opens_after_consecutive_failures_and_closes_after_a_trial():
+    circuit_breaker = CircuitBreaker("test", failure_threshold=2, recovery_seconds=0.05, half_open_max_calls=1)
+
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == CircuitBreaker.State.CLOSED
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == CircuitBreaker.State.OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+
+    circuit_breaker._opened_at -= 0.05
+    assert circuit_breaker.state == CircuitBreaker.State.HALF_OPEN
+    circuit_breaker.before_request()
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == CircuitBreaker.State.CLOSED
+
+def test_failed_trial_opens_the_circuit_again():
+    circuit_breaker = CircuitBreaker("test", failure_threshold=1, recovery_seconds=0)
+
+    circuit_breaker.record_failure()
+    circuit_breaker.before_request()
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker._state == CircuitBreaker.State.OPEN
+
+def test_released_trial_slot_can_be_taken_again():
+    circuit_breaker = CircuitBreaker("test", failure_threshold=1, recovery_seconds=0, half_open_max_calls=1)
+    circuit_breaker.record_failure()
+
+    circuit_breaker.before_request()
+    circuit_breaker.release_trial()
+    circuit_breaker.before_request()
+
+    with pytest.raises(CircuitOpenError):
+        circuit_breaker.before_request()
+
+@pytest.mark.anyio
+async def test_cancelled_call_gives_its_trial_slot_back(upstream):
+    upstream.handler = lambda request: httpx.Response(500)
+    for _ in range(settings.circuit_breaker_failure_threshold):
+        with pytest.raises((httpx.HTTPStatusError, CircuitOpenError)):
+            await APIRequest(APIRequest.Method.GET, upstream.url).sendRequest()
+
+    circuit_breaker = get_circuit_breaker(httpx.URL(upstream.url).netloc.decode())
+    circuit_breaker._opened_at -= settings.circuit_breaker_recovery_seconds
+
+    # The limiter is full, so the trial call waits for a slot until it is cancelled
+    concurrency_limiter = get_concurrency_limiter(httpx.URL(upstream.url).netloc.decode())
+    for _ in range(concurrency_limiter.limit):
+        await concurrency_limiter.acquire()
+
+    call = asyncio.ensure_future(APIRequest(APIRequest.Method.GET, upstream.url).sendRequest())
+    await asyncio.sleep(0.01)
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    assert circuit_breaker.state == CircuitBreaker.State.HALF_OPEN
+    circuit_breaker.before_request()
+
+
+@pytest.mark.anyio
+async def test_limit_grows_additively_and_backs_off_multiplicatively():
+    concurrency_limiter = ConcurrencyLimiter("test", initial_limit=10, min_limit=2, max_limit=11, backoff_ratio=0.5, latency_threshold_ms=1000)
+
+    for _ in range(10):
+        await concurrency_limiter.acquire()
+        await concurrency_limiter.release(0.01)
+    assert concurrency_limiter.limit == 10
+
+    for _ in range(20):
+        await concurrency_limiter.acquire()
+        await concurrency_limiter.release(0.01)
+    assert concurrency_limiter.limit == 11
+
+    await concurrency_limiter.acquire()
+    await concurrency_limiter.release(0.01, dropped=True)
+    assert concurrency_limiter.limit == 5
+
+    # Slow calls back off like failed ones, never below the minimum
+    for _ in range(5):
+        await concurrency_limiter.acquire()
+        await concurrency_limiter.release(2.0)
+    assert concurrency_limiter.limit == 2
+
+@pytest.mark.anyio
+async def test_calls_over_the_limit_wait_for_a_slot():
+    concurrency_limiter = ConcurrencyLimiter("test", initial_limit=2, min_limit=1, max_limit=2)
+    await concurrency_limiter.acquire()
+    await concurrency_limiter.acquire()
+
+    waiting = asyncio.ensure_future(concurrency_limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+
+    await concurrency_limiter.release(0.01)
+    await asyncio.wait_for(waiting, timeout=1)
+    assert concurrency_limiter.in_flight == 2
@@ -0,0 +1,66 @@
+import pytest
+
+from kitchen_commons.events.EventCodec import BinaryEventCodec, EventEncodingError, FieldEventCodec, decode_event_fields
+from kitchen_commons.events.Events import DeadEvent, OrderPlaced
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+
+
+@pytest.mark.parametrize("items", [
+    [],
+    [{"Pizza": 2}],
+    [{"Pizza": 1}, {"Soup": 3}],
+    [{"Pizza": 1, "Salad": 2}, {}, {"Soup": 3}],
+    [{"Gemüse-Suppe": -1}],
+])
+def test_binary_round_trip(items):
+    event = OrderPlaced(order_id=42, table_no=7, comments="no onions", items=items)
+
+    assert decode_event_fields(BinaryEventCodec().encode(event)) == {**event.model_dump(exclude={"trace_id", "span_id", "published_at"})}
+
+def test_binary_round_trip_of_traced_event():
+    event = OrderPlaced(order_id=42, table_no=7, comments="", items=[{"Pizza": 1}], trace_id=TRACE_ID, span_id=SPAN_ID, published_at=1700000000.5)
+
+    assert decode_event_fields(BinaryEventCodec().encode(event)) == event.model_dump()
+
+def test_binary_round_trip_of_dead_event():
+    event = DeadEvent(order_id=1, table_no=2, comments="Moved to DLQ", message_id="1-0", original_message='{"order_id": "abc"}', error="boom")
+
+    assert decode_event_fields(BinaryEventCodec().encode(event)) == event.model_dump(exclude={"trace_id", "span_id", "published_at"})
+
+def test_field_round_trip():
+    event = OrderPlaced(order_id=42, table_no=7, comments="", items=[{"Pizza": 1}])
+
+    assert OrderPlaced.from_redis(decode_event_fields(FieldEventCodec().encode(event))) == event
+
+@pytest.mark.parametrize("items", [
+    [{"": 1}],
+    [{"Pizza\0Soup": 1}],
+    [{"Pizza": 2 ** 31}],
+    [{f"Dish {index}": 1 for index in range(2 ** 16)}],
+])
+def test_binary_rejects_items_it_cannot_represent(items):
+    with pytest.raises(EventEncodingError):
+        BinaryEventCodec().encode(OrderPlaced(order_id=1, table_no=1, comments="", items=items))
+
+def test_binary_rejects_table_no_beyond_int32():
+    with pytest.raises(EventEncodingError):
+        BinaryEventCodec().encode(OrderPlaced(order_id=1, table_no=2 ** 31, comments="", items=[]))
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(("items", "table_no"), [
+    ([{"": 1}], 1),
+    ([{"Pizza\0Soup": 1}, {"Salad": 2}], 1),
+    ([{"Pizza": 2 ** 40}], 1),
+    ([{"Pizza": 1}], 2 ** 40),
+])
+async def test_events_that_do_not_fit_the_binary_layout_are_published_field_per_key(fake_redis, items, table_no):
+    event = await fake_redis.publish_waitress_order_event_with_new_id(OrderPlaced(order_id=0, table_no=table_no, comments="", items=items), fake_redis.ORDER_ID_COUNTER_KEY)
+    await fake_redis.publish_waitress_order_event(event)
+
+    messages = await fake_redis.consume_waitress_order_event_batch("0-0", count=10)
+
+    assert len(messages) == 2
+    for _, message_data in messages:
+        assert OrderPlaced.from_redis(message_data).model_dump(include={"order_id", "table_no", "items"}) == {"order_id": event.order_id, "table_no": table_no, "items": items}
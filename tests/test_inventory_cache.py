@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+from inventory_service.Repository.InventoryRepository import InventoryRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def _get_supply_levels(repository: InventoryRepository) -> dict[str, int]:
+    async with repository.get_connection() as conn:
+        async with conn.execute("SELECT name, qty FROM supplies") as cursor:
+            return {name: qty for (name, qty) in await cursor.fetchall()}
+
+async def test_cache_matches_database_after_concurrent_loads_and_consumptions(inventory_repository):
+    async def consume():
+        await inventory_repository.consume_orders_ingridients([[("Pizza", 1)]])
+
+    initial_levels = await _get_supply_levels(inventory_repository)
+
+    for _ in range(20):
+        await asyncio.gather(inventory_repository.reload_cache(), consume(), consume(), inventory_repository.reload_cache(), consume())
+
+    supply_levels = await _get_supply_levels(inventory_repository)
+    assert supply_levels == {name: qty - 60 for name, qty in initial_levels.items()}
+    assert inventory_repository._cache._supplies == supply_levels
+
+async def test_cache_reports_recipe_unmakeable_once_consumed(inventory_repository):
+    results = await inventory_repository.consume_orders_ingridients([[("Pizza", (await _get_supply_levels(inventory_repository))["Dough"])]])
+
+    assert results == [[(True, "Ingredients consumed successfully")]]
+    assert await inventory_repository.get_recipe_availability("Pizza") == (True, False)
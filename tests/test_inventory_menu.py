@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from inventory_service.InventoryServiceLogic import InventoryServiceLogic
+from kitchen_commons.shared.Settings import settings
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def inventory_service(fake_redis, inventory_repository):
+    service_logic = InventoryServiceLogic()
+    service_logic.inventory_repository = inventory_repository
+    return service_logic
+
+async def _add_recipe_out_of_band(inventory_repository, name: str):
+    async with inventory_repository.get_write_connection() as conn:
+        await conn.execute("INSERT INTO recipes (name, description) VALUES (?, '')", (name,))
+        await conn.commit()
+
+def _get_menu_names(menu_body: bytes) -> list[str]:
+    return [item["name"] for item in json.loads(menu_body)["items"]]
+
+async def test_menu_is_served_from_memory_within_its_ttl(inventory_service, inventory_repository, fake_redis):
+    (menu_body, etag) = await inventory_service.get_menu_response()
+    await _add_recipe_out_of_band(inventory_repository, "Soup")
+
+    assert await inventory_service.get_menu_response() == (menu_body, etag)
+    assert _get_menu_names(menu_body) == ["Pizza"]
+
+async def test_menu_edited_out_of_band_is_rebuilt_after_its_ttl(inventory_service, inventory_repository, fake_redis, monkeypatch):
+    (_, etag) = await inventory_service.get_menu_response()
+    version = await fake_redis.get_menu_version()
+    await _add_recipe_out_of_band(inventory_repository, "Soup")
+
+    monkeypatch.setattr(settings, "inventory_menu_ttl_seconds", 0)
+    (menu_body, new_etag) = await inventory_service.get_menu_response()
+
+    assert _get_menu_names(menu_body) == ["Pizza", "Soup"]
+    assert new_etag != etag
+    # The waitress menu caches are invalidated as well
+    assert await fake_redis.get_menu_version() == version + 1
+
+async def test_unchanged_menu_keeps_its_version_after_its_ttl(inventory_service, fake_redis, monkeypatch):
+    (_, etag) = await inventory_service.get_menu_response()
+    version = await fake_redis.get_menu_version()
+
+    monkeypatch.setattr(settings, "inventory_menu_ttl_seconds", 0)
+
+    assert (await inventory_service.get_menu_response())[1] == etag
+    assert await fake_redis.get_menu_version() == version
+
+async def test_inventory_cache_invalidation_rebuilds_the_menu(inventory_service, inventory_repository, fake_redis):
+    await inventory_service.get_menu_response()
+    await _add_recipe_out_of_band(inventory_repository, "Soup")
+
+    inventory_service.invalidate_inventory_cache()
+
+    assert _get_menu_names((await inventory_service.get_menu_response())[0]) == ["Pizza", "Soup"]
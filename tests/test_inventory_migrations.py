@@ -0,0 +1,72 @@
+import aiosqlite
+import pytest
+
+from inventory_service.Repository import InventoryMigrations
+from inventory_service.Repository.InventoryMigrations import SCHEMA_VERSION, apply_migrations, get_schema_version
+from inventory_service.Repository.InventoryRepository import InventoryRepository
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def conn(tmp_path):
+    async with aiosqlite.connect(tmp_path / "kitchen.db") as conn:
+        yield conn
+
+async def _get_names(conn: aiosqlite.Connection, kind: str) -> set[str]:
+    async with conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,)) as cursor:
+        return {name for (name,) in await cursor.fetchall()}
+
+async def test_new_database_is_brought_to_the_latest_version(conn):
+    assert await apply_migrations(conn) == SCHEMA_VERSION
+
+    assert await get_schema_version(conn) == SCHEMA_VERSION
+    assert {"recipes", "recipeingridient", "supplies"} <= await _get_names(conn, "table")
+    assert {"idx_recipeingridient_recipe", "idx_supplies_name_qty"} <= await _get_names(conn, "index")
+
+async def test_applying_migrations_again_changes_nothing(conn):
+    await apply_migrations(conn)
+    await conn.execute("INSERT INTO supplies (name, qty) VALUES ('Dough', 5)")
+    await conn.commit()
+
+    assert await apply_migrations(conn) == SCHEMA_VERSION
+
+    async with conn.execute("SELECT qty FROM supplies WHERE name = 'Dough'") as cursor:
+        assert await cursor.fetchone() == (5,)
+
+async def test_only_pending_migrations_are_applied(conn, monkeypatch):
+    monkeypatch.setattr(InventoryMigrations, "MIGRATIONS", InventoryMigrations.MIGRATIONS[:1])
+    await apply_migrations(conn)
+    assert "idx_recipeingridient_recipe" not in await _get_names(conn, "index")
+
+    monkeypatch.undo()
+
+    assert await apply_migrations(conn) == SCHEMA_VERSION
+    assert "idx_recipeingridient_recipe" in await _get_names(conn, "index")
+
+async def test_failed_migration_leaves_the_previous_version(conn, monkeypatch):
+    await apply_migrations(conn)
+    monkeypatch.setattr(InventoryMigrations, "SCHEMA_VERSION", SCHEMA_VERSION + 1)
+    monkeypatch.setattr(InventoryMigrations, "MIGRATIONS", InventoryMigrations.MIGRATIONS + [
+        (SCHEMA_VERSION + 1, "Broken", ["CREATE TABLE broken (id INTEGER)", "SELECT * FROM missing_table"]),
+    ])
+
+    with pytest.raises(aiosqlite.OperationalError):
+        await apply_migrations(conn)
+
+    assert await get_schema_version(conn) == SCHEMA_VERSION
+    assert "broken" not in await _get_names(conn, "table")
+
+async def test_newer_database_is_refused(conn):
+    await conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+
+    with pytest.raises(RuntimeError):
+        await apply_migrations(conn)
+
+async def test_availability_query_is_served_by_the_covering_index(conn):
+    await apply_migrations(conn)
+
+    async with conn.execute(f"EXPLAIN QUERY PLAN {InventoryRepository._RECIPE_AVAILABILITY_QUERY}", (1, "Pizza")) as cursor:
+        plan = " ".join(row[-1] for row in await cursor.fetchall())
+
+    assert "COVERING INDEX idx_recipeingridient_recipe" in plan
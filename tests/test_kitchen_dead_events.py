@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from kitchen_commons.events.Events import OrderPlaced
+from kitchen_service.KitchenServiceLogic import KitchenServiceLogic
+
+pytestmark = pytest.mark.anyio
+
+MALFORMED_ORDER = {"event_type": "OrderPlaced", "order_id": "abc", "table_no": "x", "comments": "", "items": "[]"}
+
+
+async def _consume_once(service_logic: KitchenServiceLogic):
+    messages = await service_logic.read_waitress_order_events()
+    handled = await service_logic.process_messages(messages)
+    await service_logic.commit_waitress_order_events(messages, handled)
+    return messages
+
+def _offset_mode_service_logic() -> KitchenServiceLogic:
+    service_logic = KitchenServiceLogic()
+    service_logic.use_consumer_group = False
+    service_logic.last_waitress_message_id = "0-0"
+    return service_logic
+
+@pytest.mark.parametrize("fields", [
+    MALFORMED_ORDER,
+    {**MALFORMED_ORDER, "order_id": "1", "table_no": "1", "items": "[{"},
+    {**MALFORMED_ORDER, "order_id": "1", "table_no": "1", "event_type": "OrderEaten"},
+    # Binary entry with an unknown event type code
+    {"b": b"\x02\x09" + bytes(12)},
+])
+async def test_malformed_message_is_dead_lettered_and_offset_advances(fake_redis, fields):
+    message_id = await fake_redis.client.xadd(fake_redis.WAITRESS_ORDER_EVENTS, fields)
+    service_logic = _offset_mode_service_logic()
+
+    await _consume_once(service_logic)
+
+    dead_events = await fake_redis.get_dead_events_after("0-0")
+    assert [dead_event["message_id"] for _, dead_event in dead_events] == [message_id]
+    assert dead_events[0][1]["comments"] == "Moved to DLQ, message can't be processed"
+    assert await fake_redis.get_waitress_order_retry_queue_depth() == 0
+
+    assert service_logic.last_waitress_message_id == message_id
+    assert await fake_redis.get_last_waitress_message_id() == message_id
+
+async def test_malformed_message_is_dead_lettered_and_acked_in_group_mode(fake_redis):
+    await fake_redis.client.xadd(fake_redis.WAITRESS_ORDER_EVENTS, MALFORMED_ORDER)
+
+    service_logic = KitchenServiceLogic()
+    service_logic.use_consumer_group = True
+    service_logic.last_waitress_message_id = "0-0"
+    await service_logic._initialize_consumer_group()
+
+    assert len(await _consume_once(service_logic)) == 1
+
+    assert await fake_redis.get_dead_event_queue_depth() == 1
+    pending = await fake_redis.client.xpending(fake_redis.WAITRESS_ORDER_EVENTS, service_logic.consumer_group)
+    assert pending["pending"] == 0
+
+async def test_downstream_decode_error_is_retried(fake_redis, monkeypatch):
+    await fake_redis.publish_waitress_order_event(OrderPlaced(order_id=1, table_no=1, comments="", items=[{"Pizza": 1}]))
+    service_logic = _offset_mode_service_logic()
+    service_logic._consumption_batcher = None
+
+    async def html_from_proxy(request):
+        # A proxy in front of the inventory service answered with an HTML error page
+        return json.loads("<html>502 Bad Gateway</html>")
+
+    monkeypatch.setattr(service_logic, "consume_order_ingredients", html_from_proxy)
+
+    await _consume_once(service_logic)
+
+    assert await fake_redis.get_waitress_order_retry_queue_depth() == 1
+    assert await fake_redis.get_dead_event_queue_depth() == 0
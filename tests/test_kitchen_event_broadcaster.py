@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from kitchen_commons.events.Events import OrderReady
+from waitress_service.KitchenEventBroadcaster import KitchenEventBroadcaster
+
+pytestmark = pytest.mark.anyio
+
+
+async def _publish_ready_orders(redis_service, *table_nos: int) -> list[str]:
+    for order_id, table_no in enumerate(table_nos, start=1):
+        await redis_service.publish_kitchen_order_event(OrderReady(order_id=order_id, table_no=table_no, comments=""))
+    return [message_id for message_id, _ in await redis_service.get_kitchen_order_events_after("0-0")]
+
+async def _next_ids(subscription, count: int) -> list[str]:
+    return [(await asyncio.wait_for(subscription.__anext__(), timeout=1))[0] for _ in range(count)]
+
+async def test_replays_events_after_the_last_event_id_and_skips_them_when_live(fake_redis):
+    message_ids = await _publish_ready_orders(fake_redis, 1, 1, 1)
+    broadcaster = KitchenEventBroadcaster()
+    subscription = broadcaster.subscribe(message_ids[0])
+
+    assert await _next_ids(subscription, 2) == message_ids[1:]
+
+    # The tail delivers the replayed events again, then a new one
+    for message_id in message_ids + ["9999999999999-0"]:
+        broadcaster._broadcast((message_id, {"table_no": 1}))
+
+    assert await _next_ids(subscription, 1) == ["9999999999999-0"]
+    await subscription.aclose()
+
+async def test_live_events_up_to_the_last_event_id_are_skipped_without_replay(fake_redis):
+    message_ids = await _publish_ready_orders(fake_redis, 1, 1)
+    broadcaster = KitchenEventBroadcaster()
+    subscription = broadcaster.subscribe(message_ids[-1])
+    first = asyncio.ensure_future(subscription.__anext__())
+    await asyncio.sleep(0.01)
+
+    for message_id in message_ids + ["9999999999999-0"]:
+        broadcaster._broadcast((message_id, {"table_no": 1}))
+
+    assert (await asyncio.wait_for(first, timeout=1))[0] == "9999999999999-0"
+    await subscription.aclose()
+
+async def test_subscriber_only_gets_its_tables(fake_redis):
+    message_ids = await _publish_ready_orders(fake_redis, 1, 2, 3, 2)
+    broadcaster = KitchenEventBroadcaster()
+    subscription = broadcaster.subscribe("0-0", tables={2})
+
+    assert await _next_ids(subscription, 2) == [message_ids[1], message_ids[3]]
+
+    broadcaster._broadcast(("9999999999999-0", {"table_no": 1}))
+    broadcaster._broadcast(("9999999999999-1", {"table_no": 2}))
+
+    assert await _next_ids(subscription, 1) == ["9999999999999-1"]
+    await subscription.aclose()
+
+async def test_subscriber_that_falls_behind_is_disconnected(fake_redis):
+    broadcaster = KitchenEventBroadcaster(queue_size=2)
+    subscription = broadcaster.subscribe()
+    first = asyncio.ensure_future(subscription.__anext__())
+    await asyncio.sleep(0.01)
+
+    for sequence in range(4):
+        broadcaster._broadcast((f"1-{sequence}", {"table_no": 1}))
+
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(first, timeout=1)
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from kitchen_commons.models.WaitressServiceModel import Menu, MenuItem
+from waitress_service.MenuCache import MenuCache
+
+pytestmark = pytest.mark.anyio
+
+
+def _menu(*names: str) -> Menu:
+    return Menu(items=[MenuItem(name=name, description="") for name in names])
+
+def _get_menu_names(menu_body: bytes) -> list[str]:
+    return [item["name"] for item in json.loads(menu_body)["items"]]
+
+class Upstream:
+    """Stands in for the inventory service, refilling Redis like WaitressServiceLogic.get_menu does."""
+
+    def __init__(self, redis_service, *names: str):
+        self.redis_service = redis_service
+        self.menu = _menu(*names)
+        self.calls = 0
+
+    async def fetch_menu(self) -> Menu:
+        self.calls += 1
+        (menu, version) = (self.menu, await self.redis_service.get_menu_version())
+        await asyncio.sleep(0.01)
+        await self.redis_service.set_menu_cache(menu, version)
+        return menu
+
+async def test_concurrent_misses_share_a_single_load(fake_redis):
+    upstream = Upstream(fake_redis, "Pizza")
+    menu_cache = MenuCache(upstream.fetch_menu, ttl_seconds=60, refresh_ahead_seconds=0)
+
+    bodies = await asyncio.gather(*(menu_cache.get() for _ in range(10)))
+
+    assert upstream.calls == 1
+    assert all(_get_menu_names(body) == ["Pizza"] for body in bodies)
+
+async def test_menu_is_served_from_redis_before_going_upstream(fake_redis):
+    await fake_redis.set_menu_cache(_menu("Soup"))
+    upstream = Upstream(fake_redis, "Pizza")
+
+    assert _get_menu_names(await MenuCache(upstream.fetch_menu).get()) == ["Soup"]
+    assert upstream.calls == 0
+
+async def test_newer_version_drops_the_local_copy(fake_redis):
+    upstream = Upstream(fake_redis, "Pizza")
+    menu_cache = MenuCache(upstream.fetch_menu, ttl_seconds=60, refresh_ahead_seconds=0)
+    (_, etag) = await menu_cache.get_with_etag()
+
+    # A version the local copy already has keeps it
+    menu_cache.invalidate(await fake_redis.get_menu_version())
+    await menu_cache.get()
+    assert upstream.calls == 1
+
+    upstream.menu = _menu("Pizza", "Soup")
+    menu_cache.invalidate(await fake_redis.invalidate_menu_cache())
+    (menu_body, new_etag) = await menu_cache.get_with_etag()
+
+    assert upstream.calls == 2
+    assert _get_menu_names(menu_body) == ["Pizza", "Soup"]
+    assert new_etag != etag
+
+async def test_menu_invalidated_while_fetched_is_not_cached(fake_redis):
+    upstream = Upstream(fake_redis, "Pizza")
+    fetch = asyncio.ensure_future(upstream.fetch_menu())
+    await asyncio.sleep(0.005)
+
+    await fake_redis.invalidate_menu_cache()
+    await fetch
+
+    assert await fake_redis.get_menu_cache_json() is None
+
+async def test_menu_loaded_during_an_invalidation_is_reloaded_on_the_next_call(fake_redis):
+    upstream = Upstream(fake_redis, "Pizza")
+    menu_cache = MenuCache(upstream.fetch_menu, ttl_seconds=60, refresh_ahead_seconds=0)
+    load = asyncio.ensure_future(menu_cache.get())
+    await asyncio.sleep(0.005)
+
+    upstream.menu = _menu("Pizza", "Soup")
+    menu_cache.invalidate(await fake_redis.invalidate_menu_cache())
+
+    assert _get_menu_names(await load) == ["Pizza"]
+    assert _get_menu_names(await menu_cache.get()) == ["Pizza", "Soup"]
+
+async def test_expired_menu_is_served_when_its_reload_fails(fake_redis):
+    upstream = Upstream(fake_redis, "Pizza")
+    menu_cache = MenuCache(upstream.fetch_menu, ttl_seconds=0, refresh_ahead_seconds=0)
+    menu_body = await menu_cache.get()
+
+    async def unavailable() -> Menu:
+        raise Exception("Inventory service unavailable")
+
+    menu_cache._fetch_menu = unavailable
+    await fake_redis.client.delete(fake_redis.MENU_CACHE_KEY)
+
+    assert await menu_cache.get() == menu_body
@@ -0,0 +1,48 @@
+import pytest
+
+from kitchen_commons.events.Events import DeadEvent, OrderPlaced
+from kitchen_commons.shared.Metrics import collect_stream_metrics, metrics
+
+pytestmark = pytest.mark.anyio
+
+
+async def _publish_orders(redis_service, count: int):
+    for order_id in range(1, count + 1):
+        await redis_service.publish_waitress_order_event(OrderPlaced(order_id=order_id, table_no=1, comments="", items=[{"Pizza": 1}]))
+
+async def test_stream_lag_of_binary_entries(fake_redis):
+    assert fake_redis.event_codec.name == "binary"
+    await _publish_orders(fake_redis, 3)
+    await fake_redis.create_waitress_order_consumer_group("kitchen_workers", "0-0")
+    await fake_redis.consume_waitress_order_event_group_batch("kitchen_workers", "worker", count=1)
+
+    lag = await fake_redis.get_stream_lag(fake_redis.WAITRESS_ORDER_EVENTS)
+
+    assert lag["length"] == 3
+    assert lag["consumers"]["kitchen_workers"]["pending"] == 1
+    assert lag["consumers"]["kitchen_workers"]["lag_seconds"] >= 0
+
+async def test_stream_lag_of_missing_stream(fake_redis):
+    assert await fake_redis.get_stream_lag(fake_redis.KITCHEN_ORDER_EVENTS) == {"length": 0, "consumers": {}}
+
+async def test_collect_stream_metrics_exports_binary_streams(fake_redis):
+    await _publish_orders(fake_redis, 2)
+    await fake_redis.publish_error_event(DeadEvent(order_id=1, table_no=1, comments="", message_id="1-0", original_message="{}", error="test"))
+
+    await collect_stream_metrics()
+    rendered = await metrics.render()
+
+    assert f'stream_length{{stream="{fake_redis.WAITRESS_ORDER_EVENTS}"}} 2' in rendered
+    assert "dead_event_queue_depth 1" in rendered
+
+async def test_failing_stream_does_not_block_queue_depths(fake_redis, monkeypatch):
+    async def failing_stream_lag(stream: str) -> dict:
+        raise UnicodeDecodeError("utf-8", b"\xa0", 0, 1, "invalid start byte")
+
+    monkeypatch.setattr(fake_redis, "get_stream_lag", failing_stream_lag)
+    await fake_redis.publish_error_event(DeadEvent(order_id=1, table_no=1, comments="", message_id="1-0", original_message="{}", error="test"))
+    await fake_redis.publish_error_event(DeadEvent(order_id=2, table_no=1, comments="", message_id="2-0", original_message="{}", error="test"))
+
+    await collect_stream_metrics()
+
+    assert "dead_event_queue_depth 2" in await metrics.render()
@@ -0,0 +1,97 @@
+import pytest
+
+from kitchen_commons.events.EventCodec import decode_event_fields
+from kitchen_commons.events.Events import DeadEvent, OrderPlaced
+from kitchen_commons.shared.StreamRetention import StreamRetention, iter_archived_entries, replay_archive
+
+pytestmark = pytest.mark.anyio
+
+GROUP = "kitchen_workers"
+
+
+async def _publish_orders(redis_service, count: int) -> list[str]:
+    for order_id in range(1, count + 1):
+        await redis_service.publish_waitress_order_event(OrderPlaced(order_id=order_id, table_no=1, comments="", items=[{"Pizza": 1}]))
+    return await _get_stream_ids(redis_service, redis_service.WAITRESS_ORDER_EVENTS)
+
+async def _consume_and_ack(redis_service, count: int):
+    messages = await redis_service.consume_waitress_order_event_group_batch(GROUP, "worker", count=count)
+    await redis_service.ack_waitress_order_events(GROUP, *(message_id for message_id, _ in messages))
+
+async def _get_stream_ids(redis_service, stream: str) -> list[str]:
+    return [message_id.decode() for message_id, _ in await redis_service.stream_client.xrange(stream)]
+
+async def test_only_entries_every_consumer_has_passed_are_archived_and_trimmed(fake_redis, tmp_path):
+    message_ids = await _publish_orders(fake_redis, 10)
+    await fake_redis.create_waitress_order_consumer_group(GROUP, "0-0")
+    await _consume_and_ack(fake_redis, 6)
+
+    await StreamRetention(archive_dir=str(tmp_path), max_age_seconds=0, max_length=2).apply_to_stream(fake_redis.WAITRESS_ORDER_EVENTS)
+
+    archived_ids = [message_id for message_id, _ in iter_archived_entries(fake_redis.WAITRESS_ORDER_EVENTS, str(tmp_path))]
+    assert archived_ids == message_ids[:6]
+    # Approximate trimming may leave archived entries behind, but never removes unconsumed ones
+    assert set(message_ids[6:]) <= set(await _get_stream_ids(fake_redis, fake_redis.WAITRESS_ORDER_EVENTS))
+
+async def test_pending_entries_are_kept(fake_redis, tmp_path):
+    message_ids = await _publish_orders(fake_redis, 5)
+    await fake_redis.create_waitress_order_consumer_group(GROUP, "0-0")
+    # Delivered but never acknowledged
+    await fake_redis.consume_waitress_order_event_group_batch(GROUP, "worker", count=5)
+
+    await StreamRetention(archive_dir=str(tmp_path), max_age_seconds=0, max_length=1).apply_to_stream(fake_redis.WAITRESS_ORDER_EVENTS)
+
+    assert await _get_stream_ids(fake_redis, fake_redis.WAITRESS_ORDER_EVENTS) == message_ids
+
+async def test_archived_entries_can_be_replayed(fake_redis, tmp_path):
+    message_ids = await _publish_orders(fake_redis, 4)
+    await fake_redis.create_waitress_order_consumer_group(GROUP, "0-0")
+    await _consume_and_ack(fake_redis, 4)
+    await StreamRetention(archive_dir=str(tmp_path), max_age_seconds=0, max_length=1).apply_to_stream(fake_redis.WAITRESS_ORDER_EVENTS)
+
+    replayed = [original_id async for original_id, _ in replay_archive(fake_redis.WAITRESS_ORDER_EVENTS, "replayed", str(tmp_path))]
+
+    assert replayed == message_ids[:3]
+    assert [decode_event_fields(message_data)["order_id"] for _, message_data in await fake_redis.stream_client.xrange("replayed")] == [1, 2, 3]
+
+async def _publish_dead_events(redis_service, count: int):
+    for order_id in range(1, count + 1):
+        await redis_service.publish_error_event(DeadEvent(order_id=order_id, table_no=1, comments="", message_id=f"{order_id}-0", original_message="{}", error="test"))
+
+async def test_dead_events_are_kept_by_default(fake_redis, tmp_path):
+    await _publish_dead_events(fake_redis, 5)
+
+    await StreamRetention(archive_dir=str(tmp_path), max_age_seconds=1, max_length=1).apply_to_stream(fake_redis.DEAD_EVENT_QUEUE)
+
+    assert await fake_redis.get_dead_event_queue_depth() == 5
+
+async def test_dead_events_are_trimmed_by_their_own_limits(fake_redis, tmp_path):
+    await _publish_dead_events(fake_redis, 5)
+
+    await StreamRetention(archive_dir=str(tmp_path), dead_event_max_age_seconds=0, dead_event_max_length=2).apply_to_stream(fake_redis.DEAD_EVENT_QUEUE)
+
+    assert len(list(iter_archived_entries(fake_redis.DEAD_EVENT_QUEUE, str(tmp_path)))) == 3
+
+async def test_run_is_skipped_while_another_replica_holds_the_lock(fake_redis, tmp_path):
+    await fake_redis.client.set(StreamRetention.LOCK_KEY, "other-replica")
+
+    assert await StreamRetention(archive_dir=str(tmp_path)).apply() == {}
+    assert await fake_redis.client.get(StreamRetention.LOCK_KEY) == "other-replica"
+
+async def test_lock_taken_over_during_a_run_is_not_released(fake_redis, tmp_path, monkeypatch):
+    stream_retention = StreamRetention(archive_dir=str(tmp_path))
+
+    async def outlive_the_lock(stream: str) -> int:
+        # The lock expired and another replica took it
+        await fake_redis.client.set(StreamRetention.LOCK_KEY, "other-replica")
+        return 0
+
+    monkeypatch.setattr(stream_retention, "apply_to_stream", outlive_the_lock)
+    await stream_retention.apply()
+
+    assert await fake_redis.client.get(StreamRetention.LOCK_KEY) == "other-replica"
+
+async def test_lock_is_released_after_a_run(fake_redis, tmp_path):
+    await StreamRetention(archive_dir=str(tmp_path)).apply()
+
+    assert await fake_redis.client.get(StreamRetention.LOCK_KEY) is None
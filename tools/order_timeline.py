@@ -0,0 +1,84 @@
+"""
+Prints per-order timelines from the span files the services export with tracing_export_path.
+
+The files of all services are merged by trace, so an order's timeline covers the waitress request, the time its
+event waited in the stream, the kitchen processing, the inventory call and the way back. Without --order-id, the
+slowest orders are printed, and --breakdown adds the p50/p99 duration of every kind of span across all orders.
+
+Usage: python -m tools.order_timeline FILE [FILE ...] [--order-id N] [--slowest N] [--breakdown]
+"""
+import argparse
+import json
+import statistics
+
+from kitchen_commons.shared.Tracing import build_timeline
+
+
+def _load_traces(paths: list[str]) -> dict[str, list[dict]]:
+    traces: dict[str, list[dict]] = {}
+
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    span = json.loads(line)
+                    traces.setdefault(span["trace_id"], []).append(span)
+
+    return traces
+
+def _get_depth(span: dict, spans_by_id: dict[str, dict]) -> int:
+    depth = 0
+    parent_id = span.get("parent_id")
+    while parent_id in spans_by_id and depth < 32:
+        depth += 1
+        parent_id = spans_by_id[parent_id].get("parent_id")
+    return depth
+
+def _print_timeline(timeline: dict):
+    print(f"order {timeline['order_id']}  trace {timeline['trace_id']}  total {timeline['duration_ms']:.3f} ms")
+
+    spans_by_id = {span["span_id"]: span for span in timeline["spans"]}
+    for span in timeline["spans"]:
+        indent = "  " * _get_depth(span, spans_by_id)
+        error = f"  error={span['error']}" if span.get("error") else ""
+        print(f"  +{span['offset_ms']:>10.3f} ms {span['duration_ms']:>10.3f} ms  {span.get('service') or '-':<9} {indent}{span['name']}{error}")
+    print()
+
+def _print_breakdown(timelines: list[dict]):
+    durations: dict[str, list[float]] = {}
+    for timeline in timelines:
+        for span in timeline["spans"]:
+            durations.setdefault(f"{span.get('service') or '-'} {span['name']}", []).append(span["duration_ms"])
+
+    print(f"{'span':<70} {'count':>7} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, values in sorted(durations.items(), key=lambda item: -statistics.median(item[1])):
+        values.sort()
+        print(f"{name[:70]:<70} {len(values):>7} {statistics.median(values):>10.3f} {values[max(int(len(values) * 0.99 + 0.5) - 1, 0)]:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="span files exported by the services")
+    parser.add_argument("--order-id", type=int, help="print the timeline of this order only")
+    parser.add_argument("--slowest", type=int, default=10, help="number of slowest orders to print")
+    parser.add_argument("--breakdown", action="store_true", help="print span durations across all orders")
+    args = parser.parse_args()
+
+    timelines = [timeline for timeline in map(build_timeline, _load_traces(args.files).values()) if timeline.get("order_id") is not None]
+
+    if args.order_id is not None:
+        timelines = [timeline for timeline in timelines if timeline["order_id"] == args.order_id]
+        if not timelines:
+            parser.exit(1, f"No spans found for order {args.order_id}\n")
+        for timeline in timelines:
+            _print_timeline(timeline)
+        return
+
+    print(f"{len(timelines)} orders traced\n")
+    for timeline in sorted(timelines, key=lambda timeline: -timeline["duration_ms"])[:args.slowest]:
+        _print_timeline(timeline)
+
+    if args.breakdown:
+        _print_breakdown(timelines)
+
+if __name__ == "__main__":
+    main()
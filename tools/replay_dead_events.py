@@ -0,0 +1,62 @@
+"""
+Replays dead events back into the waitress order stream.
+
+Every DeadEvent in the dead event queue holds the original message. Replaying adds that message to the waitress
+order stream as a new entry with a fresh retry budget. Use --dry-run to only list the dead events, and --delete
+to remove replayed events from the dead event queue.
+
+Usage: python -m tools.replay_dead_events [--order-id ID ...] [--after-id ID] [--limit N] [--delete] [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+
+from kitchen_commons.events.Events import DeadEvent
+from kitchen_commons.shared.Lifecycle import shutdown_redis
+from kitchen_commons.shared.RedisService import redis_service
+
+
+async def _replay(args: argparse.Namespace):
+    last_id = args.after_id
+    replayed = 0
+
+    try:
+        while replayed < args.limit:
+            messages = await redis_service.get_dead_events_after(last_id, count=100)
+            if not messages:
+                break
+
+            for message_id, message_data in messages:
+                last_id = message_id
+                dead_event = DeadEvent.model_validate(message_data)
+
+                if args.order_id and dead_event.order_id not in args.order_id:
+                    continue
+
+                print(f"{message_id} order_id={dead_event.order_id} original_message_id={dead_event.message_id} error={dead_event.error}")
+
+                if not args.dry_run:
+                    new_id = await redis_service.republish_waitress_order_message(json.loads(dead_event.original_message))
+                    print(f"  replayed as {new_id}")
+                    if args.delete:
+                        await redis_service.delete_dead_events(message_id)
+
+                replayed += 1
+                if replayed >= args.limit:
+                    break
+
+        print(f"{'Found' if args.dry_run else 'Replayed'} {replayed} dead events")
+    finally:
+        await shutdown_redis()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--order-id", type=int, action="append", help="only replay dead events of this order, can be repeated")
+    parser.add_argument("--after-id", default="0-0", help="only replay dead events after this ID")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--delete", action="store_true", help="delete replayed events from the dead event queue")
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(_replay(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
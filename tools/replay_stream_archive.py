@@ -0,0 +1,43 @@
+"""
+Replays archived stream entries back into Redis.
+
+Entries are read from the gzip segment files written by the stream retention task and appended to the
+target stream (the original stream by default) with new IDs. Use --dry-run to only list what would be replayed.
+
+Usage: python -m tools.replay_stream_archive STREAM [--target-stream NAME] [--archive-dir DIR] [--after-id ID] [--dry-run]
+"""
+import argparse
+import asyncio
+
+from kitchen_commons.events.EventCodec import decode_event_fields
+from kitchen_commons.shared.Lifecycle import shutdown_redis
+from kitchen_commons.shared.StreamRetention import iter_archived_entries, replay_archive
+
+
+async def _replay(args: argparse.Namespace):
+    try:
+        if args.dry_run:
+            for message_id, fields in iter_archived_entries(args.stream, args.archive_dir, args.after_id):
+                print(message_id, decode_event_fields(fields))
+            return
+
+        replayed = 0
+        async for message_id, new_id in replay_archive(args.stream, args.target_stream, args.archive_dir, args.after_id):
+            print(f"{message_id} -> {new_id}")
+            replayed += 1
+
+        print(f"Replayed {replayed} entries")
+    finally:
+        await shutdown_redis()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stream", help="name of the archived stream, e.g. waitress_order_events")
+    parser.add_argument("--target-stream", default=None, help="stream to append to, defaults to the archived stream")
+    parser.add_argument("--archive-dir", default=None, help="defaults to the stream_archive_dir setting")
+    parser.add_argument("--after-id", default="0-0", help="only replay entries archived after this ID")
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(_replay(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Creates or migrates an inventory database and seeds it with a synthetic catalog.
+
+The schema is brought up to date with the inventory migrations, then the catalog is replaced with RECIPES generated
+recipes (use --append to keep the existing rows). Use --explain to print the query plans of the repository's hot
+path queries and time them against the seeded catalog.
+
+Usage: python -m tools.seed_inventory_db [--db PATH] [--recipes N] [--ingridients N] [--ingridients-per-recipe N] [--qty N] [--seed N] [--append] [--explain] [--samples N]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import aiosqlite
+
+from inventory_service.Repository.CatalogSeeder import ingridient_name, recipe_name, seed_catalog
+from inventory_service.Repository.InventoryMigrations import apply_migrations
+from inventory_service.Repository.InventoryRepository import InventoryRepository
+
+
+def _get_hot_path_queries(args: argparse.Namespace, rng: random.Random) -> dict[str, tuple[str, list]]:
+    """Returns the repository's hot path queries, with parameters picked at random from the seeded catalog."""
+    recipes = [recipe_name(rng.randrange(args.recipes)) for _ in range(10)]
+    ingridients = [ingridient_name(rng.randrange(args.ingridients)) for _ in range(10)]
+
+    return {
+        "recipe availability": (InventoryRepository._RECIPE_AVAILABILITY_QUERY, [1, recipes[0]]),
+        "recipes availability (10)": (
+            InventoryRepository._RECIPES_AVAILABILITY_QUERY.format(values=", ".join(["(?, ?, ?)"] * len(recipes))),
+            [param for position, name in enumerate(recipes) for param in (position, name, 1)]
+        ),
+        "recipe ingredients": ("SELECT name, requiredQty FROM recipeingridient WHERE recipe = ?", [recipes[0]]),
+        "recipes ingredients (10)": (f"SELECT recipe, name, requiredQty FROM recipeingridient WHERE recipe IN ({', '.join(['?'] * len(recipes))})", recipes),
+        "supply level": ("SELECT qty FROM supplies WHERE name = ?", [ingridients[0]]),
+        "supply levels (10)": (f"SELECT name, qty FROM supplies WHERE name IN ({', '.join(['?'] * len(ingridients))})", ingridients),
+    }
+
+async def _explain(conn: aiosqlite.Connection, args: argparse.Namespace):
+    rng = random.Random(args.seed)
+
+    for name, (query, params) in _get_hot_path_queries(args, rng).items():
+        async with conn.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+            plan = [row[-1] for row in await cursor.fetchall()]
+
+        latencies = []
+        for _ in range(args.samples):
+            (query, params) = _get_hot_path_queries(args, rng)[name]
+            started = time.perf_counter()
+            async with conn.execute(query, params) as cursor:
+                await cursor.fetchall()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        latencies.sort()
+        print(f"{name}: p50={statistics.median(latencies):.3f}ms p99={latencies[int(len(latencies) * 0.99) - 1]:.3f}ms")
+        for step in plan:
+            print(f"    {step}")
+
+async def _seed(args: argparse.Namespace):
+    async with aiosqlite.connect(args.db) as conn:
+        version = await apply_migrations(conn)
+        print(f"Schema at version {version}")
+
+        started = time.perf_counter()
+        await seed_catalog(conn, args.recipes, args.ingridients, args.ingridients_per_recipe, args.qty, args.seed, replace=not args.append)
+        print(f"Seeded {args.recipes} recipes and {args.ingridients} ingredients in {time.perf_counter() - started:.1f}s")
+
+        if args.explain:
+            await _explain(conn, args)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=InventoryRepository._DB_PATH, help="database file, created when missing")
+    parser.add_argument("--recipes", type=int, default=10000)
+    parser.add_argument("--ingridients", type=int, default=1000)
+    parser.add_argument("--ingridients-per-recipe", type=int, default=5)
+    parser.add_argument("--qty", type=int, default=1_000_000, help="stocked quantity of every ingredient")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--append", action="store_true", help="keep the existing catalog")
+    parser.add_argument("--explain", action="store_true", help="print query plans and latencies of the hot path queries")
+    parser.add_argument("--samples", type=int, default=1000, help="executions timed per query with --explain")
+    asyncio.run(_seed(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
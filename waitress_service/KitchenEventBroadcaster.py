@@ -0,0 +1,151 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+import redis
+
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.Settings import settings
+
+
+def _stream_id_key(message_id: str) -> tuple[int, int]:
+    (milliseconds, sequence) = message_id.split("-")
+    return (int(milliseconds), int(sequence))
+
+
+class KitchenEventBroadcaster:
+    """
+    Tails the kitchen order stream once per process and fans every event out to the connected clients.
+    Subscribers can limit themselves to a set of tables, events are then routed to them by table number
+    so a subscriber never sees, or pays for, other tables' traffic. Each subscriber has its own bounded queue. A subscriber that falls too far behind is disconnected
+    and expected to reconnect with the ID of the last event it received.
+    """
+
+    # Put on a subscriber queue when the subscriber was dropped for being too slow
+    _OVERFLOW = None
+
+    _READ_BATCH_SIZE = 100
+
+    def __init__(self, queue_size: Optional[int] = None):
+        self._queue_size = queue_size if queue_size is not None else settings.kitchen_stream_subscriber_queue_size
+        # Subscribers that want every event, and subscribers keyed by the tables they follow
+        self._subscribers: set[asyncio.Queue] = set()
+        self._table_subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def subscribe(self, last_event_id: Optional[str] = None, heartbeat_seconds: Optional[float] = None, tables: Optional[set[int]] = None) -> AsyncIterator[Optional[tuple[str, dict]]]:
+        """
+        Yields (message_id, message_data) for every kitchen event, starting after last_event_id when given.
+        When tables is given, only events of those tables are yielded.
+        When heartbeat_seconds is set, None is yielded after that many idle seconds so callers can keep the connection alive.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        # Live events are queued before the replay starts, so nothing published in between is lost
+        self._add_subscriber(queue, tables)
+
+        try:
+            # Live events up to the client's last ID were already sent before it reconnected
+            replayed_id = last_event_id or None
+
+            if last_event_id:
+                async for message_id, message_data in self._replay(last_event_id):
+                    replayed_id = message_id
+                    if tables is None or self._get_table_no(message_data) in tables:
+                        yield (message_id, message_data)
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+
+                if item is self._OVERFLOW:
+                    logger.warning("Kitchen event subscriber fell behind, disconnecting it")
+                    return
+
+                (message_id, message_data) = item
+
+                # Already sent during the replay
+                if replayed_id is not None and _stream_id_key(message_id) <= _stream_id_key(replayed_id):
+                    continue
+
+                yield (message_id, message_data)
+        finally:
+            self._remove_subscriber(queue)
+
+    def _add_subscriber(self, queue: asyncio.Queue, tables: Optional[set[int]]):
+        if tables is None:
+            self._subscribers.add(queue)
+            return
+
+        for table_no in tables:
+            self._table_subscribers.setdefault(table_no, set()).add(queue)
+
+    def _remove_subscriber(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+        for table_no in [table_no for table_no, queues in self._table_subscribers.items() if queue in queues]:
+            self._table_subscribers[table_no].discard(queue)
+            if not self._table_subscribers[table_no]:
+                del self._table_subscribers[table_no]
+
+    def _get_table_no(self, message_data: dict) -> Optional[int]:
+        try:
+            return int(message_data.get('table_no', ''))
+        except ValueError:
+            return None
+
+    async def _replay(self, last_event_id: str) -> AsyncIterator[tuple[str, dict]]:
+        while True:
+            messages = await redis_service.get_kitchen_order_events_after(last_event_id, count=self._READ_BATCH_SIZE)
+
+            for message_id, message_data in messages:
+                last_event_id = message_id
+                yield (message_id, message_data)
+
+            if len(messages) < self._READ_BATCH_SIZE:
+                return
+
+    async def _tail(self):
+        last_id = await redis_service.get_kitchen_order_events_tail_id()
+
+        logger.info("Tailing kitchen order events", last_id=last_id)
+
+        while True:
+            try:
+                messages = await redis_service.consume_kitchen_order_event_batch(last_id, count=self._READ_BATCH_SIZE, block=settings.kitchen_stream_heartbeat_seconds * 1000)
+
+                for message_id, message_data in messages:
+                    last_id = message_id
+                    self._broadcast((message_id, message_data))
+
+            except redis.ConnectionError as e:
+                logger.error("Redis connection error", error=str(e))
+                await asyncio.sleep(5)  # Wait before retrying
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error tailing kitchen order events", error=str(e))
+                await asyncio.sleep(1)
+
+    def _broadcast(self, item: tuple[str, dict]):
+        (_, message_data) = item
+        table_queues = self._table_subscribers.get(self._get_table_no(message_data), set()) # type: ignore
+
+        for queue in [*self._subscribers, *table_queues]:
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._remove_subscriber(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._OVERFLOW)
@@ -0,0 +1,112 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from kitchen_commons.models.WaitressServiceModel import Menu
+from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.RedisService import redis_service
+from kitchen_commons.shared.Settings import settings
+from kitchen_commons.shared.HTTPCaching import compute_etag
+
+
+class MenuCache:
+    """
+    Per-process (L1) menu cache in front of the shared Redis menu cache.
+    It keeps the menu as pre-serialized JSON bytes, refreshes it in the background shortly before
+    it expires (stale-while-revalidate) and collapses concurrent misses into a single load (single-flight).
+    The local copy is dropped as soon as a newer menu version is announced over Redis pub/sub.
+    """
+
+    def __init__(self, fetch_menu: Callable[[], Awaitable[Menu]], ttl_seconds: Optional[int] = None, refresh_ahead_seconds: Optional[int] = None):
+        # Called when the menu is missing from Redis, expected to fetch it upstream and refill Redis
+        self._fetch_menu = fetch_menu
+        self._ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.menu_l1_ttl_seconds
+        self._refresh_ahead_seconds = refresh_ahead_seconds if refresh_ahead_seconds is not None else settings.menu_l1_refresh_ahead_seconds
+
+        self._body: Optional[bytes] = None
+        self._etag = ""
+        self._body_version = 0
+        self._latest_version = 0
+        self._expires_at = 0.0
+        self._load_task: Optional[asyncio.Task[tuple[bytes, str]]] = None
+
+    async def get(self) -> bytes:
+        """Returns the menu as JSON bytes, loading it only if there is no fresh copy in the process."""
+        (body, _) = await self.get_with_etag()
+        return body
+
+    async def get_with_etag(self) -> tuple[bytes, str]:
+        """Returns the menu as JSON bytes together with its ETag, which is computed once per load."""
+        now = asyncio.get_running_loop().time()
+
+        if self._body is not None and now < self._expires_at:
+            if now >= self._expires_at - self._refresh_ahead_seconds:
+                # Still fresh enough to serve, reload in the background so callers never wait
+                self._start_load()
+            return (self._body, self._etag)
+
+        try:
+            return await asyncio.shield(self._start_load())
+        except Exception as e:
+            if self._body is None:
+                raise
+            logger.warning("Menu reload failed, serving stale menu", error=str(e))
+            return (self._body, self._etag)
+
+    def invalidate(self, version: Optional[int] = None):
+        """
+        Drops the local copy, the next call to get loads the menu again.
+        When a version is given, the copy is only dropped if it is older than that version.
+        """
+        if version is not None:
+            self._latest_version = max(self._latest_version, version)
+            if self._body_version >= self._latest_version:
+                return
+
+        self._body = None
+        self._expires_at = 0.0
+        logger.info("Local menu cache invalidated", version=version)
+
+    async def listen_for_invalidations(self):
+        """Drops the local copy whenever the menu version changes, meant to run as a background task."""
+        while True:
+            try:
+                async for version in redis_service.listen_menu_invalidations():
+                    self.invalidate(version)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Menu invalidation subscription failed, resubscribing", error=str(e))
+                await asyncio.sleep(5)
+
+    def _start_load(self) -> asyncio.Task[tuple[bytes, str]]:
+        # Every caller that needs a load while one is in flight shares the same task
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.create_task(self._load())
+            self._load_task.add_done_callback(self._log_load_failure)
+        return self._load_task
+
+    async def _load(self) -> tuple[bytes, str]:
+        # The version is read first, so a menu invalidated while loading ends up older than the announced version
+        version = await redis_service.get_menu_version()
+        cached_menu = await redis_service.get_menu_cache_json()
+
+        if cached_menu is not None:
+            body = cached_menu.encode()
+        else:
+            menu = await self._fetch_menu()
+            body = menu.model_dump_json().encode()
+
+        # Unchanged content keeps its ETag, so clients holding it still get 304s after a reload
+        if body != self._body:
+            self._etag = compute_etag(body)
+        self._body = body
+        self._body_version = version
+        # A load that raced with an invalidation is served once but reloaded on the next call
+        self._expires_at = asyncio.get_running_loop().time() + self._ttl_seconds if version >= self._latest_version else 0.0
+
+        logger.info("Local menu cache loaded", size=len(body), version=version, etag=self._etag, from_redis=cached_menu is not None)
+        return (body, self._etag)
+
+    def _log_load_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Error loading menu into local cache", error=str(task.exception()))
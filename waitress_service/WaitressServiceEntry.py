@@ -1,20 +1,32 @@
+import asyncio
+import re
 from contextlib import asynccontextmanager
 
 from kitchen_commons.events.Events import OrderCanceled, OrderPlaced, OrderReady
 from kitchen_commons.models.WaitressServiceModel import KitchenOrderResponse, PlaceOrderRequest, PlaceOrderResponse, Menu
 from kitchen_commons.shared.Settings import settings
 from kitchen_commons.shared.Logging import logger
+from kitchen_commons.shared.Metrics import MetricsMiddleware
+from kitchen_commons.shared.Tracing import TracingMiddleware
 from kitchen_commons.shared.Lifecycle import startup_http_client, startup_redis, shutdown_redis, shutdown_http_client
 from kitchen_commons.shared.RedisService import redis_service   
+from kitchen_commons.shared.HTTPCaching import etag_matches
 #import os
 #import sys
 
 #sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from waitress_service.WaitressServiceLogic import WaitressServiceLogic
+from waitress_service.MenuCache import MenuCache
+from waitress_service.KitchenEventBroadcaster import KitchenEventBroadcaster
 
 service_logic = WaitressServiceLogic()
+menu_cache = MenuCache(service_logic.get_menu)
+kitchen_event_broadcaster = KitchenEventBroadcaster()
+
+STREAM_ID_PATTERN = re.compile(r"^\d+-\d+$")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):   
@@ -26,10 +38,14 @@ async def lifespan(app: FastAPI):
     await startup_http_client()
     await startup_redis()
 
-    await service_logic.get_menu()
+    await menu_cache.get()
+    menu_invalidation_task = asyncio.create_task(menu_cache.listen_for_invalidations())
+    kitchen_event_broadcaster.start()
 
     yield
 
+    menu_invalidation_task.cancel()
+    await kitchen_event_broadcaster.stop()
     await shutdown_http_client()
     await shutdown_redis()
 
@@ -38,36 +54,30 @@ async def lifespan(app: FastAPI):
     logger.info("########################################################################")
 
 app = FastAPI(title="Waitress service", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware, service="waitress")
 
 @app.get("/menu", response_model=Menu, status_code=status.HTTP_200_OK)
-async def show_menu():
+async def show_menu(if_none_match: str | None = Header(default=None)):
 
     logger.info("Menu endpoint called")
 
-    menu_items = await redis_service.get_menu_cache()
-
-    logger.info("Menu items cache retrieved", menu_items=menu_items)
+    # The menu is served as pre-serialized JSON from the local cache, Redis and the inventory service are only hit on reload
+    (menu_body, etag) = await menu_cache.get_with_etag()
 
-    if menu_items:
-        return menu_items
-    else:
-        await service_logic.get_menu()
-        menu_items = await redis_service.get_menu_cache()
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
-        logger.info("Menu items cache retrieved after fetching from inventory service", menu_items=menu_items)
-        
-        if menu_items:
-            return menu_items
-        else:
-            return Menu(items=[])
+    return Response(content=menu_body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.post("/place-order", response_model=PlaceOrderResponse, status_code=status.HTTP_201_CREATED)
 async def place_order(orders: PlaceOrderRequest):
     logger.info("Order placed", orders=orders)
 
-    orderPlacedEvent = OrderPlaced(comments=orders.comments, table_no=orders.table_no, order_id= await redis_service.generate_new_id("event_id_counter"), items=[item for item in orders.items])
+    # The order_id is allocated by place_order
+    orderPlacedEvent = OrderPlaced(comments=orders.comments, table_no=orders.table_no, order_id=0, items=[item for item in orders.items])
 
-    await service_logic.place_order(orderPlacedEvent)
+    orderPlacedEvent = await service_logic.place_order(orderPlacedEvent)
 
     return PlaceOrderResponse(order_id=orderPlacedEvent.order_id)
 
@@ -91,4 +101,64 @@ async def consume_kitchen_order():
         logger.warning("No new kitchen orders to consume")
         raise HTTPException(status_code=404, detail="No new kitchen orders")
 
+@app.get("/kitchen-orders/stream", status_code=status.HTTP_200_OK)
+async def stream_kitchen_orders(last_event_id: str | None = Header(default=None), table_no: list[int] | None = Query(default=None)):
+    """
+    Server-Sent Events stream of kitchen orders, limited to the given tables when table_no is set.
+    Every event carries its stream ID, so a reconnecting client resumes with the standard Last-Event-ID header.
+    """
+    if last_event_id and not STREAM_ID_PATTERN.match(last_event_id):
+        raise HTTPException(status_code=400, detail="Invalid last event ID")
+
+    logger.info("Kitchen order stream opened", last_event_id=last_event_id, tables=table_no)
+
+    async def event_stream():
+        async for event in kitchen_event_broadcaster.subscribe(last_event_id, settings.kitchen_stream_heartbeat_seconds, set(table_no) if table_no else None):
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+
+            (message_id, message_data) = event
+
+            try:
+                kitchen_order = service_logic.to_kitchen_order_response(service_logic.parse_kitchen_event(message_data))
+            except Exception as e:
+                logger.error("Skipping kitchen event", message_id=message_id, error=str(e))
+                continue
+
+            yield f"id: {message_id}\nevent: {kitchen_order.status}\ndata: {kitchen_order.model_dump_json()}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/kitchen-orders/ws")
+async def kitchen_orders_websocket(websocket: WebSocket, last_event_id: str | None = None, table_no: list[int] | None = Query(default=None)):
+    """WebSocket stream of kitchen orders, limited to the given tables when table_no is set and resumable with the last_event_id query parameter."""
+    if last_event_id and not STREAM_ID_PATTERN.match(last_event_id):
+        await websocket.close(code=1008, reason="Invalid last event ID")
+        return
+
+    await websocket.accept()
+
+    logger.info("Kitchen order websocket opened", last_event_id=last_event_id, tables=table_no)
+
+    try:
+        async for event in kitchen_event_broadcaster.subscribe(last_event_id, settings.kitchen_stream_heartbeat_seconds, set(table_no) if table_no else None):
+            if event is None:
+                await websocket.send_json({"event": "heartbeat"})
+                continue
+
+            (message_id, message_data) = event
+
+            try:
+                kitchen_order = service_logic.to_kitchen_order_response(service_logic.parse_kitchen_event(message_data))
+            except Exception as e:
+                logger.error("Skipping kitchen event", message_id=message_id, error=str(e))
+                continue
+
+            await websocket.send_json({"id": message_id, "event": kitchen_order.status, "data": kitchen_order.model_dump()})
+
+        # The subscriber fell behind, the client reconnects with the last ID it received
+        await websocket.close(code=1013, reason="Subscriber fell behind")
+    except WebSocketDisconnect:
+        logger.info("Kitchen order websocket closed")
 
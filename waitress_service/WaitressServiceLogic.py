@@ -1,65 +1,116 @@
 import asyncio
+import json
 import httpx
 
 from pydantic import BaseModel
 
-from kitchen_commons.models.WaitressServiceModel import Menu
+from kitchen_commons.models.WaitressServiceModel import KitchenOrderResponse, Menu
 from kitchen_commons.shared.Settings import settings
 from kitchen_commons.shared.Logging import logger
 from kitchen_commons.shared.RedisService import redis_service
-from kitchen_commons.events.Events import OrderCanceled, OrderPlaced, OrderReady
+from kitchen_commons.events.Events import DeadEvent, OrderCanceled, OrderPlaced, OrderReady
+from kitchen_commons.events.EventCodec import UNDECODABLE_FIELDS
 from kitchen_commons.shared.APIRequest import APIRequest
+from kitchen_commons.shared.CircuitBreaker import CircuitOpenError
+from kitchen_commons.shared.IdAllocator import IdAllocator
+from kitchen_commons.shared.Tracing import consume_span
 
 
 class WaitressServiceLogic:
 
-    async def get_menu(self):
+    def __init__(self):
+        # Last menu fetched from the inventory service, revalidated with its ETag
+        self._menu: Menu | None = None
+        self._menu_etag: str | None = None
+        self._order_id_allocator = IdAllocator(redis_service.ORDER_ID_COUNTER_KEY) if settings.order_id_block_size > 1 else None
+
+    async def get_menu(self) -> Menu:
 
         logger.info("Fetching menu items...")
 
         URL = settings.inventory_service_url + "/menu"
 
-        api_request = APIRequest(APIRequest.Method.GET, URL)
+        headers = {"If-None-Match": self._menu_etag} if self._menu is not None and self._menu_etag else None
+
+        api_request = APIRequest(APIRequest.Method.GET, URL, headers=headers)
 
         try:
+            # Read before fetching, a menu invalidated in the meantime is returned but not cached in Redis
+            version = await redis_service.get_menu_version()
             response = await api_request.sendRequest()
-            result = Menu.model_validate(response.json())
-            logger.info("Menu items fetched successfully", menu_items=result)
-            await redis_service.set_menu_cache(result)
-            return  # Exit the function if successful
-        except httpx.HTTPError as e:
+
+            if response.status_code == httpx.codes.NOT_MODIFIED and self._menu is not None:
+                result = self._menu
+                logger.info("Menu items not modified", etag=self._menu_etag)
+            else:
+                result = Menu.model_validate(response.json())
+                self._menu = result
+                self._menu_etag = response.headers.get("ETag")
+                logger.info("Menu items fetched successfully", item_count=len(result.items), etag=self._menu_etag)
+
+            await redis_service.set_menu_cache(result, version)
+            return result
+        except (httpx.HTTPError, CircuitOpenError) as e:
             logger.error("API request failed permanently", error=str(e))
             raise Exception("Inventory service unavailable") from e
 
 
 
-    async def place_order(self, orderPlacedEvent: OrderPlaced):
-        logger.info("Placing order", order_id=orderPlacedEvent.order_id, table_no=orderPlacedEvent.table_no, items=orderPlacedEvent.items)
-        await redis_service.publish_waitress_order_event(orderPlacedEvent) # type: ignore
+    async def place_order(self, orderPlacedEvent: OrderPlaced) -> OrderPlaced:
+        """Publishes the order under a newly allocated order_id, the order_id of the given event is ignored."""
+        logger.info("Placing order", table_no=orderPlacedEvent.table_no, items=orderPlacedEvent.items)
 
-    async def consume_kitchen_order(self) ->  OrderReady | OrderCanceled | None:
-        logger.info("Consuming kitchen order event...")
-        last_kitchen_message_id = await redis_service.get_last_kitchen_message_id()
+        if self._order_id_allocator is None:
+            # Allocating the order_id and publishing the event is a single round trip to Redis
+            return await redis_service.publish_waitress_order_event_with_new_id(orderPlacedEvent, redis_service.ORDER_ID_COUNTER_KEY) # type: ignore
 
-        message_id, message_data = await redis_service.consume_kitchen_order_event(last_kitchen_message_id) or (None, None)
+        # The order_id usually comes from a block reserved ahead of time, leaving only the publish on the request path
+        orderPlacedEvent = orderPlacedEvent.model_copy(update={"order_id": await self._order_id_allocator.next_id()})
+        await redis_service.publish_waitress_order_event(orderPlacedEvent)
+        return orderPlacedEvent
 
-        if message_id and message_data:
-            logger.info("Consumed kitchen order event", message_id=message_id, message_data=message_data)
-
-            match message_data.get('event_type'):
-                case 'OrderReady':
-                    logger.info("Consuming kitchen's OrderReady event", order_id=message_data.get('order_id'))
-                    kitchen_event = OrderReady.model_validate(message_data)
-                case 'OrderCanceled':
-                    logger.info("Consuming kitchen's OrderCanceled event", order_id=message_data.get('order_id'))
-                    kitchen_event = OrderCanceled.model_validate(message_data)
-                case default:
-                    logger.error("Unknown event type", event_type=message_data.get('event_type'))
-                    raise Exception(f"Unknown event type: {message_data.get('event_type')}")    
-
-            await redis_service.set_last_kitchen_message_id(message_id)
+    async def consume_kitchen_order(self) ->  OrderReady | OrderCanceled | None:
+        logger.info("Consuming kitchen order event...")
 
-            return kitchen_event
+        # Reading after the stored offset and advancing it is a single round trip to Redis
+        messages = await redis_service.consume_next_kitchen_order_events(count=1)
+
+        if messages:
+            (message_id, message_data) = messages[0]
+
+            # The offset has already moved past the entry, the dead event keeps its raw fields
+            if UNDECODABLE_FIELDS in message_data:
+                await redis_service.publish_error_event(DeadEvent(
+                    order_id=0,
+                    table_no=0,
+                    comments="Moved to DLQ, message can't be decoded",
+                    message_id=message_id,
+                    original_message=json.dumps(message_data),
+                    error=message_data.get('decode_error', '')
+                ))
+                logger.error("Message moved to DLQ", message_id=message_id)
+                return None
+
+            # Closes the order's trace with the time the kitchen event waited to be read
+            with consume_span(f"consume {message_data.get('event_type')}", redis_service.KITCHEN_ORDER_EVENTS, message_data, service="waitress"):
+                logger.info("Consumed kitchen order event", message_id=message_id, message_data=message_data)
+                return self.parse_kitchen_event(message_data)
         else:
             logger.error("No new kitchen order events to consume")
-            return None
\ No newline at end of file
+            return None
+
+    def parse_kitchen_event(self, message_data: dict) -> OrderReady | OrderCanceled:
+        match message_data.get('event_type'):
+            case 'OrderReady':
+                logger.info("Consuming kitchen's OrderReady event", order_id=message_data.get('order_id'))
+                return OrderReady.model_validate(message_data)
+            case 'OrderCanceled':
+                logger.info("Consuming kitchen's OrderCanceled event", order_id=message_data.get('order_id'))
+                return OrderCanceled.model_validate(message_data)
+            case default:
+                logger.error("Unknown event type", event_type=message_data.get('event_type'))
+                raise Exception(f"Unknown event type: {message_data.get('event_type')}")
+
+    def to_kitchen_order_response(self, kitchen_event: OrderReady | OrderCanceled) -> KitchenOrderResponse:
+        status = "Ready" if isinstance(kitchen_event, OrderReady) else "Canceled"
+        return KitchenOrderResponse(order_id=kitchen_event.order_id, status=status, comments=kitchen_event.comments)